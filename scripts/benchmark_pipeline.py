@@ -0,0 +1,216 @@
+#!/usr/bin/env
+
+import os
+import sys
+import json
+import math
+import time
+import types
+import subprocess
+import importlib.util
+import profiling
+import storage
+from synthetic_data import generate_inputs, read_manifest
+
+# usage: python benchmark_pipeline.py <work directory> [scale factors]
+# e.g. python benchmark_pipeline.py /tmp/psc_benchmark 1 10 100
+# generates synthetic inputs for each scale factor (see synthetic_data.py)
+# under the work directory, reusing them on later runs, and runs both
+# scripts against them. Prints the time of each profiled function across
+# the scales and how it grows with the input, results are saved in the work
+# directory and compared with the previous results there
+
+DEFAULT_SCALES = [1, 10, 100]
+SEED = 0
+SCRIPTS = ['process_company_data', 'neo4j_transform_load']
+# deepest calls shown in the tables, the results file has them all
+SUMMARY_DEPTH = 1
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'run':
+        run_script(*sys.argv[2:5])
+        return
+    directory = sys.argv[1]
+    scales = [float(x) for x in sys.argv[2:]] or DEFAULT_SCALES
+    previous = read_previous_results(directory)
+    started = time.strftime('%Y%m%d-%H%M%S')
+    results = {'started': started, 'seed': SEED, 'scales': {}}
+    for scale in scales:
+        results['scales']['{:g}'.format(scale)] = benchmark_scale(
+            directory, scale)
+    path = os.path.join(directory, 'results_{}.json'.format(started))
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Wrote benchmark results to {}'.format(path))
+    print_scaling(results)
+    if previous is not None:
+        print_changes(results, previous)
+
+
+def benchmark_scale(directory, scale):
+    data_directory = os.path.join(directory, '{:g}x'.format(scale))
+    manifest = read_manifest(data_directory)
+    if manifest is None or (manifest['scale'], manifest['seed']) != (scale,
+                                                                   SEED):
+        generate_inputs(data_directory, scale, SEED)
+        manifest = read_manifest(data_directory)
+    output = {'rows': manifest['rows']}
+    for script_name in SCRIPTS:
+        output[script_name] = benchmark_script(script_name, data_directory)
+    return output
+
+
+def benchmark_script(script_name, data_directory):
+    # each script runs in its own process so peak memory is its own, the
+    # script's output goes to a log next to its profiling report
+    report_directory = os.path.join(
+        data_directory, 'profiles', '{}_{}'.format(
+            script_name, time.strftime('%Y%m%d-%H%M%S')))
+    os.makedirs(report_directory)
+    log_path = os.path.join(report_directory, 'output.log')
+    print('Running {} on {}...'.format(script_name, data_directory))
+    with open(log_path, 'w') as log:
+        return_code = subprocess.call(
+            [
+                sys.executable,
+                os.path.abspath(__file__), 'run', script_name,
+                data_directory, report_directory
+            ],
+            stdout=log,
+            stderr=subprocess.STDOUT)
+    reports = [x for x in os.listdir(report_directory) if x.endswith('.json')]
+    if return_code != 0:
+        print('{} failed, see {}'.format(script_name, log_path))
+    if not reports:
+        return {'failed': True}
+    with open(os.path.join(report_directory, reports[0])) as f:
+        report = json.load(f)
+    return {
+        'failed': return_code != 0,
+        'wall_seconds': report['wall_seconds'],
+        # stages may run in their own processes
+        'peak_rss_mb': max(report['peak_rss_mb'],
+                           report.get('peak_child_rss_mb', 0)),
+        'functions': profiling.summarise_calls(report['calls'])
+    }
+
+
+def run_script(script_name, data_directory, report_directory):
+    # the scripts create their storage and Neo4j clients on import, so the
+    # local storage backend is chosen and a stand-in ignoring the graph put
+    # in place first. Only the node and edge CSVs of neo4j_transform_load
+    # are benchmarked, loading them needs a Neo4j server so is skipped
+    storage.STORAGE_BACKEND = 'local'
+    storage.LOCAL_STORAGE_ROOT = data_directory
+    sys.modules['py2neo'] = types.SimpleNamespace(
+        Graph=lambda *args, **kwargs: None, Schema=None)
+    profiling.PROFILE_REPORT_DIR = report_directory
+    # S3 keys and Neo4j credentials, with no test run arguments
+    sys.argv = [script_name, '', '', '', '']
+    if script_name == 'process_company_data':
+        sys.argv = sys.argv[:3]
+    spec = importlib.util.spec_from_file_location(
+        script_name,
+        os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            script_name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    module.NEO4J_URL = None
+    # officer worker processes look functions up by module name
+    sys.modules[script_name] = module
+    spec.loader.exec_module(module)
+    module.USE_CHECKPOINTS = False
+    if script_name == 'neo4j_transform_load':
+        module.ROOT_DIR_OUTPUT = 'neo4j/'
+        module.load_graph = lambda *file_records: None
+    module.main()
+
+
+def read_previous_results(directory):
+    if not os.path.exists(directory):
+        return None
+    paths = sorted(x for x in os.listdir(directory)
+                   if x.startswith('results_') and x.endswith('.json'))
+    if not paths:
+        return None
+    with open(os.path.join(directory, paths[-1])) as f:
+        return json.load(f)
+
+
+def growth(scales, seconds):
+    # exponent of the time's growth with the input between the smallest and
+    # largest scale, 1 is linear
+    if len(scales) < 2 or min(seconds[0], seconds[-1]) < 0.05:
+        return ''
+    return '{:.2f}'.format(
+        math.log(seconds[-1] / seconds[0]) / math.log(scales[-1] / scales[0]))
+
+
+def print_scaling(results):
+    scale_names = sorted(results['scales'], key=float)
+    scales = [float(x) for x in scale_names]
+    for script_name in SCRIPTS:
+        runs = [results['scales'][x][script_name] for x in scale_names]
+        # rows are matched across scales by call path
+        paths = []
+        seconds = {}
+        for i, run in enumerate(runs):
+            for row in run.get('functions', []):
+                if row['depth'] > SUMMARY_DEPTH:
+                    continue
+                path = tuple(row['path'])
+                if path not in seconds:
+                    paths.append(path)
+                    seconds[path] = [0.0 for _ in runs]
+                seconds[path][i] = row['wall_seconds']
+        line = '{:<44}' + ' {:>10}' * len(runs) + ' {:>7}'
+        print()
+        print(
+            line.format(script_name,
+                        *['{}x s'.format(x) for x in scale_names] +
+                        ['growth']))
+        for path in paths:
+            timings = seconds[path]
+            print(
+                line.format(('  ' * (len(path) - 1) + path[-1])[:44],
+                            *['{:.1f}'.format(x)
+                              for x in timings] + [growth(scales, timings)]))
+        totals = [x.get('wall_seconds', 0.0) for x in runs]
+        print(
+            line.format('total', *['{:.1f}'.format(x) for x in totals] +
+                        [growth(scales, totals)]))
+        print(
+            line.format(
+                'peak RSS MB',
+                *['{:.0f}'.format(x.get('peak_rss_mb', 0))
+                  for x in runs] + ['']))
+        failed = [
+            '{}x'.format(x) for x, run in zip(scale_names, runs)
+            if run.get('failed')
+        ]
+        if failed:
+            print('Failed at {}'.format(', '.join(failed)))
+
+
+def print_changes(results, previous):
+    print()
+    print('Compared with the results of {}:'.format(previous['started']))
+    for scale_name, runs in sorted(
+            results['scales'].items(), key=lambda x: float(x[0])):
+        previous_runs = previous['scales'].get(scale_name, {})
+        for script_name in SCRIPTS:
+            run = runs[script_name]
+            previous_run = previous_runs.get(script_name)
+            if previous_run is None or previous_run.get('failed') or \
+                    run.get('failed'):
+                continue
+            print('{}x {}: {:.1f}s ({:+.1%}), peak RSS {:.0f}MB ({:+.1%})'.
+                  format(scale_name, script_name, run['wall_seconds'],
+                         run['wall_seconds'] / previous_run['wall_seconds'] -
+                         1, run['peak_rss_mb'], run['peak_rss_mb'] /
+                         previous_run['peak_rss_mb'] - 1))
+
+
+if __name__ == '__main__':
+    main()
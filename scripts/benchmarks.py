@@ -0,0 +1,569 @@
+#!/usr/bin/env
+
+import os
+import sys
+import time
+import pickle
+import tempfile
+import random
+import numpy as np
+import pandas as pd
+from pandas.io.json import json_normalize
+from pandas.api.types import is_categorical_dtype
+from psc_schema import flatten_psc_data_payload
+from transforms import (create_join_ids, flag_any_country_in,
+                        to_categoricals, create_type_codes, read_csv_columns,
+                        encode_company_numbers, create_company_index,
+                        in_company_index, parse_dates,
+                        create_month_year_births, create_interval_index,
+                        count_overlapping_intervals, join_distinct_values)
+from company_lookup import (create_company_lookup, save_company_lookup,
+                            load_company_lookup, lookup_company_column)
+from synthetic_data import create_companies, create_live_companies_file
+
+# usage: python benchmarks.py <benchmark> [number of rows]
+
+
+def main():
+    benchmark = sys.argv[1] if len(sys.argv) > 1 else 'all'
+    nrows = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    for name, function in BENCHMARKS:
+        if benchmark in (name, 'all'):
+            function(nrows)
+
+
+def time_function(function, *args, **kwargs):
+    repeat = kwargs.pop('repeat', 3)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    return min(timings), output
+
+
+def print_comparison(title, nrows, baseline_seconds, new_seconds):
+    print('{} ({} rows): current {:.3f}s, new {:.3f}s, {:.1f}x faster'.format(
+        title, nrows, baseline_seconds, new_seconds,
+        baseline_seconds / new_seconds))
+
+
+def synthetic_psc_payloads(nrows, seed=0):
+    rng = random.Random(seed)
+    natures = [
+        'ownership-of-shares-75-to-100-percent',
+        'voting-rights-75-to-100-percent',
+        'right-to-appoint-and-remove-directors',
+        'significant-influence-or-control'
+    ]
+    output = []
+    for i in range(nrows):
+        kind = rng.choice([
+            'individual-person-with-significant-control',
+            'individual-person-with-significant-control',
+            'individual-person-with-significant-control',
+            'corporate-entity-person-with-significant-control',
+            'persons-with-significant-control-statement', 'exemptions'
+        ])
+        data = {
+            'etag': '{:040x}'.format(rng.getrandbits(160)),
+            'kind': kind,
+            'links': {
+                'self': '/company/{:08d}/persons-with-significant-control/'
+                        'individual/{}'.format(i, i)
+            }
+        }
+        if kind == 'persons-with-significant-control-statement':
+            data['statement'] = (
+                'no-individual-or-entity-with-signficant-control')
+            data['notified_on'] = '2016-04-06'
+        elif kind == 'exemptions':
+            data['exemptions'] = {
+                'psc_exempt_as_trading_on_regulated_market': {
+                    'exemption_type':
+                    'psc-exempt-as-trading-on-regulated-market',
+                    'items': [{'exempt_from': '2016-04-06'}]
+                }
+            }
+        else:
+            data.update({
+                'name': 'Mr John Smith',
+                'notified_on': '2016-04-06',
+                'natures_of_control': rng.sample(natures, 2),
+                'address': {
+                    'address_line_1': '1 High Street',
+                    'locality': 'London',
+                    'postal_code': 'N1 1AA',
+                    'country': 'England',
+                    'premises': '1'
+                }
+            })
+            if kind == 'individual-person-with-significant-control':
+                data.update({
+                    'nationality': 'British',
+                    'country_of_residence': 'England',
+                    'name_elements': {
+                        'title': 'Mr',
+                        'forename': 'John',
+                        'surname': 'Smith'
+                    },
+                    'date_of_birth': {
+                        'year': rng.randint(1940, 1999),
+                        'month': rng.randint(1, 12)
+                    }
+                })
+            else:
+                data['identification'] = {
+                    'legal_authority': 'Companies Act 2006',
+                    'legal_form': 'Limited Company',
+                    'country_registered': 'England',
+                    'place_registered': 'Companies House',
+                    'registration_number': str(rng.randint(1, 99999999))
+                }
+        output.append(data)
+    return pd.Series(output)
+
+
+def benchmark_psc_flatten(nrows):
+    payloads = synthetic_psc_payloads(nrows)
+    baseline_seconds, baseline = time_function(json_normalize, payloads)
+    new_seconds, (flattened, unknown_keys) = time_function(
+        flatten_psc_data_payload, payloads)
+    assert not unknown_keys, unknown_keys
+    assert list(flattened.columns) == sorted(baseline.columns)
+    assert baseline[flattened.columns].astype(str).equals(
+        flattened.astype(str))
+    print_comparison('PSC data flatten', nrows, baseline_seconds, new_seconds)
+
+
+def create_join_id(x, first_name_col, surname_col, month_year_birth_col):
+    # the per-row implementation create_join_ids replaced
+    if not x.isnull().values.any():
+        first_name = x[first_name_col].split(' ')[0]
+        month_year = x[month_year_birth_col].strftime('%Y-%m')
+        join_id = first_name + '-' + x[surname_col] + '_' + month_year
+        join_id = join_id.strip('-_ ')
+        join_id = join_id.upper()
+        join_id = join_id.replace(' ', '')
+        return join_id
+    else:
+        return np.nan
+
+
+def synthetic_people(nrows, seed=0):
+    rng = np.random.RandomState(seed)
+    forenames = np.array(
+        ['John', 'Mary Ann', ' Ali', 'Chen', 'Olga', None, 'Jean-Luc'],
+        dtype=object)
+    surnames = np.array(
+        ['Smith', 'Van Dyke', 'Ng', "O'Neil", None, 'Müller '], dtype=object)
+    dates = pd.Series(
+        pd.to_datetime(
+            pd.Series(rng.randint(1940, 2000, nrows)).astype(str) + '-' +
+            pd.Series(rng.randint(1, 13, nrows)).astype(str),
+            format='%Y-%m'))
+    dates = dates.where(rng.rand(nrows) > 0.1)
+    return pd.DataFrame({
+        'forenames': forenames[rng.randint(0, len(forenames), nrows)],
+        'surname': surnames[rng.randint(0, len(surnames), nrows)],
+        'month_year_birth': dates
+    })
+
+
+def benchmark_join_id(nrows):
+    people = synthetic_people(nrows)
+    baseline_seconds, baseline = time_function(
+        people.apply,
+        create_join_id,
+        first_name_col='forenames',
+        surname_col='surname',
+        month_year_birth_col='month_year_birth',
+        axis=1,
+        repeat=1)
+    new_seconds, new = time_function(create_join_ids, people['forenames'],
+                                     people['surname'],
+                                     people['month_year_birth'])
+    assert baseline.equals(new)
+    print_comparison('join_id', nrows, baseline_seconds, new_seconds)
+
+
+def secret_function(x, secret_jurisdictions):
+    # the per-row implementations flag_any_country_in replaced
+    if x['country_of_residence_normal'] in secret_jurisdictions:
+        return True
+    elif x['address_country_normal'] in secret_jurisdictions:
+        return True
+    elif x['registered_country_normal'] in secret_jurisdictions:
+        return True
+    else:
+        return False
+
+
+def non_rle_function(x, rle_list):
+    if x['kind'] == 'corporate-entity-person-with-significant-control' and ~pd.isnull(
+            x['registered_country_normal']
+    ) and x['address_country_normal'] not in rle_list and x[
+            'registered_country_normal'] not in rle_list:
+        return True
+    else:
+        return False
+
+
+def synthetic_countries(nrows, seed=0):
+    rng = np.random.RandomState(seed)
+    secret_jurisdictions = ['SECRET LAND {}'.format(i) for i in range(45)]
+    rle_list = ['LISTED LAND {}'.format(i) for i in range(80)]
+    countries = np.array(
+        secret_jurisdictions + rle_list +
+        ['OTHER LAND {}'.format(i) for i in range(100)] + ['', None],
+        dtype=object)
+    df = pd.DataFrame({
+        col: countries[rng.randint(0, len(countries), nrows)]
+        for col in [
+            'country_of_residence_normal', 'address_country_normal',
+            'registered_country_normal'
+        ]
+    })
+    df['kind'] = np.array(
+        [
+            'individual-person-with-significant-control',
+            'corporate-entity-person-with-significant-control'
+        ],
+        dtype=object)[rng.randint(0, 2, nrows)]
+    return df, secret_jurisdictions, rle_list
+
+
+def current_jurisdiction_flags(df, secret_jurisdictions, rle_list):
+    secret_base = df.apply(
+        secret_function, secret_jurisdictions=secret_jurisdictions, axis=1)
+    non_rle_country = df.apply(non_rle_function, rle_list=rle_list, axis=1)
+    return secret_base, non_rle_country
+
+
+def new_jurisdiction_flags(df, secret_jurisdictions, rle_list):
+    secret_base = flag_any_country_in(df, [
+        'country_of_residence_normal', 'address_country_normal',
+        'registered_country_normal'
+    ], secret_jurisdictions)
+    non_rle_country = (
+        df.kind == 'corporate-entity-person-with-significant-control'
+    ) & ~flag_any_country_in(
+        df, ['address_country_normal', 'registered_country_normal'],
+        rle_list)
+    return secret_base, non_rle_country
+
+
+def benchmark_jurisdiction_flags(nrows):
+    df, secret_jurisdictions, rle_list = synthetic_countries(nrows)
+    baseline_seconds, baseline = time_function(
+        current_jurisdiction_flags,
+        df,
+        secret_jurisdictions,
+        rle_list,
+        repeat=1)
+    new_seconds, new = time_function(new_jurisdiction_flags, df,
+                                     secret_jurisdictions, rle_list)
+    assert baseline[0].equals(new[0]) and baseline[1].equals(new[1])
+    print_comparison('secret_base and non_rle_country', nrows,
+                     baseline_seconds, new_seconds)
+
+
+def benchmark_categorical_columns(nrows):
+    categorical = flatten_psc_data_payload(synthetic_psc_payloads(nrows))[0]
+    columns = [
+        col for col in categorical.columns
+        if is_categorical_dtype(categorical[col])
+    ]
+    dense = categorical.astype({col: object for col in columns})
+    baseline_bytes = dense[columns].memory_usage(deep=True).sum()
+    new_bytes = categorical[columns].memory_usage(deep=True).sum()
+    print('Categorical PSC columns ({} rows): objects {:.1f}MB, '
+          'categoricals {:.1f}MB'.format(nrows, baseline_bytes / 1e6,
+                                         new_bytes / 1e6))
+
+    def filter_and_count(df):
+        records = df[df['kind'] != 'exemptions']
+        return records.groupby('nationality').size()
+
+    baseline_seconds, baseline = time_function(filter_and_count, dense)
+    new_seconds, new = time_function(filter_and_count, categorical)
+    assert baseline.to_dict() == new[new > 0].to_dict()
+    print_comparison('kind filter and nationality count', nrows,
+                     baseline_seconds, new_seconds)
+
+
+def company_code_creator(x):
+    if x[:2].isdigit():
+        return 'EAW'
+    else:
+        return x[:2]
+
+
+# the BasicCompanyData columns process_company_data.LIVE_COMPANIES_COLUMNS
+# keeps, as they appear in the file
+LIVE_COMPANIES_COLUMNS = [
+    'CompanyName', 'CompanyNumber', 'RegAddress.AddressLine1',
+    'RegAddress.AddressLine2', 'RegAddress.PostTown', 'RegAddress.County',
+    'RegAddress.Country', 'RegAddress.PostCode', 'CompanyCategory',
+    'CountryOfOrigin', 'DissolutionDate', 'IncorporationDate'
+] + [
+    'PreviousName_{}.{}'.format(i, x) for i in range(1, 11)
+    for x in ['CONDATE', 'CompanyName']
+]
+LIVE_COMPANIES_CATEGORICAL_COLUMNS = [
+    'RegAddress.PostTown', 'RegAddress.County', 'RegAddress.Country',
+    'CompanyCategory', 'CompanyStatus', 'CountryOfOrigin',
+    'Accounts.AccountCategory', 'SICCode.SicText_1', 'SICCode.SicText_2',
+    'SICCode.SicText_3', 'SICCode.SicText_4'
+]
+
+
+def current_live_companies_load(path):
+    with open(path) as f:
+        df = pd.read_csv(f, low_memory=False)
+    to_categoricals(df, [
+        x for x in df.columns
+        if x.strip() in LIVE_COMPANIES_CATEGORICAL_COLUMNS
+    ])
+    type_codes = df[' CompanyNumber'].apply(company_code_creator).astype(
+        'category')
+    return df, type_codes
+
+
+def new_live_companies_load(path):
+    with open(path) as f:
+        df = read_csv_columns(
+            f, lambda x: x.strip() in LIVE_COMPANIES_COLUMNS,
+            lambda x: x.strip() in LIVE_COMPANIES_CATEGORICAL_COLUMNS,
+            low_memory=False)
+    return df, create_type_codes(df[' CompanyNumber'])
+
+
+def benchmark_live_companies_load(nrows):
+    rng = np.random.RandomState(0)
+    live_companies = create_live_companies_file(
+        rng, create_companies(rng, nrows))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'BasicCompanyData.csv')
+        live_companies.to_csv(path, index=False)
+        del live_companies
+        baseline_seconds, baseline = time_function(
+            current_live_companies_load, path, repeat=1)
+        baseline_bytes = baseline[0].memory_usage(deep=True).sum()
+        baseline_codes = baseline[1]
+        del baseline
+        new_seconds, new = time_function(
+            new_live_companies_load, path, repeat=1)
+    assert baseline_codes.astype(str).equals(new[1].astype(str))
+    print('Live companies in memory ({} rows): all columns {:.1f}MB, '
+          'used columns {:.1f}MB'.format(nrows, baseline_bytes / 1e6,
+                                         new[0].memory_usage(
+                                             deep=True).sum() / 1e6))
+    print_comparison('live companies load and type codes', nrows,
+                     baseline_seconds, new_seconds)
+
+
+def current_live_filters(live_company_numbers, company_numbers):
+    live_companies_list = live_company_numbers.unique().tolist()
+    return [x.isin(live_companies_list).values for x in company_numbers]
+
+
+def new_live_filters(live_company_numbers, company_numbers):
+    live_companies_index = create_company_index(
+        encode_company_numbers(live_company_numbers))
+    return [
+        in_company_index(encode_company_numbers(x), live_companies_index)
+        for x in company_numbers
+    ]
+
+
+def benchmark_company_number_index(nrows):
+    # live company filters of the PSC records, exemptions and statements,
+    # roughly one in ten company numbers isn't live
+    rng = np.random.RandomState(0)
+    numbers = create_companies(rng, nrows + nrows // 10).company_number
+    live_company_numbers = numbers[:nrows]
+    company_numbers = [
+        pd.Series(rng.choice(numbers.values, size)) for size in
+        [nrows, nrows // 20, nrows // 10]
+    ]
+    baseline_seconds, baseline = time_function(
+        current_live_filters, live_company_numbers, company_numbers)
+    new_seconds, new = time_function(new_live_filters, live_company_numbers,
+                                     company_numbers)
+    assert all((x == y).all() for x, y in zip(baseline, new))
+    print_comparison('live company filters', nrows, baseline_seconds,
+                     new_seconds)
+
+
+def current_worker_lookup(live_company_map, codes):
+    # each worker unpickled its own copy of the map
+    live_company_map = pickle.loads(pickle.dumps(live_company_map))
+    return pd.Series(codes).map(live_company_map['company_name']).values
+
+
+def new_worker_lookup(lookup_dir, codes):
+    return lookup_company_column(
+        load_company_lookup(lookup_dir), codes, 'company_name')
+
+
+def benchmark_company_lookup(nrows):
+    # what a worker process does to look up the names of the companies of
+    # nrows records, roughly one in ten company numbers isn't live
+    rng = np.random.RandomState(0)
+    live_companies = create_companies(rng, nrows)
+    live_codes = encode_company_numbers(live_companies.company_number)
+    codes = encode_company_numbers(
+        pd.Series(rng.choice(live_companies.company_number.values, nrows)))
+    codes[rng.rand(nrows) < 0.1] = -1
+    live_company_map = live_companies[['company_name']].set_index(live_codes)
+    lookup = create_company_lookup(
+        live_codes, {'company_name': live_companies.company_name})
+    with tempfile.TemporaryDirectory() as directory:
+        save_company_lookup(lookup, directory)
+        baseline_seconds, baseline = time_function(
+            current_worker_lookup, live_company_map, codes)
+        new_seconds, new = time_function(new_worker_lookup, directory, codes)
+    assert pd.Series(baseline).equals(pd.Series(new))
+    print('Live company names in memory ({} rows): DataFrame {:.1f}MB, '
+          'lookup {:.1f}MB shared between workers'.format(
+              nrows,
+              live_company_map.memory_usage(deep=True).sum() / 1e6,
+              sum(x.nbytes for x in lookup.values()) / 1e6))
+    print_comparison('worker company name lookup', nrows, baseline_seconds,
+                     new_seconds)
+
+
+def current_date_parsing(years, months, partial_dates):
+    month_year_births = years.dropna().astype(str).str.replace(
+        r'\.0', '') + '-' + months.dropna().astype(str).str.replace(
+            r'\.0', '')
+    month_year_births = pd.to_datetime(
+        month_year_births, format='%Y-%m', errors='coerce')
+    partial_dates = pd.to_datetime(
+        partial_dates.astype(str).str.strip() + '01',
+        format='%Y%m%d',
+        errors='coerce')
+    return month_year_births.reindex(years.index), partial_dates
+
+
+def new_date_parsing(years, months, partial_dates):
+    return create_month_year_births(years, months), parse_dates(
+        partial_dates,
+        format='%Y%m%d',
+        function=lambda x: x.astype(str).str.strip() + '01')
+
+
+def benchmark_date_parsing(nrows):
+    # PSC months of birth from the year and month columns and officer
+    # partial dates of birth, about a thousand distinct months
+    rng = np.random.RandomState(0)
+    years = pd.Series(rng.randint(1930, 2001, nrows).astype(float))
+    months = pd.Series(rng.randint(1, 13, nrows).astype(float))
+    years[rng.rand(nrows) < 0.05] = np.nan
+    partial_dates = pd.Series(
+        (years.fillna(1970).astype(int).astype(str) +
+         months.astype(int).map('{:02d}'.format)).values)
+    baseline_seconds, baseline = time_function(current_date_parsing, years,
+                                               months, partial_dates)
+    new_seconds, new = time_function(new_date_parsing, years, months,
+                                     partial_dates)
+    assert all(x.equals(y) for x, y in zip(baseline, new))
+    print_comparison('date parsing', nrows, baseline_seconds, new_seconds)
+
+
+def current_interval_matches(periods, people):
+    # every person row paired with every period of its join_id
+    pairs = pd.merge(
+        people.reset_index(), periods, on='join_id', how='inner')
+    during = pairs[(pairs.start.isnull() | (pairs.start <= pairs.date))
+                   & (pairs.end.isnull() | (pairs.end >= pairs.date))]
+    output = np.zeros(len(people), dtype=bool)
+    output[during['index'].unique()] = True
+    return output
+
+
+def new_interval_matches(periods, people):
+    index = create_interval_index(periods.join_id, periods.start, periods.end)
+    return count_overlapping_intervals(index, people.join_id, people.date,
+                                       people.date) > 0
+
+
+def benchmark_interval_matching(nrows):
+    # appointment dates of nrows officers against the disqualification
+    # periods of a tenth as many people, names are shared so each join_id
+    # has a few periods and many officers
+    rng = np.random.RandomState(0)
+    join_ids = np.array(['PERSON-{}'.format(x) for x in range(nrows // 40)])
+    periods = pd.DataFrame({
+        'join_id': join_ids[rng.randint(0, len(join_ids), nrows // 10)],
+        'start': pd.to_datetime('1990-01-01') + pd.to_timedelta(
+            rng.randint(0, 10000, nrows // 10), 'D')
+    })
+    periods['end'] = periods.start + pd.to_timedelta(
+        rng.randint(365, 5000, len(periods)), 'D')
+    people = pd.DataFrame({
+        'join_id': join_ids[rng.randint(0, len(join_ids), nrows)],
+        'date': pd.to_datetime('1985-01-01') + pd.to_timedelta(
+            rng.randint(0, 12000, nrows), 'D')
+    })
+    baseline_seconds, baseline = time_function(
+        current_interval_matches, periods, people, repeat=1)
+    new_seconds, new = time_function(new_interval_matches, periods, people)
+    assert (baseline == new).all()
+    print_comparison('interval matching', nrows, baseline_seconds,
+                     new_seconds)
+
+
+def current_distinct_join(df):
+    output = df.groupby('uid').agg(
+        lambda x: ' | '.join(list(set(x)))).reset_index()
+    return output.apply(lambda x: x.str.strip('| '))
+
+
+def new_distinct_join(df):
+    return join_distinct_values(df, 'uid').apply(lambda x: x.str.strip('| '))
+
+
+def distinct_values(s):
+    # the values of each joined cell, whatever their order
+    return s.map(lambda x: frozenset(y for y in x.split(' | ') if y))
+
+
+def benchmark_distinct_join(nrows):
+    # node rows of about four fifths as many uids, as in the company nodes,
+    # with 15 columns of a few hundred values each, a fifth of them empty
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame({
+        'uid': pd.Series(rng.randint(0, nrows * 4 // 5, nrows)).map(
+            'UID-{}'.format)
+    })
+    for i in range(15):
+        values = np.array(['VALUE-{}-{}'.format(i, x) for x in range(300)])
+        df['column_{}'.format(i)] = np.where(
+            rng.rand(nrows) < 0.2, '', values[rng.randint(0, 300, nrows)])
+    baseline_seconds, baseline = time_function(
+        current_distinct_join, df, repeat=1)
+    new_seconds, new = time_function(new_distinct_join, df)
+    assert (baseline.uid.values == new.uid.values).all()
+    assert all((distinct_values(baseline[x]) == distinct_values(new[x])).all()
+               for x in df.columns.drop('uid'))
+    print_comparison('distinct value join', nrows, baseline_seconds,
+                     new_seconds)
+
+
+BENCHMARKS = [
+    ('psc_flatten', benchmark_psc_flatten),
+    ('join_id', benchmark_join_id),
+    ('jurisdiction_flags', benchmark_jurisdiction_flags),
+    ('categorical_columns', benchmark_categorical_columns),
+    ('live_companies_load', benchmark_live_companies_load),
+    ('company_number_index', benchmark_company_number_index),
+    ('company_lookup', benchmark_company_lookup),
+    ('date_parsing', benchmark_date_parsing),
+    ('interval_matching', benchmark_interval_matching),
+    ('distinct_join', benchmark_distinct_join),
+]
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env
+
+import pandas as pd
+from pandas.api.types import is_categorical_dtype
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed when writing or reading parquet
+    pa = None
+    pq = None
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError(
+            'pyarrow is required for parquet input and output, install it '
+            'with pip install pyarrow')
+
+
+def declared_arrow_type(kind):
+    # arrow type of a declared column kind, as in psc_schema.PSC_DATA_FIELDS
+    # plus 'bool', 'int32' and 'timestamp'. Categories are dictionary encoded
+    # strings
+    return {
+        'string': pa.string(),
+        'category': pa.dictionary(pa.int32(), pa.string()),
+        'number': pa.float64(),
+        'list': pa.list_(pa.string()),
+        # pyarrow 0.14 can't write lists of structs to parquet, the items
+        # are kept as the text the CSVs have
+        'exemption_items': pa.string(),
+        'bool': pa.bool_(),
+        'int32': pa.int32(),
+        'timestamp': pa.timestamp('ns')
+    }[kind]
+
+
+def arrow_types(df):
+    # arrow type of every column holding at least one value, categoricals
+    # are typed by their values as their dictionaries differ between tables,
+    # and string ones are dictionary encoded
+    require_pyarrow()
+    categorical_columns = [
+        col for col in df.columns if is_categorical_dtype(df[col])
+    ]
+    schema = pa.Schema.from_pandas(
+        df.astype({col: object
+                   for col in categorical_columns}),
+        preserve_index=False)
+    return {
+        field.name: declared_arrow_type('category')
+        if field.name in categorical_columns and field.type == pa.string()
+        else field.type
+        for field in schema if field.type != pa.null()
+    }
+
+
+def merge_arrow_types(types, new_types):
+    # combines the column types of several partial tables, integers widen
+    # to floats the way pandas upcasts them and other conflicts fall back to
+    # strings
+    for col, new_type in new_types.items():
+        current = types.get(col)
+        if current is None or current == new_type:
+            types[col] = new_type
+        elif {str(current), str(new_type)} <= {'int64', 'double'}:
+            types[col] = pa.float64()
+        else:
+            types[col] = pa.string()
+    return types
+
+
+def create_arrow_schema(columns, types, column_kinds=None):
+    # columns in column_kinds (a dict of column to declared kind) take their
+    # declared type whatever their values, so a table gets the same schema
+    # whether it's written whole or in parts. The rest take the type found
+    # in types, or null when none of their values were seen
+    require_pyarrow()
+    column_kinds = column_kinds or {}
+    return pa.schema([
+        pa.field(
+            col,
+            declared_arrow_type(column_kinds[col]) if col in column_kinds else
+            types.get(col, pa.null())) for col in columns
+    ])
+
+
+def to_arrow_table(df, schema=None):
+    # columns with no values in this table take the schema's type, others
+    # are made strings where the schema has strings and string categoricals
+    # where it has dictionaries
+    require_pyarrow()
+    if schema is None:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    temp_df = df.copy()
+    for field in schema:
+        col = field.name
+        if temp_df[col].isnull().all():
+            temp_df[col] = pd.Series(None, index=temp_df.index, dtype=object)
+        elif field.type == pa.string() or isinstance(field.type,
+                                                      pa.DictionaryType):
+            values = temp_df[col].astype(object)
+            temp_df[col] = values.where(values.isnull(), values.astype(str))
+        if isinstance(field.type, pa.DictionaryType):
+            # string categories even when there are no values, pyarrow can't
+            # convert other columns to dictionaries
+            temp_df[col] = pd.Categorical(
+                temp_df[col],
+                categories=pd.Index(
+                    sorted(set(temp_df[col].dropna())), dtype=object))
+    return pa.Table.from_pandas(temp_df, schema=schema, preserve_index=False)
+
+
+def write_parquet(df, f, column_kinds=None):
+    # the schema is made as create_arrow_schema makes the schema of a table
+    # written in parts, so both give the same one
+    schema = create_arrow_schema(df.columns, arrow_types(df), column_kinds)
+    pq.write_table(to_arrow_table(df, schema), f)
+
+
+def read_parquet(f, columns=None):
+    # those of columns the file has, or all of them. List columns come back
+    # as numpy arrays, turn them back into lists so they print the same as
+    # the lists in the CSV outputs
+    require_pyarrow()
+    parquet_file = pq.ParquetFile(f)
+    if columns is not None:
+        names = parquet_file.schema.to_arrow_schema().names
+        columns = [x for x in columns if x in names]
+    table = parquet_file.read(columns=columns)
+    output_df = table.to_pandas()
+    for field in table.schema:
+        if str(field.type).startswith('list'):
+            output_df[field.name] = [
+                x.tolist() if x is not None else None
+                for x in output_df[field.name]
+            ]
+    return output_df
+
+
+def create_parquet_writer(stack, f, schema):
+    # writer appending one row group per table written to it, the file and
+    # writer are closed when the ExitStack exits
+    require_pyarrow()
+    stack.enter_context(f)
+    writer = pq.ParquetWriter(f, schema)
+    stack.callback(writer.close)
+    return writer
@@ -0,0 +1,84 @@
+#!/usr/bin/env
+
+import os
+import numpy as np
+import pandas as pd
+from transforms import in_company_index, company_index_positions
+
+# read-only lookup of the live companies on their encoded company numbers
+# (see transforms.encode_company_numbers). It holds only numpy arrays: the
+# sorted codes and, for each looked up column, its values in code order as
+# UTF-8 bytes packed end to end with their offsets. Saved to a directory it
+# can be memory-mapped by any number of worker processes, which then share
+# the operating system's one copy of it rather than each unpickling their own
+
+
+def create_company_lookup(codes, columns):
+    # codes of the companies and a dict of the columns to look up, as Series
+    # in the same order. Codes of -1 are left out
+    codes = np.asarray(codes)
+    keep = np.flatnonzero(codes >= 0)
+    keep = keep[np.argsort(codes[keep], kind='mergesort')]
+    output = {'codes': codes[keep]}
+    for name, values in columns.items():
+        values = values.values[keep]
+        missing = pd.isnull(values)
+        encoded = [
+            b'' if is_missing else str(x).encode('utf-8')
+            for x, is_missing in zip(values, missing)
+        ]
+        output['{}_missing'.format(name)] = missing
+        output['{}_offsets'.format(name)] = np.concatenate(
+            [[0], np.cumsum([len(x) for x in encoded], dtype=np.int64)])
+        output['{}_data'.format(name)] = np.frombuffer(
+            b''.join(encoded), dtype=np.uint8)
+    return output
+
+
+def save_company_lookup(lookup, directory):
+    for name, values in lookup.items():
+        np.save(os.path.join(directory, '{}.npy'.format(name)), values)
+
+
+def load_company_lookup(directory):
+    # the arrays are mapped, not read, so pages are only loaded as they are
+    # touched and are shared with other processes mapping the same files
+    return {
+        x[:-len('.npy')]: load_array(os.path.join(directory, x))
+        for x in os.listdir(directory) if x.endswith('.npy')
+    }
+
+
+def load_array(path):
+    # numpy can't map an empty array
+    values = np.load(path, mmap_mode='r')
+    if values.size == 0:
+        return np.load(path)
+    return values
+
+
+def in_company_lookup(lookup, codes):
+    return in_company_index(codes, lookup['codes'])
+
+
+def lookup_company_column(lookup, codes, name):
+    # values of column name for each of codes, NaN where the company isn't in
+    # the lookup or has no value. Each distinct company is decoded once,
+    # straight from the mapped bytes so only the pages holding its value are
+    # read and nothing is copied into the process's own memory
+    positions = company_index_positions(codes, lookup['codes'])
+    found = np.flatnonzero(positions >= 0)
+    found = found[~lookup['{}_missing'.format(name)][positions[found]]]
+    inverse, distinct = pd.factorize(positions[found])
+    offsets = lookup['{}_offsets'.format(name)]
+    data = memoryview(lookup['{}_data'.format(name)])
+    # the last value is for the codes not found
+    values = np.empty(len(distinct) + 1, dtype=object)
+    values[:-1] = [
+        bytes(data[start:end]).decode('utf-8') for start, end in zip(
+            offsets[distinct].tolist(), offsets[distinct + 1].tolist())
+    ]
+    values[-1] = np.nan
+    value_positions = np.full(len(positions), len(distinct), dtype=np.int64)
+    value_positions[found] = inverse
+    return values.take(value_positions)
@@ -2,16 +2,15 @@
 
 import sys
 import pandas as pd
-import s3fs
 import re
 import datetime
 from everypolitician import EveryPolitician
+from storage import create_filesystem
 
 
 root_dir = 'private-gw/psc-2019/'
-fs = s3fs.S3FileSystem(
-    key=sys.argv[1], secret=sys.argv[2],
-    anon=False)  # create AWS S3 filesystem
+fs = create_filesystem(
+    key=sys.argv[1], secret=sys.argv[2])  # S3 or local, see storage.py
 
 
 def main():
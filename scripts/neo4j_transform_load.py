@@ -1,15 +1,22 @@
 #!/usr/bin/env
 from py2neo import Graph, Schema
 import pandas as pd
+from pandas.api.types import is_categorical_dtype
 import sys
-import s3fs
 import numpy as np
 import recordlinkage
 import re
-
-fs = s3fs.S3FileSystem(
-    key=sys.argv[1], secret=sys.argv[2],
-    anon=False)  # create AWS S3 filesystem
+import os
+from columnar import read_parquet
+from pipeline import create_stage, run_stages, code_version
+from profiling import profiled, count_s3_opens, write_report, print_summary
+from storage import create_filesystem
+from transforms import join_distinct_values
+from sampling import (create_company_sample, corporate_psc_owners,
+                      sample_companies, print_company_sample)
+
+fs = count_s3_opens(create_filesystem(
+    key=sys.argv[1], secret=sys.argv[2]))  # S3 or local, see storage.py
 
 graph = Graph(
     NEO4J_URL,
@@ -19,89 +26,314 @@ graph = Graph(
 ROOT_DIR_INPUT = ''
 ROOT_DIR_OUTPUT = ''
 S3_BASE = ''
-
+# format of the processed tables to load, 'parquet' reads the typed columnar
+# copies process_company_data.py writes when OUTPUT_FORMATS includes it
+INPUT_FORMAT = 'csv'
+# skip generating the node and edge CSVs and loading the graph when nothing
+# feeding them has changed since they last completed
+USE_CHECKPOINTS = True
+# the company, person and other node and edge CSVs can be written at the
+# same time in up to this many forked processes. Each process reads its own
+# copy of the processed tables it uses and they share active_psc_records,
+# active_officers and companies, so 1, writing them one after another in
+# this process and reading each table once at a time, keeps the peak lowest
+STAGE_PROCESSES = 1
+# see process_company_data.STAGE_MEMORY_LIMIT_MB
+STAGE_MEMORY_LIMIT_MB = 100000
+STAGE_MEMORY_MB = {
+    'company_csvs': 30000,
+    'person_csvs': 30000,
+    'other_csvs': 10000,
+    'graph_load': 1000
+}
+# the columns of each processed table the node and edge builders use, the
+# only ones read. The other processed tables aren't used. Columns are read
+# as strings apart from the dates in INPUT_DATE_COLUMNS and the flags and
+# numbers in INPUT_INFERRED_COLUMNS, whose types pandas infers as before
+INPUT_COLUMNS = {
+    'companies': [
+        'company_number', 'company_name', 'regaddress_addressline1',
+        'regaddress_addressline2', 'regaddress_posttown',
+        'regaddress_county', 'regaddress_country', 'regaddress_postcode',
+        'companycategory', 'countryoforigin', 'dissolutiondate',
+        'incorporationdate'
+    ],
+    'active_psc_records': [
+        'company_number', 'kind', 'etag', 'name', 'name_elements_forename',
+        'name_elements_surname', 'month_year_birth', 'nationality',
+        'natures_of_control', 'notified_on', 'address_address_line_1',
+        'address_address_line_2', 'address_care_of', 'address_country',
+        'address_locality', 'address_po_box', 'address_postal_code',
+        'exemptions_count', 'identification_country_registered',
+        'identification_legal_authority', 'identification_legal_form',
+        'identification_place_registered',
+        'identification_registration_number', 'country_of_residence_normal',
+        'address_country_normal', 'secret_base', 'join_id',
+        'psc_likely_disqualified_director', 'possible_politician',
+        'politician_leg_country', 'politician_leg_name',
+        'politician_active_periods'
+    ],
+    'active_psc_statements':
+    ['company_number', 'etag', 'statement', 'notified_on'],
+    'active_exemption_records': ['company_number'],
+    'active_officers': [
+        'company_number', 'person_number', 'corporate_indicator',
+        'forenames', 'surname', 'title', 'honours', 'occupation',
+        'nationality', 'resident_country', 'partial_date_of_birth',
+        'partial_date_of_birth_formatted', 'address_line_1',
+        'address_line_2', 'post_town', 'county', 'country',
+        'person_postcode', 'appointment_type_label',
+        'appointment_date_formatted', 'country_of_residence_normal',
+        'address_country_normal', 'secret_base', 'join_id',
+        'possible_politician', 'politician_leg_country',
+        'politician_leg_name', 'politician_active_periods'
+    ]
+}
+INPUT_DATE_COLUMNS = [
+    'month_year_birth', 'partial_date_of_birth_formatted',
+    'appointment_date_formatted'
+]
+INPUT_INFERRED_COLUMNS = [
+    'exemptions_count', 'partial_date_of_birth', 'secret_base',
+    'possible_politician', 'psc_likely_disqualified_director'
+]
+# the columns of active_psc_records the company sample is drawn from
+SAMPLE_COLUMNS = [
+    'company_number', 'kind', 'identification_registration_number'
+]
+
+# 'test' reads the first rows of each table, 'sample' the rows of a hash
+# sample of the companies that keeps the tables joined, see sampling.py
+nrows = None
+sample_fraction = None
 try:
     if sys.argv[5] == 'test':
         nrows = int(sys.argv[6])
         print('Running on sample of {} records...'.format(str(nrows)))
+    elif sys.argv[5] == 'sample':
+        sample_fraction = float(sys.argv[6])
+        print('Running on a sample of {:.2%} of companies...'.format(
+            sample_fraction))
     else:
-        nrows = None
         print('Running on full data...')
 except Exception:
-    nrows = None
     print('Running on full data...')
 
-live_companies = pd.read_csv(
-    fs.open('{}processed/companies.csv'.format(ROOT_DIR_INPUT)),
-    parse_dates=['incorporation_date_formatted'],
-    low_memory=False,
-    nrows=nrows)
-active_psc_records = pd.read_csv(
-    fs.open('{}processed/active_psc_records.csv'.format(ROOT_DIR_INPUT)),
-    parse_dates=['month_year_birth'],
-    low_memory=False,
-    nrows=nrows)
-active_psc_statements = pd.read_csv(
-    fs.open('{}processed/active_psc_statements.csv'.format(ROOT_DIR_INPUT)),
-    low_memory=False,
-    nrows=nrows)
-active_psc_controls = pd.read_csv(
-    fs.open('{}processed/active_psc_controls.csv'.format(ROOT_DIR_INPUT)),
-    low_memory=False,
-    nrows=nrows)
-active_exemptions = pd.read_csv(
-    fs.open('{}processed/active_exemption_records.csv'.format(ROOT_DIR_INPUT)),
-    low_memory=False,
-    nrows=nrows)
-ceased_exemptions = pd.read_csv(
-    fs.open('{}processed/ceased_exemption_records.csv'.format(ROOT_DIR_INPUT)),
-    low_memory=False,
-    nrows=nrows)
-active_officers = pd.read_csv(
-    fs.open('{}processed/active_officers.csv'.format(ROOT_DIR_INPUT)),
-    low_memory=False,
-    nrows=nrows,
-    parse_dates=[
-        'partial_date_of_birth_formatted', 'appointment_date_formatted'
-    ],
-    dtype={'person_number': str})
+
+def processed_path(filename):
+    return '{}processed/{}.{}'.format(ROOT_DIR_INPUT, filename, INPUT_FORMAT)
+
+
+@profiled
+def read_processed(filename, columns=None, parse_dates=False, **kwargs):
+    # loads one processed table, only the listed columns when columns is
+    # given. Listed columns the table lacks, snapshot fields no record had,
+    # are added empty. Parquet keeps the types it was written with so the
+    # CSV parsing options are only used for CSV
+    if INPUT_FORMAT == 'parquet':
+        output_df = read_parquet(
+            fs.open(processed_path(filename)), columns=columns)
+        output_df = add_missing_columns(output_df, columns)
+        # categoricals come back as categoricals, the node and edge tables
+        # fill their gaps with '' which categoricals don't accept
+        output_df = output_df.astype({
+            col: object
+            for col in output_df.columns
+            if is_categorical_dtype(output_df[col])
+        })
+        if nrows is not None:
+            output_df = output_df.head(nrows)
+        return output_df
+    # company numbers stay strings in tables that happen to hold only
+    # numeric ones, or they can't be merged with the other tables
+    dtype = {'company_number': str}
+    dtype.update(kwargs.pop('dtype', {}))
+    output_df = pd.read_csv(
+        fs.open(processed_path(filename)),
+        usecols=None if columns is None else lambda x: x in columns,
+        parse_dates=parse_dates,
+        low_memory=False,
+        nrows=nrows,
+        dtype=dtype,
+        **kwargs)
+    return add_missing_columns(output_df, columns)
+
+
+def add_missing_columns(df, columns):
+    for col in columns or []:
+        if col not in df.columns:
+            df[col] = pd.Series(np.nan, index=df.index, dtype=object)
+    return df
+
+
+def read_input_table(filename, columns=None):
+    # the columns of a processed table the node and edge builders use, or
+    # those of them given, with their declared types and sampled when
+    # sampling
+    columns = columns or INPUT_COLUMNS[filename]
+    parse_dates = [x for x in columns if x in INPUT_DATE_COLUMNS]
+    output_df = read_processed(
+        filename,
+        columns=columns,
+        parse_dates=parse_dates,
+        dtype={
+            x: str
+            for x in columns
+            if x not in parse_dates and x not in INPUT_INFERRED_COLUMNS
+        })
+    return sample_companies(output_df, company_sample)
+
+
+# each stage reads the tables it uses when it first needs them and releases
+# them once its last builder using them is done, so no process holds a table
+# it has finished with or one it never uses
+input_tables = {}
+
+
+def input_table(filename):
+    if filename not in input_tables:
+        input_tables[filename] = read_input_table(filename)
+    return input_tables[filename]
+
+
+def release_input_tables(*filenames):
+    for filename in filenames:
+        input_tables.pop(filename, None)
+
+
+company_sample = None
+if sample_fraction is not None:
+    company_sample = create_company_sample(
+        sample_fraction, *corporate_psc_owners(
+            read_input_table('active_psc_records', SAMPLE_COLUMNS)))
+    print_company_sample(company_sample)
 
 csv_file_records = [
 ]  # list to store information on CSV file for Neo4J import queries
 
 
 def main():
+    stages = [
+        create_stage(
+            'company_csvs',
+            create_company_csvs,
+            input_paths=input_paths([
+                'companies', 'active_psc_records', 'active_psc_statements',
+                'active_exemption_records', 'active_officers'
+            ]),
+            memory_mb=STAGE_MEMORY_MB['company_csvs']),
+        create_stage(
+            'person_csvs',
+            create_person_csvs,
+            input_paths=input_paths(['active_psc_records',
+                                     'active_officers']),
+            memory_mb=STAGE_MEMORY_MB['person_csvs']),
+        create_stage(
+            'other_csvs',
+            create_other_csvs,
+            input_paths=input_paths([
+                'companies', 'active_psc_records', 'active_psc_statements'
+            ]),
+            memory_mb=STAGE_MEMORY_MB['other_csvs']),
+        create_stage(
+            'graph_load',
+            load_graph,
+            depends_on=['company_csvs', 'person_csvs', 'other_csvs'],
+            memory_mb=STAGE_MEMORY_MB['graph_load']),
+    ]
+    try:
+        run_stages(
+            stages,
+            fs,
+            code_version(os.path.abspath(__file__)),
+            settings={
+                'root_dir_input': ROOT_DIR_INPUT,
+                'root_dir_output': ROOT_DIR_OUTPUT,
+                's3_base': S3_BASE,
+                'nrows': nrows,
+                'sample_fraction': sample_fraction,
+                'input_format': INPUT_FORMAT
+            },
+            use_checkpoints=USE_CHECKPOINTS,
+            processes=STAGE_PROCESSES,
+            memory_limit_mb=STAGE_MEMORY_LIMIT_MB)
+    finally:
+        write_report('neo4j_transform_load')
+        print_summary()
+    print('Script finished!')
+
+
+def input_paths(filenames):
+    return [processed_path(x) for x in filenames]
+
+
+# each of these returns the records of the CSVs it wrote, they're
+# independent of each other so can run in separate processes
+
+
+@profiled
+def create_company_csvs():
+    records_before = len(csv_file_records)
     active_filing_company_nodes = prepare_filing_company_data(
-        active_psc_records, active_psc_statements, active_exemptions,
-        live_companies)
+        input_table('active_psc_records'),
+        input_table('active_psc_statements'),
+        input_table('active_exemption_records'), input_table('companies'))
+    release_input_tables('active_psc_statements', 'active_exemption_records')
     active_target_company_nodes = prepare_target_company_data(
-        active_psc_records)
+        input_table('active_psc_records'))
+    release_input_tables('active_psc_records')
     active_officers_company_nodes = prepare_company_officer_data(
-        active_officers, live_companies)
+        input_table('active_officers'), input_table('companies'))
+    release_input_tables('active_officers', 'companies')
     combine_company_nodes(active_filing_company_nodes,
                           active_target_company_nodes,
                           active_officers_company_nodes)
-    active_officer_human_nodes = prepare_human_officer_data(active_officers)
-    active_psc_human_nodes = prepare_human_psc_data(active_psc_records)
+    return csv_file_records[records_before:]
+
+
+@profiled
+def create_person_csvs():
+    records_before = len(csv_file_records)
+    active_officer_human_nodes = prepare_human_officer_data(
+        input_table('active_officers'))
+    release_input_tables('active_officers')
+    active_psc_human_nodes = prepare_human_psc_data(
+        input_table('active_psc_records'))
+    release_input_tables('active_psc_records')
     combine_person_nodes(active_officer_human_nodes, active_psc_human_nodes)
-    prepare_legal_person_psc_data(active_psc_records)
-    prepare_psc_exemptions_data(active_exemptions)
-    prepare_psc_statements_data(active_psc_statements)
-    prepare_super_secure_data(active_psc_records)
-    prepare_address_data(live_companies)
-    print(csv_file_records)
+    return csv_file_records[records_before:]
+
+
+@profiled
+def create_other_csvs():
+    records_before = len(csv_file_records)
+    prepare_legal_person_psc_data(input_table('active_psc_records'))
+    prepare_psc_exemptions_data(input_table('active_psc_records'))
+    prepare_super_secure_data(input_table('active_psc_records'))
+    release_input_tables('active_psc_records')
+    prepare_psc_statements_data(input_table('active_psc_statements'))
+    release_input_tables('active_psc_statements')
+    prepare_address_data(input_table('companies'))
+    release_input_tables('companies')
+    return csv_file_records[records_before:]
+
+
+@profiled
+def load_graph(*stage_file_records):
+    file_records = [x for records in stage_file_records for x in records]
+    print(file_records)
     clear_graph(graph)
     create_constraints([
         'Person', 'Company', 'Exemption', 'Statement', 'SuperSecure',
         'Postcode', 'LegalPerson'
     ], graph)
-    node_csvs = get_node_csvs(csv_file_records)
+    node_csvs = get_node_csvs(file_records)
     create_all_nodes(node_csvs, graph)
-    edge_csvs = get_edge_csvs(csv_file_records)
+    edge_csvs = get_edge_csvs(file_records)
     create_all_edges(edge_csvs, graph)
-    print('Script finished!')
 
 
+@profiled
 def combine_company_nodes(filing_company_nodes, target_company_nodes,
                           active_officers_company_nodes):
     company_nodes = pd.concat([
@@ -112,11 +344,10 @@ def combine_company_nodes(filing_company_nodes, target_company_nodes,
                               ignore_index=True,
                               sort=True)
     company_nodes.drop_duplicates(inplace=True)
-    company_nodes['full_address'] = company_nodes[[
+    company_nodes['full_address'] = join_columns(company_nodes, [
         'address_line_1', 'address_line_2', 'county', 'country', 'town',
         'postcode'
-    ]].fillna('').apply(
-        ','.join, axis=1)
+    ], ',')
     company_nodes['full_address'] = company_nodes['full_address'].str.replace(
         r'(,\s*){1,}', ', ')
     company_nodes['full_address'] = company_nodes['full_address'].str.strip(
@@ -129,27 +360,27 @@ def combine_company_nodes(filing_company_nodes, target_company_nodes,
         'incorporation_date', 'legal_authority', 'legal_form',
         'name', 'place_registered', 'resident_country',
         'country_of_residence_normal', 'address_country_normal', 'secret_base'
-    ]].fillna('').astype(str).groupby(
-        'uid').agg(lambda x: ' | '.join(list(set(x)))).reset_index()
-    company_nodes = company_nodes.apply(lambda x: x.str.strip('| '))
-    company_nodes = company_nodes.apply(lambda x: x.str.upper())
+    ]].fillna('').astype(str)
+    company_nodes = join_distinct_values(company_nodes, 'uid')
+    company_nodes = company_nodes.apply(
+        lambda x: x.str.strip('| ').str.upper())
     perform_unique_check(company_nodes, 'uid')
     filename = 'company_nodes'
     create_file_record(filename, 'nodes', label='Company')
     write_csv_s3_neo(company_nodes, filename, fs)
 
 
+@profiled
 def combine_person_nodes(human_officer_nodes, human_psc_nodes):
     person_nodes = pd.concat([human_officer_nodes, human_psc_nodes],
                              axis=0,
                              ignore_index=True,
                              sort=True)
     person_nodes.drop_duplicates(inplace=True)
-    person_nodes['full_address'] = person_nodes[[
+    person_nodes['full_address'] = join_columns(person_nodes, [
         'address_line_1', 'address_line_2', 'care_of', 'po_box', 'county',
         'locality', 'country', 'town', 'postcode'
-    ]].fillna('').apply(
-        ', '.join, axis=1)
+    ], ', ')
     person_nodes['full_address'] = person_nodes['full_address'].str.replace(
         r'(,\s*){1,}', ', ')
     person_nodes['full_address'] = person_nodes['full_address'].str.strip(', ')
@@ -166,12 +397,12 @@ def combine_person_nodes(human_officer_nodes, human_psc_nodes):
         'psc_likely_disqualified_director', 'possible_politician',
         'politician_leg_country', 'politician_leg_name',
         'politician_active_periods'
-    ]].fillna('').astype(str).groupby(
-        'uid').agg(lambda x: ' | '.join(list(set(x)))).reset_index()
+    ]].fillna('').astype(str)
+    person_nodes = join_distinct_values(person_nodes, 'uid')
     person_nodes['join_id'] = person_nodes['join_id'].str.split(
-        ' | ').apply(lambda x: x[0])
-    person_nodes = person_nodes.apply(lambda x: x.str.strip('| '))
-    person_nodes = person_nodes.apply(lambda x: x.str.upper())
+        ' | ').str[0]
+    person_nodes = person_nodes.apply(
+        lambda x: x.str.strip('| ').str.upper())
     person_nodes = person_nodes.apply(lambda x: x.str.replace(
         r'(\\)$', ''))  # neo was assuming excaped speechmarks in one place
     create_probable_same_person_edges(person_nodes)
@@ -181,21 +412,31 @@ def combine_person_nodes(human_officer_nodes, human_psc_nodes):
     write_csv_s3_neo(person_nodes, filename, fs)
 
 
+def join_columns(df, columns, separator):
+    # the values of columns in each row joined by separator, missing values
+    # as ''
+    output = df[columns[0]].fillna('')
+    for col in columns[1:]:
+        output = output + separator + df[col].fillna('')
+    return output
+
+
+@profiled
 def prepare_filing_company_data(active_psc_records, active_psc_statements,
                                 active_exemptions, live_companies):
     temp_1 = pd.merge(
         live_companies,
-        active_psc_records.drop('company_name', axis=1),
+        active_psc_records[['company_number']],
         on='company_number',
         how='outer')  # include all live compamies
     temp_2 = pd.merge(
         live_companies,
-        active_psc_statements.drop('company_name', axis=1),
+        active_psc_statements[['company_number']],
         on='company_number',
         how='outer')
     temp_3 = pd.merge(
         live_companies,
-        active_exemptions.drop('company_name', axis=1),
+        active_exemptions[['company_number']],
         on='company_number',
         how='outer')
     active_filing_company_psc = pd.concat([temp_1, temp_2, temp_3], sort=False)
@@ -207,6 +448,7 @@ def prepare_filing_company_data(active_psc_records, active_psc_statements,
     return active_filing_company_nodes
 
 
+@profiled
 def prepare_target_company_data(active_psc_records):
     active_target_company_psc = active_psc_records[
         active_psc_records.kind ==
@@ -229,6 +471,7 @@ def prepare_target_company_data(active_psc_records):
     return active_target_company_nodes
 
 
+@profiled
 def prepare_human_psc_data(active_psc_records):
     active_human_psc = active_psc_records[
         active_psc_records.kind ==
@@ -250,6 +493,7 @@ def prepare_human_psc_data(active_psc_records):
     return active_human_psc_nodes
 
 
+@profiled
 def prepare_legal_person_psc_data(active_psc_records):
     active_legal_psc = active_psc_records[
         active_psc_records.kind ==
@@ -263,7 +507,8 @@ def prepare_legal_person_psc_data(active_psc_records):
     create_legal_person_psc_edges(active_legal_psc)
 
 
-def prepare_psc_exemptions_data(active_exmemptions):
+@profiled
+def prepare_psc_exemptions_data(active_psc_records):
     active_exemptions_psc = active_psc_records[active_psc_records.kind ==
                                                'exemptions'].copy()
     active_exemptions_psc['uid'] = active_exemptions_psc['etag'].copy()
@@ -272,6 +517,7 @@ def prepare_psc_exemptions_data(active_exmemptions):
     create_exemption_edges(active_exemptions_psc)
 
 
+@profiled
 def prepare_psc_statements_data(active_psc_statements):
     active_psc_statements['uid'] = active_psc_statements['etag']
     active_psc_statements.drop_duplicates(inplace=True)
@@ -279,6 +525,7 @@ def prepare_psc_statements_data(active_psc_statements):
     create_statement_edges(active_psc_statements)
 
 
+@profiled
 def prepare_super_secure_data(active_psc_records):
     active_super_secure_psc = active_psc_records[
         active_psc_records.kind ==
@@ -289,6 +536,7 @@ def prepare_super_secure_data(active_psc_records):
     create_super_secure_edges(active_super_secure_psc)
 
 
+@profiled
 def prepare_address_data(live_companies):
     active_addresses = live_companies.melt(
         id_vars=['regaddress_postcode'], value_vars=['company_number'])
@@ -298,6 +546,7 @@ def prepare_address_data(live_companies):
     create_address_edges(active_addresses)
 
 
+@profiled
 def prepare_human_officer_data(active_officers):
     active_officers_humans = active_officers[
         active_officers.corporate_indicator != 'Y'].copy()
@@ -318,6 +567,7 @@ def prepare_human_officer_data(active_officers):
     return active_officers_humans_nodes
 
 
+@profiled
 def prepare_company_officer_data(active_officers, live_companies):
     active_officers_companies = active_officers[
         active_officers.corporate_indicator == 'Y'].copy()
@@ -782,6 +1032,7 @@ def create_probable_same_person_edges(persons_nodes):
     write_csv_s3_neo(probable_id_edges, filename, fs)
 
 
+@profiled
 def write_csv_s3_neo(df, filename, fs):
     if df is None:
         print('Empty df, no CSV for {} written...'.format(filename))
@@ -896,6 +1147,7 @@ def get_edge_csvs(csv_file_records):
     return edge_records
 
 
+@profiled
 def clear_graph(graph):
     count = 1
     while count > 0:
@@ -910,6 +1162,7 @@ def clear_graph(graph):
     print('All nodes and edges deleted, plus constraints dropped')
 
 
+@profiled
 def create_constraints(constraint_labels, graph):
     for label in constraint_labels:
         graph.run(
@@ -917,6 +1170,7 @@ def create_constraints(constraint_labels, graph):
     print('Uniqueness constraints created...')
 
 
+@profiled
 def create_all_nodes(node_csvs, graph):
     print('Running node creation queries...')
     for record in node_csvs:
@@ -924,6 +1178,7 @@ def create_all_nodes(node_csvs, graph):
         graph.run(cypher)
 
 
+@profiled
 def create_all_edges(edge_csvs, graph):
     print('Running edge creation queries...')
     for record in edge_csvs:
@@ -0,0 +1,284 @@
+#!/usr/bin/env
+
+import os
+import ast
+import json
+import pickle
+import re
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+from multiprocessing.connection import wait
+import profiling
+from reference_data import remote_file_version
+
+# results of completed stages, named by a hash of everything that feeds the
+# stage so an unchanged stage can be skipped on the next run
+CHECKPOINT_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'psc_checkpoints')
+
+
+def create_stage(name,
+                 function,
+                 depends_on=None,
+                 input_paths=None,
+                 output_paths=None,
+                 memory_mb=0):
+    # function is called with the results of the depends_on stages in order.
+    # input_paths are the S3 files (or directories, ending in /) the stage
+    # reads and output_paths the S3 files it writes, a stage whose outputs
+    # have gone missing is run again. memory_mb is a rough estimate of the
+    # stage's peak memory, used when stages run concurrently
+    return {
+        'name': name,
+        'function': function,
+        'depends_on': depends_on or [],
+        'input_paths': input_paths or [],
+        'output_paths': output_paths or [],
+        'memory_mb': memory_mb
+    }
+
+
+def run_stages(stages,
+               fs,
+               code_version,
+               settings,
+               use_checkpoints=True,
+               checkpoint_dir=CHECKPOINT_DIR,
+               processes=1,
+               memory_limit_mb=None):
+    # runs stages in dependency order, skipping those with a checkpoint for
+    # their current key. The results of skipped stages are only loaded when
+    # a stage depending on them has to run. With more than one process,
+    # stages whose dependencies are done run concurrently, see
+    # run_stages_concurrently
+    keys = {}
+    to_run = []
+    for stage in order_stages(stages):
+        name = stage['name']
+        keys[name] = stage_key(stage, keys, fs, code_version, settings)
+        path = checkpoint_path(checkpoint_dir, name, keys[name])
+        if use_checkpoints and os.path.exists(path) and all(
+                fs.exists(x) for x in stage['output_paths']):
+            print('Stage {} is up to date, skipping...'.format(name))
+            continue
+        to_run.append(stage)
+    if processes > 1 and len(to_run) > 1:
+        return run_stages_concurrently(to_run, keys, fs, use_checkpoints,
+                                       checkpoint_dir, processes,
+                                       memory_limit_mb)
+    results = {}
+    for stage in to_run:
+        name = stage['name']
+        args = [
+            stage_result(x, keys[x], results, checkpoint_dir)
+            for x in stage['depends_on']
+        ]
+        print('Running stage {}...'.format(name))
+        results[name] = run_stage(stage, args, fs)
+        if use_checkpoints:
+            path = checkpoint_path(checkpoint_dir, name, keys[name])
+            save_checkpoint(path, results[name])
+            remove_stale_checkpoints(checkpoint_dir, name, path)
+    return results
+
+
+def run_stages_concurrently(stages, keys, fs, use_checkpoints,
+                            checkpoint_dir, processes, memory_limit_mb):
+    # each stage runs in a forked process as soon as the stages it depends
+    # on are done, up to processes at once. Stage results and everything
+    # else loaded before the fork are shared with the process rather than
+    # copied, its own result comes back through a pickle (its checkpoint if
+    # checkpoints are used) along with its profiling records. A stage isn't
+    # started while the memory_mb of the running stages and its own would
+    # add up to more than memory_limit_mb, unless nothing else is running
+    context = multiprocessing.get_context('fork')
+    results_dir = tempfile.mkdtemp(prefix='stage_results_')
+    result_paths = {}
+    results = {}
+    pending = list(stages)
+    running = {}
+    try:
+        while pending or running:
+            for stage in list(pending):
+                if len(running) >= processes:
+                    break
+                if any(x in running or x in [y['name'] for y in pending]
+                       for x in stage['depends_on']):
+                    continue
+                memory_mb = sum(x[1]['memory_mb'] for x in running.values())
+                if running and memory_limit_mb is not None and (
+                        memory_mb + stage['memory_mb'] > memory_limit_mb):
+                    continue
+                name = stage['name']
+                args = [
+                    stage_result(x, keys[x], results, checkpoint_dir,
+                                 result_paths.get(x))
+                    for x in stage['depends_on']
+                ]
+                result_paths[name] = checkpoint_path(
+                    checkpoint_dir, name, keys[name]
+                ) if use_checkpoints else os.path.join(
+                    results_dir, '{}.pkl'.format(name))
+                process = context.Process(
+                    target=run_stage_process,
+                    args=(stage, args, fs, result_paths[name],
+                          os.path.join(results_dir,
+                                       '{}_profile.pkl'.format(name))),
+                    name='stage_{}'.format(name))
+                print('Running stage {}...'.format(name))
+                process.start()
+                running[name] = (process, stage)
+                pending.remove(stage)
+            finished = wait([x[0].sentinel for x in running.values()])
+            for name, (process, stage) in list(running.items()):
+                if process.sentinel not in finished:
+                    continue
+                process.join()
+                del running[name]
+                if process.exitcode != 0:
+                    raise RuntimeError('Stage {} failed with exit code '
+                                       '{}'.format(name, process.exitcode))
+                with open(
+                        os.path.join(results_dir,
+                                     '{}_profile.pkl'.format(name)),
+                        'rb') as f:
+                    profiling.calls.extend(pickle.load(f))
+                print('Stage {} finished...'.format(name))
+                if use_checkpoints:
+                    remove_stale_checkpoints(checkpoint_dir, name,
+                                             result_paths[name])
+        for stage in stages:
+            stage_result(stage['name'], keys[stage['name']], results,
+                         checkpoint_dir, result_paths[stage['name']])
+    finally:
+        for process, _ in running.values():
+            process.terminate()
+            process.join()
+        shutil.rmtree(results_dir, ignore_errors=True)
+    return results
+
+
+def run_stage(stage, args, fs):
+    # the stage's input files are fetched together before it reads them
+    fs.prefetch(stage['input_paths'])
+    return stage['function'](*args)
+
+
+def run_stage_process(stage, args, fs, result_path, profile_path):
+    fs.reconnect()
+    calls_before = len(profiling.calls)
+    result = run_stage(stage, args, fs)
+    save_checkpoint(result_path, result)
+    save_checkpoint(profile_path, profiling.calls[calls_before:])
+
+
+def order_stages(stages):
+    stages_by_name = {stage['name']: stage for stage in stages}
+    output = []
+    done = set()
+    visiting = set()
+
+    def visit(stage):
+        if stage['name'] in done:
+            return
+        if stage['name'] in visiting:
+            raise ValueError('Stage {} depends on itself'.format(
+                stage['name']))
+        visiting.add(stage['name'])
+        for name in stage['depends_on']:
+            if name not in stages_by_name:
+                raise ValueError('Stage {} depends on unknown stage {}'.format(
+                    stage['name'], name))
+            visit(stages_by_name[name])
+        done.add(stage['name'])
+        output.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return output
+
+
+def stage_key(stage, keys, fs, code_version, settings):
+    key = {
+        'name': stage['name'],
+        'code': code_version,
+        'settings': settings,
+        'upstream': [keys[x] for x in stage['depends_on']],
+        'inputs': [input_version(fs, x) for x in stage['input_paths']]
+    }
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True, default=str).encode(
+            'utf-8')).hexdigest()[:16]
+
+
+def input_version(fs, path):
+    if path.endswith('/'):
+        return [[x, remote_file_version(fs.info(x))] for x in fs.ls(path)]
+    return remote_file_version(fs.info(path))
+
+
+def code_version(script_path):
+    # hash of the script and the modules alongside it that it imports,
+    # directly or through each other, so editing the benchmarks, the tests
+    # or the other script leaves its checkpoints valid
+    directory = os.path.dirname(script_path)
+    output = hashlib.sha256()
+    for filename in sorted(local_imports(script_path)):
+        output.update(filename.encode('utf-8'))
+        with open(os.path.join(directory, filename), 'rb') as f:
+            output.update(f.read())
+    return output.hexdigest()
+
+
+def local_imports(path, found=None):
+    # file names of the module at path and of the modules in its directory
+    # it imports, including imports inside functions
+    found = set() if found is None else found
+    found.add(os.path.basename(path))
+    directory = os.path.dirname(path)
+    with open(path, 'rb') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [x.name for x in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            filename = '{}.py'.format(name.split('.')[0])
+            if filename not in found and os.path.exists(
+                    os.path.join(directory, filename)):
+                local_imports(os.path.join(directory, filename), found)
+    return found
+
+
+def checkpoint_path(checkpoint_dir, name, key):
+    return os.path.join(checkpoint_dir, '{}_{}.pkl'.format(name, key))
+
+
+def stage_result(name, key, results, checkpoint_dir, path=None):
+    # path is where a stage run in another process saved its result
+    if name not in results:
+        with open(path or checkpoint_path(checkpoint_dir, name, key),
+                  'rb') as f:
+            results[name] = pickle.load(f)
+    return results[name]
+
+
+def save_checkpoint(path, result):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def remove_stale_checkpoints(checkpoint_dir, name, current_path):
+    pattern = re.compile(r'{}_[0-9a-f]{{16}}\.pkl$'.format(re.escape(name)))
+    for filename in os.listdir(checkpoint_dir):
+        path = os.path.join(checkpoint_dir, filename)
+        if pattern.match(filename) and path != current_path:
+            os.remove(path)
@@ -1,14 +1,46 @@
 #!/usr/bin/env
 
 import sys
+import os
+import io
+import json
+import ast
+import shutil
+import tempfile
+from multiprocessing import Pool
+from functools import lru_cache
+from itertools import chain
+from collections import Counter
+from contextlib import ExitStack
 import pandas as pd
-from pandas.io.json import json_normalize
-import s3fs
 import numpy as np
-
-fs = s3fs.S3FileSystem(
-    key=sys.argv[1], secret=sys.argv[2],
-    anon=False)  # create AWS S3 filesystem
+from psc_schema import (flatten_psc_data_payload, report_unknown_keys,
+                        PSC_NATURES_OF_CONTROL, PSC_DATA_FIELDS)
+from transforms import (create_join_ids, flag_any_country_in,
+                        explode_list_column, encode_values, to_categoricals,
+                        map_categories, concat_categoricals,
+                        create_type_codes, read_csv_columns,
+                        encode_company_numbers, create_company_index,
+                        in_company_index, parse_dates,
+                        create_month_year_births, format_month_year,
+                        create_interval_index, count_overlapping_intervals)
+from reference_data import fetch_reference_file
+from pipeline import create_stage, run_stages, code_version
+from profiling import (profiled, count_s3_opens, record_s3_open,
+                       write_report, print_summary)
+from columnar import (write_parquet, read_parquet, to_arrow_table,
+                      arrow_types, merge_arrow_types, create_arrow_schema,
+                      create_parquet_writer)
+from storage import create_filesystem
+from company_lookup import (create_company_lookup, save_company_lookup,
+                            load_company_lookup, in_company_lookup,
+                            lookup_company_column)
+from sampling import (create_company_sample, corporate_psc_owners,
+                      in_company_sample, sample_companies,
+                      print_company_sample, CORPORATE_PSC_KIND)
+
+fs = count_s3_opens(create_filesystem(
+    key=sys.argv[1], secret=sys.argv[2]))  # S3 or local, see storage.py
 
 ROOT_DIR = ''
 PSC_FILE_PATH = '{}raw/persons-with-significant-control-snapshot-2019-03-05.txt'.format(
@@ -20,7 +52,126 @@ DISQUALIFIED_DIRECTORS_PATH = '{}raw/disqualified_directors/'.format(ROOT_DIR)
 POLITICIANS_PATH = '{}processed/politicians.csv'.format(ROOT_DIR)
 URL_COMPANY_CODES_PATH = '{}interim/companies_house_url_type_codes.csv'.format(
     ROOT_DIR)
-
+SECRET_JURISDICTIONS_PATH = '{}interim/secret_jurisdictions.csv'.format(
+    ROOT_DIR)
+RLE_COUNTRIES_PATH = '{}interim/recognised_stock_exchange_countries.csv'.format(
+    ROOT_DIR)
+REGISTERED_COUNTRY_CLEANER_MAP_PATH = '{}interim/registered_country_cleaner_map.csv'.format(
+    ROOT_DIR)
+ADDRESS_COUNTRY_CLEANER_MAP_PATH = '{}interim/address_country_cleaner_map.csv'.format(
+    ROOT_DIR)
+# number of snapshot lines per chunk when streaming the PSC JSON, set to None
+# to load the whole snapshot into memory in one go
+PSC_CHUNK_SIZE = None
+# reuse the previous run's processed PSC outputs for every snapshot record
+# whose company_number and etag are unchanged, only new and changed records
+# go through the derived column logic. Takes precedence over PSC_CHUNK_SIZE
+PSC_INCREMENTAL = False
+# officer files are read and filtered to live companies in parallel, None
+# uses one process per CPU
+OFFICERS_READ_PROCESSES = None
+# officer file columns kept after standardising the names, None keeps all
+OFFICERS_COLUMNS = [
+    'company_number', 'person_number', 'appointment_date', 'appointment_type',
+    'corporate_indicator', 'partial_date_of_birth', 'title', 'forenames',
+    'surname', 'honours', 'occupation', 'nationality', 'resident_country',
+    'address_line_1', 'address_line_2', 'post_town', 'county', 'country',
+    'person_postcode'
+]
+# country columns normalized by normalize_countries, as the raw column, the
+# normalized column and whether it is cleaned with the cleaner maps rather
+# than only upper cased. Addresses and registered countries are cleaned the
+# same way for PSCs and officers
+PSC_COUNTRY_COLUMNS = [
+    ('address_country', 'address_country_normal', True),
+    ('identification_country_registered', 'registered_country_normal', True),
+    ('country_of_residence', 'country_of_residence_normal', False),
+]
+OFFICERS_COUNTRY_COLUMNS = [
+    ('resident_country', 'country_of_residence_normal', False),
+    ('country', 'address_country_normal', True),
+]
+# formats the processed tables are written in, add 'parquet' to also write
+# typed columnar copies that keep dtypes, dates, booleans and list columns
+# (needs pyarrow)
+OUTPUT_FORMATS = ['csv']
+# parquet types of the PSC tables' columns, as columnar.declared_arrow_type
+# kinds, so the tables get the same schema whether they are written in one go
+# or streamed in chunks, whichever values each chunk happens to hold
+PSC_COLUMN_KINDS = dict(
+    [(path.replace('.', '_'), kind) for path, kind in PSC_DATA_FIELDS] + [
+        (x, 'string') for x in [
+            'company_number', 'join_id', 'politician_leg_country',
+            'politician_leg_name', 'politician_active_periods',
+            'company_name', 'company_first_and_postcode', 'nature_of_control'
+        ]
+    ] + [(x, 'category') for x in [
+        'type_codes', 'company_type', 'address_country_normal',
+        'registered_country_normal', 'country_of_residence_normal'
+    ]] + [(x, 'bool') for x in [
+        'possible_politician', 'psc_politician_in_office_when_notified',
+        'psc_control_overlaps_politician_term', 'secret_base',
+        'non_rle_country', 'psc_likely_disqualified_director',
+        'psc_disqualified_when_notified',
+        'psc_control_overlaps_disqualification'
+    ]] + [('month_year_birth', 'timestamp'),
+          ('nature_of_control_code', 'int32')])
+# BasicCompanyData columns kept after standardising the names, those the
+# pipeline, the Neo4J company nodes and the analysis notebook use. The rest
+# are never parsed, None keeps all
+LIVE_COMPANIES_COLUMNS = [
+    'companyname', 'companynumber', 'regaddress_addressline1',
+    'regaddress_addressline2', 'regaddress_posttown', 'regaddress_county',
+    'regaddress_country', 'regaddress_postcode', 'companycategory',
+    'countryoforigin', 'dissolutiondate', 'incorporationdate'
+] + [
+    'previousname_{}_{}'.format(i, x) for i in range(1, 11)
+    for x in ['condate', 'companyname']
+]
+# low-cardinality columns held as pandas categoricals from load onwards so
+# comparisons, isin, groupby and map work on integer codes, the PSC snapshot
+# categoricals are declared in psc_schema.PSC_DATA_FIELDS
+LIVE_COMPANIES_CATEGORICAL_COLUMNS = [
+    'regaddress_posttown', 'regaddress_county', 'regaddress_country',
+    'companycategory', 'countryoforigin'
+]
+OFFICERS_CATEGORICAL_COLUMNS = [
+    'corporate_indicator', 'title', 'honours', 'occupation', 'nationality',
+    'resident_country', 'post_town', 'county', 'country'
+]
+# skip pipeline stages whose code, settings and inputs are unchanged since
+# they last completed, see pipeline.CHECKPOINT_DIR
+USE_CHECKPOINTS = True
+# stages that don't depend on each other run at the same time in up to this
+# many forked processes, 1 runs them one after another in this process
+STAGE_PROCESSES = 4
+# no stage is started alongside others if their peak memory estimates would
+# add up to more than this, None for no limit. The estimates are rough peaks
+# on the full data, the profiling reports give the current ones
+STAGE_MEMORY_LIMIT_MB = 100000
+STAGE_MEMORY_MB = {
+    'company_sample': 2000,
+    'live_companies': 8000,
+    'disqualified_directors': 500,
+    'politicians': 100,
+    'psc': 60000,
+    'officers': 25000
+}
+# snapshot fields create_additional_columns_all_records reads, a chunk may not
+# contain all of them when streaming
+PSC_DERIVED_INPUT_COLUMNS = [
+    'date_of_birth_year', 'date_of_birth_month', 'name_elements_forename',
+    'name_elements_surname', 'address_country',
+    'identification_country_registered', 'country_of_residence', 'kind',
+    'notified_on', 'ceased_on'
+]
+
+# 'test' runs on the first rows of each file and a test JSON, 'sample' on a
+# hash sample of the companies that keeps the inputs joined, see sampling.py.
+# Both write to test-output/
+nrows = None
+sample_fraction = None
+test_run = False
 try:
     if sys.argv[3] == 'test':
         nrows = int(sys.argv[4])
@@ -29,36 +180,117 @@ try:
         print(
             'Running on sample of {} records per file and test JSON...'.format(
                 str(nrows)))
+    elif sys.argv[3] == 'sample':
+        sample_fraction = float(sys.argv[4])
+        test_run = True
+        print('Running on a sample of {:.2%} of companies...'.format(
+            sample_fraction))
     else:
-        nrows = None
         print('Running on full data...')
 except Exception:
-    nrows = None
-    test_run = False
     print('Running on full data...')
 
 
 def main():
-    live_companies_list, live_company_map = process_live_companies(
-        LIVE_COMPANIES_PATH)
-    disqualified_directors = process_disqualified_directors_data(
-        DISQUALIFIED_DIRECTORS_PATH)
-    politicians = process_politicians(POLITICIANS_PATH)
-    process_psc_data(PSC_FILE_PATH, live_companies_list, live_company_map,
-                     disqualified_directors, politicians)
-    process_officers(OFFICERS_DIRECTORY_PATH, live_companies_list, politicians)
+    reference_paths = [
+        URL_COMPANY_CODES_PATH, SECRET_JURISDICTIONS_PATH, RLE_COUNTRIES_PATH,
+        REGISTERED_COUNTRY_CLEANER_MAP_PATH, ADDRESS_COUNTRY_CLEANER_MAP_PATH
+    ]
+    # when sampling, the sample is picked first and the live companies and
+    # PSC stages are passed it
+    sample_stages = [
+        create_stage(
+            'company_sample',
+            lambda: create_psc_company_sample(PSC_FILE_PATH, sample_fraction),
+            input_paths=[PSC_FILE_PATH],
+            memory_mb=STAGE_MEMORY_MB['company_sample'])
+    ] if sample_fraction is not None else []
+    sample_depends_on = [x['name'] for x in sample_stages]
+    stages = sample_stages + [
+        create_stage(
+            'live_companies',
+            lambda *company_sample: process_live_companies(
+                LIVE_COMPANIES_PATH, *company_sample),
+            depends_on=sample_depends_on,
+            input_paths=[LIVE_COMPANIES_PATH, URL_COMPANY_CODES_PATH],
+            output_paths=output_paths(['companies']),
+            memory_mb=STAGE_MEMORY_MB['live_companies']),
+        create_stage(
+            'disqualified_directors',
+            lambda: process_disqualified_directors_data(
+                DISQUALIFIED_DIRECTORS_PATH),
+            input_paths=[DISQUALIFIED_DIRECTORS_PATH],
+            output_paths=output_paths(['disqualified_directors']),
+            memory_mb=STAGE_MEMORY_MB['disqualified_directors']),
+        create_stage(
+            'politicians',
+            lambda: process_politicians(POLITICIANS_PATH),
+            input_paths=[POLITICIANS_PATH],
+            memory_mb=STAGE_MEMORY_MB['politicians']),
+        create_stage(
+            'psc',
+            lambda live_companies, disqualified_directors, politicians, *
+            company_sample: process_psc_data(
+                PSC_FILE_PATH, live_companies, disqualified_directors,
+                politicians, *company_sample),
+            depends_on=[
+                'live_companies', 'disqualified_directors', 'politicians'
+            ] + sample_depends_on,
+            input_paths=[PSC_FILE_PATH] + reference_paths,
+            output_paths=output_paths([
+                'active_psc_records', 'ceased_psc_records',
+                'active_psc_statements', 'ceased_psc_statements',
+                'active_exemption_records', 'ceased_exemption_records',
+                'active_psc_controls', 'active_psc_controls_encoded',
+                'psc_control_types'
+            ]),
+            memory_mb=STAGE_MEMORY_MB['psc']),
+        create_stage(
+            'officers',
+            lambda live_companies, politicians, disqualified_directors:
+            process_officers(OFFICERS_DIRECTORY_PATH, live_companies,
+                             politicians, disqualified_directors),
+            depends_on=[
+                'live_companies', 'politicians', 'disqualified_directors'
+            ],
+            input_paths=[OFFICERS_DIRECTORY_PATH, SECRET_JURISDICTIONS_PATH],
+            output_paths=output_paths(['active_officers']),
+            memory_mb=STAGE_MEMORY_MB['officers']),
+    ]
+    try:
+        run_stages(
+            stages,
+            fs,
+            code_version(os.path.abspath(__file__)),
+            settings={
+                'root_dir': ROOT_DIR,
+                'nrows': nrows,
+                'test_run': test_run,
+                'sample_fraction': sample_fraction,
+                'output_formats': OUTPUT_FORMATS,
+                'officers_columns': OFFICERS_COLUMNS,
+                'live_companies_columns': LIVE_COMPANIES_COLUMNS
+            },
+            use_checkpoints=USE_CHECKPOINTS,
+            processes=STAGE_PROCESSES,
+            memory_limit_mb=STAGE_MEMORY_LIMIT_MB)
+    finally:
+        write_report('process_company_data')
+        print_summary()
     print('Script finished!')
 
 
+@profiled
 def process_disqualified_directors_data(disqualfied_directors_path):
     disqualified_directors = read_disqualified_directors(
         DISQUALIFIED_DIRECTORS_PATH)
     disqualified_directors = create_additional_columns_diqual_directors(
         disqualified_directors)
-    write_csv_s3(disqualified_directors, 'disqualified_directors', fs)
+    write_output_s3(disqualified_directors, 'disqualified_directors', fs)
     return disqualified_directors
 
 
+@profiled
 def process_politicians(politicians_path):
     df = pd.read_csv(fs.open(politicians_path))
     output_df = df[['join_id', 'leg_country', 'leg_name',
@@ -67,73 +299,351 @@ def process_politicians(politicians_path):
         'join_id', 'politician_leg_country', 'politician_leg_name',
         'politician_active_periods'
     ]
-    return output_df
+    return create_politician_index(output_df)
+
+
+def create_politician_index(df):
+    # one row per join_id, indexed by it. A join_id can be shared by several
+    # EveryPolitician memberships, their distinct values are joined with
+    # ' | ' as the Neo4J nodes join the values of a person's rows
+    df = df.dropna(subset=['join_id'])
+    return df.groupby('join_id', sort=False).agg(
+        lambda x: ' | '.join(x.dropna().astype(str).unique()) or np.nan)
+
+
+def create_politician_terms(politicians):
+    # the active periods of the politician index, 'start -> end' with '?'
+    # for unknown dates, as intervals for count_overlapping_intervals
+    periods = politicians.politician_active_periods.dropna().str.split(
+        r' \| |, ').reset_index()
+    periods = explode_list_column(periods, 'politician_active_periods',
+                                  'period', ['join_id'])
+    dates = periods.period.str.split(' -> ', n=1)
+    return create_interval_index(periods.join_id, parse_dates(dates.str[0]),
+                                 parse_dates(dates.str[1]))
+
+
+def create_disqualification_periods(disqualified_directors):
+    return create_interval_index(
+        disqualified_directors.join_id,
+        disqualified_directors.disqual_start_date_formatted,
+        disqualified_directors.disqual_end_date_formatted)
+
+
+def add_period_matches(df, periods, starts, ends, during_col, overlaps_col):
+    # flags the rows whose join_id has one of periods running on their start
+    # date in during_col, and one overlapping the time from their start to
+    # their end in overlaps_col. A missing end is still ongoing
+    df[during_col] = count_overlapping_intervals(periods, df.join_id, starts,
+                                                 starts) > 0
+    df[overlaps_col] = count_overlapping_intervals(periods, df.join_id,
+                                                   starts, ends) > 0
+    return df
 
 
-def process_psc_data(psc_file_path, live_companies_list, live_company_map,
-                     disqualified_directors, politicians):
-    url_company_codes, url_company_codes_s = create_url_company_codes(
-        URL_COMPANY_CODES_PATH)
+def psc_notified_on(df):
+    return parse_dates(df.notified_on, format='%Y-%m-%d')
+
+
+def psc_ceased_on(df):
+    # not in the snapshot when no record of it has ceased
+    if 'ceased_on' not in df.columns:
+        return pd.Series(pd.NaT, index=df.index)
+    return parse_dates(df.ceased_on, format='%Y-%m-%d')
+
+
+def add_politician_columns(df, politicians):
+    # flags the rows whose join_id is in the politician index and looks up
+    # its columns, one output row per row of df
+    positions = politicians.index.get_indexer(df.join_id)
+    df['possible_politician'] = positions >= 0
+    for col in politicians.columns:
+        # the last value is for the rows not in the index
+        values = np.append(politicians[col].values.astype(object), np.nan)
+        df[col] = values[positions]
+    print('Added politician field and associated data...')
+    return df
+
+
+@profiled
+def process_psc_data(psc_file_path, live_company_lookup,
+                     disqualified_directors, politicians,
+                     company_sample=None):
+    if PSC_INCREMENTAL:
+        if company_sample is not None:
+            raise ValueError('PSC_INCREMENTAL patches the outputs of a full '
+                             'run and cannot be sampled')
+        process_psc_data_incremental(psc_file_path, live_company_lookup,
+                                     disqualified_directors, politicians)
+        return
+    if PSC_CHUNK_SIZE:
+        process_psc_data_streaming(psc_file_path, live_company_lookup,
+                                   disqualified_directors, politicians,
+                                   PSC_CHUNK_SIZE, company_sample)
+        return
     psc_json_path = PSC_FILE_PATH
-    all_records = read_psc_json(fs.open(psc_json_path))
+    all_records = read_psc_json(
+        open_psc_snapshot(psc_json_path, company_sample))
     all_records = remove_no_record_rows(all_records)
     all_records.columns = standardise_columns(all_records.columns)
     all_records = create_additional_columns_all_records(
-        all_records, live_company_map, disqualified_directors, politicians)
+        all_records, live_company_lookup, disqualified_directors, politicians)
+    write_psc_outputs(all_records, live_company_lookup)
+    print('Processed PSC data')
+
+
+@profiled
+def write_psc_outputs(all_records, live_company_lookup):
     psc_records = create_records_psc_df(all_records)
     psc_records, exemption_records = split_exemptions_from_psc_records(
         psc_records)
     active_psc_records, ceased_psc_records = split_active_ceased(
-        psc_records, live_companies_list)
+        psc_records, live_company_lookup)
     active_psc_controls = create_psc_controls_df(active_psc_records)
+    control_types = create_control_types()
+    active_psc_controls_encoded = encode_psc_controls(active_psc_controls,
+                                                      control_types)
     active_exemption_records, ceased_exemption_records = split_active_ceased(
-        exemption_records, live_companies_list)
+        exemption_records, live_company_lookup)
     psc_statements = create_psc_statements_df(all_records)
     active_psc_statements, ceased_psc_statements = split_active_ceased(
-        psc_statements, live_companies_list)
-    write_csv_s3(active_psc_records, 'active_psc_records', fs)
-    write_csv_s3(ceased_psc_records, 'ceased_psc_records', fs)
-    write_csv_s3(active_psc_statements, 'active_psc_statements', fs)
-    write_csv_s3(ceased_psc_statements, 'ceased_psc_statements', fs)
-    write_csv_s3(active_exemption_records, 'active_exemption_records', fs)
-    write_csv_s3(ceased_exemption_records, 'ceased_exemption_records', fs)
-    write_csv_s3(active_psc_controls, 'active_psc_controls', fs)
+        psc_statements, live_company_lookup)
+    write_output_s3(active_psc_records, 'active_psc_records', fs,
+                    PSC_COLUMN_KINDS)
+    write_output_s3(ceased_psc_records, 'ceased_psc_records', fs,
+                    PSC_COLUMN_KINDS)
+    write_output_s3(active_psc_statements, 'active_psc_statements', fs,
+                    PSC_COLUMN_KINDS)
+    write_output_s3(ceased_psc_statements, 'ceased_psc_statements', fs,
+                    PSC_COLUMN_KINDS)
+    write_output_s3(active_exemption_records, 'active_exemption_records',
+                    fs, PSC_COLUMN_KINDS)
+    write_output_s3(ceased_exemption_records, 'ceased_exemption_records',
+                    fs, PSC_COLUMN_KINDS)
+    write_output_s3(active_psc_controls, 'active_psc_controls', fs,
+                    PSC_COLUMN_KINDS)
+    write_output_s3(active_psc_controls_encoded,
+                    'active_psc_controls_encoded', fs, PSC_COLUMN_KINDS)
+    write_output_s3(
+        create_control_types_df(control_types), 'psc_control_types', fs)
+
+
+@profiled
+def process_psc_data_incremental(psc_file_path, live_company_lookup,
+                                 disqualified_directors, politicians):
+    # patches the previous run's outputs: rows of records still in the
+    # snapshot with the same etag are kept as they were, apart from the
+    # lookups on the monthly company and disqualification files, records that
+    # are new or changed are derived afresh and records no longer in the
+    # snapshot are dropped. Rows are put back in snapshot order
+    previous_records = read_previous_psc_outputs()
+    previous_keys = set(
+        zip(previous_records.company_number, previous_records.etag))
+    delta, unchanged = read_psc_json_delta(
+        fs.open(psc_file_path), previous_keys)
+    all_records = remove_no_record_rows(delta)
+    all_records.columns = standardise_columns(all_records.columns)
+    all_records = add_previous_snapshot_columns(all_records,
+                                                previous_records)
+    all_records['snapshot_line'] = all_records.index
+    padding = pad_derived_input_columns(all_records)
+    all_records = create_additional_columns_all_records(
+        all_records, live_company_lookup, disqualified_directors, politicians)
+    all_records.drop(columns=padding, inplace=True)
+    reused_records = reuse_previous_records(previous_records, unchanged)
+    reused_records = add_company_and_disqualification_columns(
+        reused_records, live_company_lookup, disqualified_directors)
+    # dates read back as text would be written with a time once mixed with
+    # the new records' dates
+    for col in all_records.select_dtypes(['datetime64']).columns:
+        reused_records[col] = parse_dates(reused_records[col])
+    print('Reused {} unchanged PSC records and derived {} new or changed '
+          'ones, {} previous records were changed or removed...'.format(
+              len(reused_records), all_records.snapshot_line.nunique(),
+              len(previous_keys) - len(unchanged)))
+    all_records = pd.concat(
+        [all_records, reused_records], ignore_index=True,
+        sort=False)[all_records.columns]
+    all_records.sort_values('snapshot_line', kind='mergesort', inplace=True)
+    all_records.drop(columns=['snapshot_line'], inplace=True)
+    write_psc_outputs(all_records, live_company_lookup)
     print('Processed PSC data')
 
 
-def process_live_companies(live_companies_path):
-    url_company_codes, url_company_codes_s = create_url_company_codes(
-        URL_COMPANY_CODES_PATH)
+def reuse_previous_records(previous_records, unchanged):
+    # a previous row of each unchanged (company_number, etag) for every line
+    # of the snapshot with that key, so lines the snapshot repeats are all
+    # kept as a full run would keep them
+    first_rows = previous_records[~previous_records.duplicated(
+        ['company_number', 'etag'])]
+    lines = pd.Series(
+        list(zip(first_rows.company_number, first_rows.etag)),
+        index=first_rows.index).map(unchanged).dropna()
+    output_df = first_rows.loc[lines.index.repeat(lines.map(len))]
+    output_df = output_df.reset_index(drop=True)
+    output_df['snapshot_line'] = list(chain.from_iterable(lines))
+    return output_df
+
+
+def add_previous_snapshot_columns(df, previous_records):
+    # the delta only has the snapshot fields its own records have, those
+    # only the reused records have are added empty so the outputs keep the
+    # fields a full run would write, in the same order
+    found = set(df.columns).union(previous_records.columns)
+    columns = ['company_number'] + [
+        x for x in standardise_columns(flatten_psc_data_payload.columns)
+        if x in found
+    ]
+    output_df = df.reindex(columns=columns)
+    for col in columns:
+        if col not in df.columns:
+            output_df[col] = output_df[col].astype(object)
+    return output_df
+
+
+@profiled
+def read_previous_psc_outputs():
+    frames = []
+    for filename in [
+            'active_psc_records', 'ceased_psc_records',
+            'active_psc_statements', 'ceased_psc_statements',
+            'active_exemption_records', 'ceased_exemption_records'
+    ]:
+        if 'parquet' in OUTPUT_FORMATS:
+            path = output_path(filename, 'parquet')
+            if fs.exists(path):
+                frames.append(read_parquet(fs.open(path)))
+        else:
+            path = output_path(filename)
+            # read as text so reused rows are written back exactly as they
+            # were, apart from the lists the controls tables are built from
+            if fs.exists(path):
+                frames.append(
+                    pd.read_csv(
+                        fs.open(path),
+                        dtype=str,
+                        converters={'natures_of_control': parse_list},
+                        low_memory=False))
+    if not frames:
+        raise ValueError('PSC_INCREMENTAL needs the PSC outputs of a '
+                         'previous run, none were found')
+    output_df = pd.concat(frames, ignore_index=True, sort=False)
+    print('Read previous PSC outputs...')
+    return output_df
+
+
+def parse_list(x):
+    return ast.literal_eval(x) if x else np.nan
+
+
+@profiled
+def process_psc_data_streaming(psc_file_path, live_company_lookup,
+                               disqualified_directors, politicians,
+                               chunksize, company_sample=None):
+    # same outputs as process_psc_data but only one chunk of the snapshot is
+    # held in memory at a time, partial tables are spilled to local disk
+    spill_dir = tempfile.mkdtemp(prefix='psc_spill_')
+    spills = {
+        name: create_spill(spill_dir, name)
+        for name in ['psc_records', 'exemption_records', 'psc_statements']
+    }
+    snapshot_columns = []
+    derived_columns = []
+    control_types = create_control_types()
+    try:
+        for chunk, includes_last_line in read_psc_json_chunks(
+                open_psc_snapshot(psc_file_path, company_sample), chunksize):
+            snapshot_columns.append(list(chunk.columns[1:]))
+            all_records = remove_no_record_rows(chunk, includes_last_line)
+            if all_records.empty:
+                continue
+            all_records.columns = standardise_columns(all_records.columns)
+            padding = pad_derived_input_columns(all_records)
+            all_records = create_additional_columns_all_records(
+                all_records, live_company_lookup, disqualified_directors,
+                politicians)
+            all_records.drop(columns=padding, inplace=True)
+            derived_columns = list(all_records.columns[len(chunk.columns):])
+            psc_records = create_records_psc_df(all_records)
+            psc_records, exemption_records = split_exemptions_from_psc_records(
+                psc_records)
+            psc_statements = create_psc_statements_df(all_records)
+            spill_partial(spills['psc_records'], psc_records,
+                          live_company_lookup)
+            spill_partial(spills['exemption_records'], exemption_records,
+                          live_company_lookup)
+            spill_partial(spills['psc_statements'], psc_statements,
+                          live_company_lookup)
+            del chunk, all_records, psc_records, exemption_records
+            del psc_statements
+        columns = standardise_columns(
+            ['company_number'] +
+            merge_snapshot_columns(snapshot_columns)) + derived_columns
+        write_spilled_active_ceased(spills['psc_records'], columns,
+                                    live_company_lookup, 'active_psc_records',
+                                    'ceased_psc_records',
+                                    controls_filename='active_psc_controls',
+                                    control_types=control_types)
+        write_spilled_active_ceased(
+            spills['psc_statements'], columns, live_company_lookup,
+            'active_psc_statements', 'ceased_psc_statements')
+        write_spilled_active_ceased(
+            spills['exemption_records'], columns, live_company_lookup,
+            'active_exemption_records', 'ceased_exemption_records')
+        write_output_s3(
+            create_control_types_df(control_types), 'psc_control_types', fs)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    print('Processed PSC data')
+
+
+@profiled
+def process_live_companies(live_companies_path, company_sample=None):
     live_companies = load_live_companies(fs.open(live_companies_path))
     live_companies = clean_live_companies(live_companies)
+    live_companies = sample_companies(live_companies, company_sample)
     live_companies = create_additional_columns_live_companies(live_companies)
-    write_csv_s3(live_companies, 'companies', fs)
-    live_companies_list = live_companies.company_number.unique().tolist()
-    live_company_map = live_companies[[
-        'company_number', 'company_name', 'first_and_postcode'
-    ]].set_index('company_number')
+    write_output_s3(live_companies, 'companies', fs)
+    # membership tests and lookups on company number compare integer codes
+    codes = encode_company_numbers(live_companies.company_number)
+    if (codes < 0).any():
+        print('{} live company numbers could not be encoded and are treated '
+              'as not live...'.format((codes < 0).sum()))
+    live_company_lookup = create_company_lookup(
+        codes, {
+            'company_name': live_companies.company_name,
+            'first_and_postcode': live_companies.first_and_postcode
+        })
     print('Processed live companies')
-    return live_companies_list, live_company_map
+    return live_company_lookup
 
 
-def process_officers(officers_directory_path, live_companies_list,
-                     politicians):
+@profiled
+def process_officers(officers_directory_path, live_company_lookup,
+                     politicians, disqualified_directors):
     officers_people_files = get_officers_files(fs.ls(officers_directory_path))
-    officers = read_officers(officers_directory_path, officers_people_files)
-    officers.columns = standardise_columns(officers.columns)
-    active_officers = filter_active_officers(officers, live_companies_list)
-    active_officers = add_additional_columns_officers(active_officers,
-                                                      politicians)
-    write_csv_s3(active_officers, 'active_officers', fs)
+    active_officers = read_officers(
+        officers_directory_path, officers_people_files, live_company_lookup)
+    active_officers = add_additional_columns_officers(
+        active_officers, politicians, disqualified_directors)
+    write_output_s3(active_officers, 'active_officers', fs)
     print('Processed officers')
 
 
+@profiled
 def load_live_companies(path):
-    output = pd.read_csv(path, low_memory=False, nrows=nrows)
+    output = read_csv_columns(
+        path,
+        is_live_companies_column,
+        lambda x: standardise_column(x.strip()) in
+        LIVE_COMPANIES_CATEGORICAL_COLUMNS,
+        low_memory=False,
+        nrows=nrows)
     print('Loaded live companies...')
     return output
 
 
+@profiled
 def clean_live_companies(df):
     output = df.copy()
     output.columns = [x.strip() for x in output.columns]
@@ -148,30 +658,34 @@ def clean_live_companies(df):
     return output
 
 
+@profiled
 def create_additional_columns_live_companies(df):
     url_company_codes, url_company_codes_s = create_url_company_codes(
         URL_COMPANY_CODES_PATH)
     output = df.copy()
     output['first_and_postcode'] = output[
         'regaddress_addressline1'] + '-' + output['regaddress_postcode']
-    output['incorporation_date_formatted'] = pd.to_datetime(
-        output['incorporationdate'], errors='coerce', format='%d/%m/%Y')
-    output['type_codes'] = output.company_number.apply(company_code_creator)
-    output['company_type'] = output.type_codes.map(url_company_codes_s)
+    output['incorporation_date_formatted'] = parse_dates(
+        output['incorporationdate'], format='%d/%m/%Y')
+    output['type_codes'] = create_type_codes(output.company_number)
+    output['company_type'] = map_categories(
+        output.type_codes, lambda x: x.map(url_company_codes_s))
     output['psc_regime_applies'] = psc_regime_applies(output)
     print('Created additional columns in live companies...')
     return output
 
 
-def company_code_creator(x):
-    if x[:2].isdigit():
-        return 'EAW'
-    else:
-        return x[:2]
+def is_live_companies_column(column):
+    return LIVE_COMPANIES_COLUMNS is None or standardise_column(
+        column.strip()) in LIVE_COMPANIES_COLUMNS
 
 
+# reference tables are read once per process and handed out to every caller,
+# callers must not modify them
+@lru_cache(maxsize=None)
 def create_url_company_codes(path):
-    url_company_codes = pd.read_csv(fs.open(path), keep_default_na=False)
+    url_company_codes = pd.read_csv(
+        fetch_reference_file(fs, path), keep_default_na=False)
     url_company_codes.columns = standardise_columns(url_company_codes)
     url_company_codes_s = pd.Series(
         url_company_codes['company_type'].values,
@@ -180,20 +694,27 @@ def create_url_company_codes(path):
 
 
 def psc_regime_applies(df):
-    url_company_codes, url_company_codes_s = create_url_company_codes(
+    excludedcompanytypes = create_excluded_company_types(
         URL_COMPANY_CODES_PATH)
-    excludedcompanytypes = url_company_codes[
-        url_company_codes['excluded_from_psc'] == 'X']['prefix'].tolist()
     excludedcompanycategories = [
         'Industrial and Provident Society', 'Registered Society'
     ]
-    additional_excluded_company_types = ['CE', 'CS', 'PC']
-    excludedcompanytypes.extend(additional_excluded_company_types)
     output_s = ~(df.companycategory.isin(excludedcompanycategories)
                  | df.type_codes.isin(excludedcompanytypes))
     return output_s
 
 
+@lru_cache(maxsize=None)
+def create_excluded_company_types(path):
+    url_company_codes, url_company_codes_s = create_url_company_codes(path)
+    excludedcompanytypes = url_company_codes[
+        url_company_codes['excluded_from_psc'] == 'X']['prefix'].tolist()
+    additional_excluded_company_types = ['CE', 'CS', 'PC']
+    excludedcompanytypes.extend(additional_excluded_company_types)
+    return frozenset(excludedcompanytypes)
+
+
+@profiled
 def read_disqualified_directors(disqualfied_directors_path):
     disqual_files = fs.ls(disqualfied_directors_path)
     for path in disqual_files:
@@ -210,34 +731,187 @@ def read_disqualified_directors(disqualfied_directors_path):
     return output_df
 
 
+@profiled
 def create_additional_columns_diqual_directors(df):
-    df['person_dob_formatted'] = pd.to_datetime(
-        df['person_dob'], format="%Y%m%d", errors='coerce')
-    df['persons_month_year'] = df.person_dob_formatted.dt.strftime('%Y-%m')
-    df['join_id'] = df[['forenames', 'surname', 'person_dob_formatted']].apply(
-        create_join_id,
-        first_name_col='forenames',
-        surname_col='surname',
-        month_year_birth_col='person_dob_formatted', axis=1)
-    df['disqual_start_date_formatted'] = pd.to_datetime(
-        df['disqual_start_date'], format="%Y%m%d", errors='coerce')
-    df['disqual_end_date_formatted'] = pd.to_datetime(
-        df['disqual_end_date'], format="%Y%m%d", errors='coerce')
+    df['person_dob_formatted'] = parse_dates(
+        df['person_dob'], format="%Y%m%d")
+    df['persons_month_year'] = format_month_year(df.person_dob_formatted)
+    df['join_id'] = create_join_ids(df['forenames'], df['surname'],
+                                    df['person_dob_formatted'])
+    df['disqual_start_date_formatted'] = parse_dates(
+        df['disqual_start_date'], format="%Y%m%d")
+    df['disqual_end_date_formatted'] = parse_dates(
+        df['disqual_end_date'], format="%Y%m%d")
     return df
 
 
+def open_psc_snapshot(path, company_sample=None):
+    # the snapshot, or only the lines of the sampled companies and the last
+    # line, which isn't a record
+    if company_sample is None:
+        return fs.open(path)
+    return io.StringIO(''.join(sample_psc_lines(fs.open(path),
+                                                company_sample)))
+
+
+def sample_psc_lines(lines, company_sample, batch_size=100000):
+    batch = []
+    last_line = None
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        if last_line is not None:
+            batch.append(last_line)
+        last_line = line
+        if len(batch) == batch_size:
+            yield from sampled_psc_lines(batch, company_sample)
+            batch = []
+    yield from sampled_psc_lines(batch, company_sample)
+    if last_line is not None:
+        yield last_line if last_line.endswith('\n') else last_line + '\n'
+
+
+def sampled_psc_lines(lines, company_sample):
+    company_numbers = pd.Series(
+        [json.loads(x).get('company_number') for x in lines], dtype=object)
+    keep = in_company_sample(
+        encode_company_numbers(company_numbers), company_sample)
+    return [x for x, is_kept in zip(lines, keep) if is_kept]
+
+
+@profiled
+def create_psc_company_sample(psc_file_path, fraction):
+    # only the lines of corporate PSCs are parsed for the ownership links
+    company_numbers = []
+    owner_numbers = []
+    for line in fs.open(psc_file_path):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if CORPORATE_PSC_KIND not in line:
+            continue
+        record = json.loads(line)
+        data = record.get('data') or {}
+        if data.get('kind') == CORPORATE_PSC_KIND:
+            company_numbers.append(record.get('company_number'))
+            owner_numbers.append(
+                (data.get('identification') or {}).get('registration_number'))
+    owners = pd.DataFrame({
+        'company_number': company_numbers,
+        'kind': CORPORATE_PSC_KIND,
+        'identification_registration_number': owner_numbers
+    })
+    company_sample = create_company_sample(fraction,
+                                           *corporate_psc_owners(owners))
+    print_company_sample(company_sample)
+    return company_sample
+
+
+@profiled
 def read_psc_json(path):
     temp_df = pd.read_json(path, lines=True)
-    output_df = pd.concat(
-        [temp_df['company_number'],
-         json_normalize(temp_df['data'])], axis=1)
+    output_df = flatten_psc_data(temp_df)
     print('Read JSON file...')
     return output_df
 
 
-def remove_no_record_rows(df):
+def read_psc_json_chunks(path, chunksize):
+    # yields (DataFrame, includes_last_line) for every chunksize lines, one
+    # chunk is held back so the final line of the file can be flagged
+    lines = []
+    previous = None
+    for line in path:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        lines.append(line)
+        if len(lines) == chunksize:
+            if previous is not None:
+                yield previous, False
+            previous = psc_lines_to_df(lines)
+            lines = []
+    if lines:
+        if previous is not None:
+            yield previous, False
+        previous = psc_lines_to_df(lines)
+    if previous is not None:
+        yield previous, True
+    print('Read JSON file...')
+
+
+@profiled
+def read_psc_json_delta(path, previous_keys):
+    # parses every snapshot line but only flattens the records whose
+    # (company_number, etag) is not in previous_keys, returning them indexed
+    # by line number along with {key: [line numbers]} of the unchanged ones.
+    # The last line is always returned as remove_no_record_rows drops it
+    records = []
+    line_numbers = []
+    unchanged = {}
+    pending = None
+    line_number = 0
+    for line in path:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        if pending is not None:
+            record = pending[1]
+            key = (record.get('company_number'),
+                   (record.get('data') or {}).get('etag'))
+            if key in previous_keys:
+                unchanged.setdefault(key, []).append(pending[0])
+            else:
+                line_numbers.append(pending[0])
+                records.append(record)
+        pending = (line_number, json.loads(line))
+        line_number += 1
+    if pending is not None:
+        line_numbers.append(pending[0])
+        records.append(pending[1])
+    temp_df = pd.DataFrame(
+        records, index=line_numbers).reindex(
+            columns=['company_number', 'data'])
+    print('Read JSON file...')
+    return flatten_psc_data(temp_df), unchanged
+
+
+def pad_derived_input_columns(df):
+    # adds the snapshot fields create_additional_columns_all_records reads
+    # that a subset of the snapshot may lack, returning the ones added
+    padding = [
+        col for col in PSC_DERIVED_INPUT_COLUMNS if col not in df.columns
+    ]
+    for col in PSC_DERIVED_INPUT_COLUMNS:
+        if col in padding or df[col].isnull().all():
+            df[col] = pd.Series(np.nan, index=df.index, dtype=object)
+    return padding
+
+
+def psc_lines_to_df(lines):
+    temp_df = pd.DataFrame([json.loads(line) for line in lines]).reindex(
+        columns=['company_number', 'data'])
+    return flatten_psc_data(temp_df)
+
+
+@profiled
+def flatten_psc_data(temp_df):
+    data_df, unknown_keys = flatten_psc_data_payload(temp_df['data'])
+    report_unknown_keys(unknown_keys)
+    data_df.index = temp_df.index
+    output_df = pd.concat([temp_df['company_number'], data_df], axis=1)
+    return output_df
+
+
+@profiled
+def remove_no_record_rows(df, includes_last_line=True):
     # remove last line of DataFrame which is not a record
-    output_df = df.iloc[:-1].copy()
+    if includes_last_line:
+        output_df = df.iloc[:-1].copy()
+    else:
+        output_df = df.copy()
     # remove summary totals
     output_df = output_df[
         output_df.kind != 'totals#persons-of-significant-control-snapshot']
@@ -245,78 +919,105 @@ def remove_no_record_rows(df):
     return output_df
 
 
+@profiled
 def create_psc_controls_df(df):
-    # create a DataFrame of ways of controlling companies
-    temp_df = df[['company_number', 'natures_of_control'
-                  ]].dropna(subset=['natures_of_control']).copy()
-    list_of_lists = []
-    for index, row in temp_df.iterrows():
-        for item in row['natures_of_control']:
-            list_of_lists.append([row['company_number'], item])
-    output_df = pd.DataFrame(list_of_lists)
-    output_df.columns = ['company_number', 'nature_of_control']
+    # create a DataFrame of ways of controlling companies, one row per nature
+    # of control of each PSC
+    output_df = explode_list_column(df, 'natures_of_control',
+                                    'nature_of_control',
+                                    ['company_number', 'etag', 'kind'])
+    output_df = output_df[[
+        'company_number', 'nature_of_control', 'etag', 'kind'
+    ]]
     print('Created PSC controls df...')
     return output_df
 
 
-def create_additional_columns_all_records(df, live_company_map,
+def create_control_types():
+    # codes for the known natures of control are fixed, any others found are
+    # numbered after them in the order they are first seen
+    return {
+        nature: code
+        for code, nature in enumerate(PSC_NATURES_OF_CONTROL)
+    }
+
+
+@profiled
+def encode_psc_controls(df, control_types):
+    output_df = df[['company_number', 'etag']].copy()
+    output_df['nature_of_control_code'] = encode_values(
+        df['nature_of_control'], control_types)
+    return output_df
+
+
+def create_control_types_df(control_types):
+    output_df = pd.DataFrame(
+        sorted((code, nature) for nature, code in control_types.items()),
+        columns=['nature_of_control_code', 'nature_of_control'])
+    return output_df
+
+
+@profiled
+def create_additional_columns_all_records(df, live_company_lookup,
                                           disqualified_directors, politicians):
     url_company_codes, url_company_codes_s = create_url_company_codes(
         URL_COMPANY_CODES_PATH)
     temp_df = df.copy()
-    temp_df['month_year_birth'] = temp_df['date_of_birth_year'].dropna(
-    ).astype(str).str.replace(
-        r'\.0', '') + '-' + temp_df['date_of_birth_month'].dropna().astype(
-            str).str.replace(r'\.0', '')
-    temp_df['month_year_birth'] = pd.to_datetime(
-        temp_df['month_year_birth'], format='%Y-%m', errors='coerce')
-    temp_df['join_id'] = temp_df[[
-        'name_elements_forename', 'name_elements_surname', 'month_year_birth'
-    ]].apply(
-        create_join_id,
-        first_name_col='name_elements_forename',
-        surname_col='name_elements_surname',
-        month_year_birth_col='month_year_birth', axis=1)
-    temp_df['type_codes'] = temp_df.company_number.apply(company_code_creator)
-    temp_df['company_type'] = temp_df.type_codes.map(url_company_codes_s)
-    temp_df['address_country_normal'] = temp_df['address_country'].str.upper()
-    temp_df['address_country_normal'].fillna('', inplace=True)
-    temp_df['registered_country_normal'] = df[
-        'identification_country_registered'].str.upper()
-    temp_df['registered_country_normal'].fillna('', inplace=True)
-    temp_df['country_of_residence_normal'] = temp_df[
-        'country_of_residence'].str.upper()
-    temp_df['country_of_residence_normal'].fillna('', inplace=True)
-    temp_df['registered_country_normal'] = clean_countries(
-        temp_df['registered_country_normal'])
-    temp_df['address_country_normal'] = clean_countries(
-        temp_df['address_country_normal'])
-    temp_df['possible_politician'] = temp_df.join_id.isin(
-        politicians.join_id.dropna().unique())
-    temp_df = pd.merge(temp_df, politicians, on='join_id', how='left')
-    print('Added politician field and associated data...')
+    temp_df['month_year_birth'] = create_month_year_births(
+        temp_df['date_of_birth_year'], temp_df['date_of_birth_month'])
+    temp_df['join_id'] = create_join_ids(temp_df['name_elements_forename'],
+                                         temp_df['name_elements_surname'],
+                                         temp_df['month_year_birth'])
+    temp_df['type_codes'] = create_type_codes(temp_df.company_number)
+    temp_df['company_type'] = map_categories(
+        temp_df.type_codes, lambda x: x.map(url_company_codes_s))
+    normalize_countries(temp_df, PSC_COUNTRY_COLUMNS)
+    temp_df = add_politician_columns(temp_df, politicians)
+    add_period_matches(temp_df, create_politician_terms(politicians),
+                       psc_notified_on(temp_df), psc_ceased_on(temp_df),
+                       'psc_politician_in_office_when_notified',
+                       'psc_control_overlaps_politician_term')
     secret_jurisdictions = create_secrecy_jurisdiction_list(
-        fs.open('{}interim/secret_jurisdictions.csv'.format(ROOT_DIR)))
-    temp_df['secret_base'] = temp_df.apply(
-        secret_function, secret_jurisdictions=secret_jurisdictions, axis=1)
+        SECRET_JURISDICTIONS_PATH)
+    temp_df['secret_base'] = flag_any_country_in(
+        temp_df, [
+            'country_of_residence_normal', 'address_country_normal',
+            'registered_country_normal'
+        ], secret_jurisdictions)
     print('Added secret base field...')
-    rle_list = create_rle_list(
-        fs.open('{}interim/recognised_stock_exchange_countries.csv'.format(
-            ROOT_DIR)))
-    temp_df['non_rle_country'] = temp_df.apply(
-        non_rle_function, rle_list=rle_list, axis=1)
+    rle_list = create_rle_list(RLE_COUNTRIES_PATH)
+    temp_df['non_rle_country'] = (
+        temp_df.kind == 'corporate-entity-person-with-significant-control'
+    ) & ~flag_any_country_in(
+        temp_df, ['address_country_normal', 'registered_country_normal'],
+        rle_list)
     print('Added non-rle country field...')
-    temp_df['psc_likely_disqualified_director'] = temp_df.join_id.isin(
-        disqualified_directors.dropna(
-            subset=['persons_month_year']).join_id.dropna().unique())
-    temp_df['company_name'] = temp_df.company_number.map(
-        live_company_map['company_name'])
-    temp_df['company_first_and_postcode'] = temp_df.company_number.map(
-        live_company_map['first_and_postcode'])
+    temp_df = add_company_and_disqualification_columns(
+        temp_df, live_company_lookup, disqualified_directors)
     print('Created additional columns on all records df...')
     return temp_df
 
 
+def add_company_and_disqualification_columns(df, live_company_lookup,
+                                             disqualified_directors):
+    # adds the columns looked up on the monthly company and disqualified
+    # directors files, modifying df
+    df['psc_likely_disqualified_director'] = df.join_id.isin(
+        disqualified_directors.dropna(
+            subset=['persons_month_year']).join_id.dropna().unique())
+    add_period_matches(df, create_disqualification_periods(
+        disqualified_directors), psc_notified_on(df), psc_ceased_on(df),
+                       'psc_disqualified_when_notified',
+                       'psc_control_overlaps_disqualification')
+    codes = encode_company_numbers(df.company_number)
+    df['company_name'] = lookup_company_column(live_company_lookup, codes,
+                                               'company_name')
+    df['company_first_and_postcode'] = lookup_company_column(
+        live_company_lookup, codes, 'first_and_postcode')
+    return df
+
+
+@profiled
 def create_records_psc_df(df):
     if 'statement' in df.columns:
         output_df = df[pd.isnull(df.statement)].copy()
@@ -327,17 +1028,21 @@ def create_records_psc_df(df):
         return df
 
 
-def split_active_ceased(df, live_companies_list):
+@profiled
+def split_active_ceased(df, live_company_lookup):
     if df is None:
         print('Nothing to split as df empty...')
         return None, None
     else:
-        active = df[pd.isnull(df.ceased_on)].copy()
-        active = active[active.company_number.isin(live_companies_list)]
-        ceased = df[~df.company_number.isin(active.company_number)]
+        codes = encode_company_numbers(df.company_number)
+        is_active = select_active_rows(df, codes, live_company_lookup)
+        active = df[is_active].copy()
+        ceased = df[~in_company_index(
+            codes, create_company_index(codes[is_active]))]
         return active, ceased
 
 
+@profiled
 def create_psc_statements_df(df):
     if 'statement' in df.columns:
         output_df = df[~pd.isnull(df.statement)].copy()
@@ -347,31 +1052,213 @@ def create_psc_statements_df(df):
         return None
 
 
+def create_spill(spill_dir, name):
+    return {
+        'directory': spill_dir,
+        'name': name,
+        'paths': [],
+        'partial_columns': [],
+        'kinds': {},
+        'has_nulls': set(),
+        'arrow_types': {},
+        'active_company_codes': []
+    }
+
+
+def spill_partial(spill, df, live_company_lookup):
+    if df is None:
+        return
+    path = os.path.join(spill['directory'], '{}_{}.pkl'.format(
+        spill['name'], len(spill['paths'])))
+    df.to_pickle(path)
+    spill['paths'].append(path)
+    if len(df) > 0:
+        spill['partial_columns'].append(set(df.columns))
+        for col in df.columns:
+            if df[col].isnull().any():
+                spill['has_nulls'].add(col)
+            if not df[col].isnull().all():
+                spill['kinds'].setdefault(col, set()).add(df[col].dtype.kind)
+        if 'parquet' in OUTPUT_FORMATS:
+            merge_arrow_types(spill['arrow_types'], arrow_types(df))
+        codes = encode_company_numbers(df.company_number)
+        spill['active_company_codes'].append(
+            create_company_index(codes[select_active_rows(
+                df, codes, live_company_lookup)]))
+
+
+def merge_snapshot_columns(column_lists):
+    # the union of the chunks' flattened fields, sorted as the flattener
+    # sorts those of the whole snapshot
+    return sorted(set().union(*column_lists))
+
+
+def read_spilled_partials(spill, columns):
+    # integer columns with gaps in some partials would have been upcast to
+    # float when concatenated in memory, mirror that here
+    has_nulls = spill['has_nulls'].union(
+        col for partial_columns in spill['partial_columns'] for col in columns
+        if col not in partial_columns)
+    float_columns = [
+        col for col, kinds in spill['kinds'].items()
+        if 'i' in kinds and kinds <= {'i', 'f'} and (
+            'f' in kinds or col in has_nulls)
+    ]
+    for path in spill['paths']:
+        df = pd.read_pickle(path).reindex(columns=columns)
+        for col in float_columns:
+            df[col] = df[col].astype('float64')
+        yield df
+
+
+def select_active_rows(df, codes, live_company_lookup):
+    # mask of the rows not ceased whose company is live, codes are the
+    # encoded company numbers of df
+    output = in_company_lookup(live_company_lookup, codes)
+    if 'ceased_on' in df.columns:
+        output &= pd.isnull(df.ceased_on).values
+    return output
+
+
+@profiled
+def write_spilled_active_ceased(spill, columns, live_company_lookup,
+                                active_filename, ceased_filename,
+                                controls_filename=None, control_types=None):
+    if not spill['paths']:
+        print('Nothing to split as df empty...')
+        print('Empty df, no CSV for {} written...'.format(active_filename))
+        print('Empty df, no CSV for {} written...'.format(ceased_filename))
+        return
+    active_company_index = create_company_index(
+        np.concatenate(spill['active_company_codes'] +
+                       [np.empty(0, dtype=np.int64)]))
+    filenames = [active_filename, ceased_filename]
+    if controls_filename is not None:
+        filenames.extend(
+            [controls_filename, '{}_encoded'.format(controls_filename)])
+    with ExitStack() as stack:
+        files = {}
+        if 'csv' in OUTPUT_FORMATS:
+            files = {
+                filename: stack.enter_context(
+                    fs.open(output_path(filename), 'w'))
+                for filename in filenames
+            }
+        # the active and ceased tables share one schema covering every
+        # partial, the controls tables are typed from their first partial.
+        # Declared PSC columns take their declared types in both
+        records_schema = create_arrow_schema(
+            columns, spill['arrow_types'], PSC_COLUMN_KINDS
+        ) if 'parquet' in OUTPUT_FORMATS else None
+        parquet_writers = {}
+        written = set()
+        for df in read_spilled_partials(spill, columns):
+            codes = encode_company_numbers(df.company_number)
+            active = df[select_active_rows(df, codes, live_company_lookup)]
+            ceased = df[~in_company_index(codes, active_company_index)]
+            outputs = [(active_filename, active), (ceased_filename, ceased)]
+            if controls_filename is not None and not active.reindex(
+                    columns=['natures_of_control']).dropna().empty:
+                controls = create_psc_controls_df(active)
+                outputs.extend([(controls_filename, controls),
+                                ('{}_encoded'.format(controls_filename),
+                                 encode_psc_controls(controls, control_types))
+                                ])
+            for filename, output in outputs:
+                if filename in files:
+                    output.to_csv(
+                        files[filename],
+                        chunksize=100000,
+                        index=False,
+                        header=filename not in written)
+                if records_schema is not None:
+                    if filename not in parquet_writers:
+                        schema = records_schema if filename in [
+                            active_filename, ceased_filename
+                        ] else create_arrow_schema(
+                            output.columns, arrow_types(output),
+                            PSC_COLUMN_KINDS)
+                        parquet_writers[filename] = create_parquet_writer(
+                            stack,
+                            fs.open(output_path(filename, 'parquet'), 'wb'),
+                            schema)
+                    parquet_writers[filename].write_table(
+                        to_arrow_table(output,
+                                       parquet_writers[filename].schema))
+                written.add(filename)
+    for filename in filenames:
+        if 'csv' in OUTPUT_FORMATS:
+            print('Wrote {} to CSV'.format(filename))
+        if filename in parquet_writers:
+            print('Wrote {} to parquet'.format(filename))
+
+
+@profiled
 def split_exemptions_from_psc_records(df):
     exemption_records = df[df.kind == 'exemptions']
     active_psc_records = df[df.kind != 'exemptions']
     return active_psc_records, exemption_records
 
 
-def clean_countries(s):
-    temp_s = s.copy()
+def normalize_countries(df, columns):
+    # adds the normalized country columns to df in place. Every distinct raw
+    # value across columns is upper cased, and looked up in the cleaner
+    # maps, once. Missing values are treated as empty strings
+    clean_map = create_country_clean_map(REGISTERED_COUNTRY_CLEANER_MAP_PATH,
+                                         ADDRESS_COUNTRY_CLEANER_MAP_PATH)
+    raw = {x[0]: df[x[0]].astype('category') for x in columns}
+    raw_values = pd.Index(
+        list(chain.from_iterable(x.cat.categories
+                                 for x in raw.values()))).unique()
+    upper = pd.Series(
+        pd.Series(raw_values, dtype=object).str.upper().values,
+        index=raw_values)
+    cleaned = upper.map(clean_map)
+    unmapped = Counter()
+    for raw_col, normal_col, clean in columns:
+        if clean:
+            df[normal_col] = map_categories(
+                raw[raw_col], lambda x: x.map(cleaned),
+                fill_value=clean_map.get('', np.nan))
+            counts = raw[raw_col].value_counts()
+            counts = counts[counts.gt(0).values
+                            & cleaned.reindex(counts.index).isnull().values]
+            for value, count in counts.items():
+                unmapped[upper[value]] += count
+        else:
+            df[normal_col] = map_categories(
+                raw[raw_col], lambda x: x.map(upper), fill_value='')
+    report_unmapped_countries(unmapped)
+    return df
+
+
+def report_unmapped_countries(unmapped):
+    if not unmapped:
+        return
+    print('{} rows have one of {} countries not in the cleaner maps, their '
+          'normalized country is left blank. Most common: {}'.format(
+              sum(unmapped.values()), len(unmapped), ', '.join(
+                  '{} ({})'.format(x, count)
+                  for x, count in unmapped.most_common(10))))
+
+
+@lru_cache(maxsize=None)
+def create_country_clean_map(registered_country_path, address_country_path):
     registered_country_clean_map = pd.read_csv(
-        fs.open(
-            '{}interim/registered_country_cleaner_map.csv'.format(ROOT_DIR)))
+        fetch_reference_file(fs, registered_country_path))
     address_country_clean_map = pd.read_csv(
-        fs.open('{}interim/address_country_cleaner_map.csv'.format(ROOT_DIR)))
+        fetch_reference_file(fs, address_country_path))
     combined_clean_map = pd.concat(
         [registered_country_clean_map, address_country_clean_map])
     combined_clean_map.drop_duplicates(subset=['original'], inplace=True)
     combined_clean_map_s = pd.Series(
         combined_clean_map.clean.values, index=combined_clean_map.original)
-    output_s = temp_s.map(combined_clean_map_s)
-    print('Cleaned country fields...')
-    return output_s
+    return combined_clean_map_s
 
 
+@lru_cache(maxsize=None)
 def create_rle_list(path):
-    temp_df = pd.read_csv(path)
+    temp_df = pd.read_csv(fetch_reference_file(fs, path))
     output = temp_df['country_name'].str.upper().tolist()
     output.extend([
         'ENGLAND', 'SCOTLAND', 'NORTHERN IRELAND', 'GREAT BRITAIN', 'UK',
@@ -379,28 +1266,7 @@ def create_rle_list(path):
         'ENGLAND & WALES', 'REPUBLIC OF IRELAND', 'IRELAND',
         'ENGLAND AND WALES'
     ])
-    return output
-
-
-def secret_function(x, secret_jurisdictions):
-    if x['country_of_residence_normal'] in secret_jurisdictions:
-        return True
-    elif x['address_country_normal'] in secret_jurisdictions:
-        return True
-    elif x['registered_country_normal'] in secret_jurisdictions:
-        return True
-    else:
-        return False
-
-
-def non_rle_function(x, rle_list):
-    if x['kind'] == 'corporate-entity-person-with-significant-control' and ~pd.isnull(
-            x['registered_country_normal']
-    ) and x['address_country_normal'] not in rle_list and x[
-            'registered_country_normal'] not in rle_list:
-        return True
-    else:
-        return False
+    return frozenset(output)
 
 
 def get_officers_files(officer_files):
@@ -410,64 +1276,103 @@ def get_officers_files(officer_files):
     return output
 
 
-def read_officers(directory, officers_files):
-    output_df = pd.DataFrame()
-    for file in officers_files:
-        temp_df = pd.read_csv(
-            fs.open(file),
-            dtype={
-                'Company Number': str,
-                'Person number': str,
-                'Partial Date of Birth': str,
-            },
-            low_memory=False,
-            nrows=nrows)
-        output_df = pd.concat([temp_df, output_df])
+@profiled
+def read_officers(directory, officers_files, live_company_lookup):
+    # each worker reads, projects and filters whole files so only officers of
+    # live companies come back to be combined with a single concat. The
+    # workers map the live company lookup from local disk
+    lookup_dir = tempfile.mkdtemp(prefix='live_companies_')
+    try:
+        save_company_lookup(live_company_lookup, lookup_dir)
+        with Pool(
+                OFFICERS_READ_PROCESSES,
+                initializer=init_officers_worker,
+                initargs=(lookup_dir, )) as pool:
+            frames = pool.map(read_officers_file, officers_files, chunksize=1)
+    finally:
+        shutil.rmtree(lookup_dir, ignore_errors=True)
+    for path in officers_files:
+        record_s3_open(fs, path, 'rb')
+    # files were previously stacked newest first, keep that row order
+    output_df = concat_categoricals(frames[::-1])
     output_df.reset_index(inplace=True)
     print('Combined officers into a single df...')
     return output_df
 
 
+def is_officers_column(column):
+    return OFFICERS_COLUMNS is None or standardise_column(
+        column) in OFFICERS_COLUMNS
+
+
+def init_officers_worker(lookup_dir):
+    global officers_live_companies
+    fs.reconnect()
+    officers_live_companies = load_company_lookup(lookup_dir)
+
+
+def read_officers_file(path):
+    temp_df = pd.read_csv(
+        fs.open(path),
+        dtype={
+            'Company Number': str,
+            'Person number': str,
+            'Partial Date of Birth': str,
+        },
+        usecols=is_officers_column,
+        low_memory=False,
+        nrows=nrows)
+    temp_df.columns = [standardise_column(x) for x in temp_df.columns]
+    temp_df = filter_active_officers(temp_df, officers_live_companies).copy()
+    to_categoricals(temp_df, OFFICERS_CATEGORICAL_COLUMNS)
+    print('Read {} active officers from {}...'.format(len(temp_df), path))
+    return temp_df
+
+
 def clean_officers(df):
     temp_df = df.copy()
     return temp_df
 
 
-def filter_active_officers(df, live_companies_list):
-    temp_df = df[df.company_number.isin(live_companies_list)]
+def filter_active_officers(df, live_company_lookup):
+    temp_df = df[in_company_lookup(
+        live_company_lookup, encode_company_numbers(df.company_number))]
     return temp_df
 
 
-def add_additional_columns_officers(df, politicians):
+@profiled
+def add_additional_columns_officers(df, politicians,
+                                    disqualified_directors):
     temp_df = df.copy()
-    temp_df['partial_date_of_birth_formatted'] = pd.to_datetime(
-        temp_df.partial_date_of_birth.astype(str).str.strip() + '01',
+    temp_df['partial_date_of_birth_formatted'] = parse_dates(
+        temp_df.partial_date_of_birth,
         format='%Y%m%d',
-        errors='coerce')
-    temp_df['appointment_date_formatted'] = pd.to_datetime(
-        temp_df.appointment_date.astype(str).str.strip(),
+        function=lambda x: x.astype(str).str.strip() + '01')
+    temp_df['appointment_date_formatted'] = parse_dates(
+        temp_df.appointment_date,
         format='%Y%m%d',
-        errors='coerce')
-    temp_df['country_of_residence_normal'] = temp_df[
-        'resident_country'].str.upper()
-    temp_df['address_country_normal'] = temp_df['country'].str.upper()
+        function=lambda x: x.astype(str).str.strip())
+    normalize_countries(temp_df, OFFICERS_COUNTRY_COLUMNS)
     secret_jurisdictions = create_secrecy_jurisdiction_list(
-        fs.open('{}interim/secret_jurisdictions.csv'.format(ROOT_DIR)))
-    temp_df['secret_base'] = temp_df.apply(
-        secret_officer_function,
-        secret_jurisdictions=secret_jurisdictions,
-        axis=1)
-    temp_df['join_id'] = temp_df[[
-        'forenames', 'surname', 'partial_date_of_birth_formatted'
-    ]].apply(
-        create_join_id,
-        first_name_col='forenames',
-        surname_col='surname',
-        month_year_birth_col='partial_date_of_birth_formatted', axis=1)
-    temp_df['possible_politician'] = temp_df.join_id.isin(
-        politicians.join_id.unique())
-    temp_df = pd.merge(temp_df, politicians, on='join_id', how='left')
-    print('Added politician field and associated data...')
+        SECRET_JURISDICTIONS_PATH)
+    temp_df['secret_base'] = flag_any_country_in(
+        temp_df, ['country_of_residence_normal', 'address_country_normal'],
+        secret_jurisdictions)
+    temp_df['join_id'] = create_join_ids(
+        temp_df['forenames'], temp_df['surname'],
+        temp_df['partial_date_of_birth_formatted'])
+    temp_df = add_politician_columns(temp_df, politicians)
+    # officers in the file are still in post
+    still_in_post = pd.Series(pd.NaT, index=temp_df.index)
+    add_period_matches(temp_df, create_politician_terms(politicians),
+                       temp_df.appointment_date_formatted, still_in_post,
+                       'officer_politician_in_office_when_appointed',
+                       'officer_appointment_overlaps_politician_term')
+    add_period_matches(temp_df,
+                       create_disqualification_periods(disqualified_directors),
+                       temp_df.appointment_date_formatted, still_in_post,
+                       'officer_disqualified_when_appointed',
+                       'officer_appointment_overlaps_disqualification')
     appointment_type_label_dict = {
         0: 'Current Secretary',
         1: 'Current Director',
@@ -480,62 +1385,69 @@ def add_additional_columns_officers(df, politicians):
         18: 'Current SE Member of Supervisory Organ',
         19: 'Current SE Member of Management Organ'
     }
-    temp_df['appointment_type_label'] = temp_df.appointment_type.map(
-        appointment_type_label_dict)
+    temp_df['appointment_type_label'] = map_categories(
+        temp_df.appointment_type,
+        lambda x: x.map(appointment_type_label_dict))
     print('Created additional officers columns...')
     return temp_df
 
 
 def standardise_columns(columns):
-    output = [x.replace(' ', '_') for x in columns]
-    output = [x.lower() for x in output]
-    output = [x.replace('.', '_') for x in output]
+    output = [standardise_column(x) for x in columns]
     print('Standardized df columns...')
     return output
 
 
+def standardise_column(column):
+    return column.replace(' ', '_').lower().replace('.', '_')
+
+
+@lru_cache(maxsize=None)
 def create_secrecy_jurisdiction_list(path):
-    temp_df = pd.read_csv(path, header=None)[0]
-    output = temp_df.tolist()
+    temp_df = pd.read_csv(fetch_reference_file(fs, path), header=None)[0]
+    output = frozenset(temp_df.tolist())
     return output
 
 
-def secret_officer_function(x, secret_jurisdictions):
-    if x['country_of_residence_normal'] in secret_jurisdictions:
-        return True
-    elif x['address_country_normal'] in secret_jurisdictions:
-        return True
-    else:
-        return False
-
-
-def create_join_id(x, first_name_col, surname_col, month_year_birth_col):
-    if not x.isnull().values.any():
-        first_name = x[first_name_col].split(' ')[0]
-        month_year = x[month_year_birth_col].strftime('%Y-%m')
-        join_id = first_name + '-' + x[surname_col] + '_' + month_year
-        join_id = join_id.strip('-_ ')
-        join_id = join_id.upper()
-        join_id = join_id.replace(' ', '')
-        return join_id
+def output_path(filename, extension='csv'):
+    if test_run:
+        return '{}test-output/{}.{}'.format(ROOT_DIR, filename, extension)
     else:
-        return np.nan
+        return '{}processed/{}.{}'.format(ROOT_DIR, filename, extension)
+
+
+def output_paths(filenames):
+    return [
+        output_path(filename, extension) for filename in filenames
+        for extension in OUTPUT_FORMATS
+    ]
+
+
+@profiled
+def write_output_s3(df, filename, fs, column_kinds=None):
+    if 'csv' in OUTPUT_FORMATS:
+        write_csv_s3(df, filename, fs)
+    if 'parquet' in OUTPUT_FORMATS:
+        write_parquet_s3(df, filename, fs, column_kinds)
 
 
 def write_csv_s3(df, filename, fs):
     if df is None:
         print('Empty df, no CSV for {} written...'.format(filename))
     else:
-        if test_run:
-            with fs.open('{}test-output/{}.csv'.format(ROOT_DIR, filename),
-                         'w') as f:
-                df.to_csv(f, chunksize=100000, index=False)
-        else:
-            with fs.open('{}processed/{}.csv'.format(ROOT_DIR, filename),
-                         'w') as f:
-                df.to_csv(f, chunksize=100000, index=False)
+        with fs.open(output_path(filename), 'w') as f:
+            df.to_csv(f, chunksize=100000, index=False)
         print('Wrote {} to CSV'.format(filename))
 
 
+def write_parquet_s3(df, filename, fs, column_kinds=None):
+    if df is None:
+        print('Empty df, no parquet for {} written...'.format(filename))
+    else:
+        with fs.open(output_path(filename, 'parquet'), 'wb') as f:
+            write_parquet(df, f, column_kinds)
+        print('Wrote {} to parquet'.format(filename))
+
+
 if __name__ == '__main__':
     main()
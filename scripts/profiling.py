@@ -0,0 +1,208 @@
+#!/usr/bin/env
+
+import os
+import json
+import time
+import resource
+from functools import wraps
+import pandas as pd
+
+# every call of a function decorated with profiled is recorded here and
+# written out as a JSON report at the end of the run, along with a summary
+# table of where the time and memory went
+PROFILE_REPORT_DIR = 'profiles'
+
+calls = []
+call_stack = []
+s3_opens = []
+s3_sizes = {}
+run_started = time.time()
+
+
+def profiled(function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        record = {
+            'name': function.__name__,
+            # names of the profiled calls this one was made from
+            'path': [x['name'] for x in call_stack] + [function.__name__],
+            'depth': len(call_stack),
+            'started_seconds': round(time.time() - run_started, 3)
+        }
+        calls.append(record)
+        call_stack.append(record)
+        opens_before = len(s3_opens)
+        peak_before = peak_rss_mb()
+        children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+        wall_before = time.perf_counter()
+        cpu_before = time.process_time()
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            record['failed'] = True
+            raise
+        finally:
+            call_stack.pop()
+            children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            record.update({
+                'wall_seconds':
+                round(time.perf_counter() - wall_before, 3),
+                # includes worker processes that finished during the call
+                'cpu_seconds':
+                round(
+                    time.process_time() - cpu_before + children.ru_utime +
+                    children.ru_stime - children_before.ru_utime -
+                    children_before.ru_stime, 3),
+                'peak_rss_mb':
+                round(peak_rss_mb(), 1),
+                'peak_rss_delta_mb':
+                round(peak_rss_mb() - peak_before, 1),
+                'rows_in':
+                count_rows(list(args) + list(kwargs.values())),
+                's3_bytes_read':
+                s3_bytes(s3_opens[opens_before:], 'r'),
+                's3_bytes_written':
+                s3_bytes(s3_opens[opens_before:], 'w')
+            })
+        record['rows_out'] = count_rows(result)
+        return result
+
+    return wrapper
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def peak_child_rss_mb():
+    # largest peak of the finished worker and stage processes
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+
+def count_rows(x):
+    # rows of the DataFrames and Series in x, directly or in a list or tuple
+    if isinstance(x, (pd.DataFrame, pd.Series)):
+        return len(x)
+    if isinstance(x, (list, tuple)):
+        return sum(
+            len(y) for y in x if isinstance(y, (pd.DataFrame, pd.Series)))
+    return 0
+
+
+def count_s3_opens(fs):
+    # records the paths fs opens and downloads, their sizes are looked up
+    # once the profiled call that opened them returns
+    fs_open = fs.open
+    fs_get = fs.get
+
+    def open_recorded(path, mode='rb', **kwargs):
+        record_s3_open(fs, path, mode)
+        return fs_open(path, mode, **kwargs)
+
+    def get_recorded(path, *args, **kwargs):
+        record_s3_open(fs, path, 'rb')
+        return fs_get(path, *args, **kwargs)
+
+    fs.open = open_recorded
+    fs.get = get_recorded
+    return fs
+
+
+def record_s3_open(fs, path, mode):
+    # for files read elsewhere, e.g. by worker processes
+    s3_opens.append((fs, path, mode))
+
+
+def s3_bytes(opens, mode):
+    output = 0
+    for fs, path, open_mode in opens:
+        if mode not in open_mode:
+            continue
+        if (path, open_mode) not in s3_sizes:
+            try:
+                info = fs.info(path)
+            except Exception:  # e.g. still being written
+                continue
+            s3_sizes[(path, open_mode)] = info.get('Size',
+                                                   info.get('size', 0))
+        output += s3_sizes[(path, open_mode)]
+    return output
+
+
+def write_report(script_name):
+    if not os.path.exists(PROFILE_REPORT_DIR):
+        os.makedirs(PROFILE_REPORT_DIR)
+    path = os.path.join(
+        PROFILE_REPORT_DIR, '{}_{}.json'.format(
+            script_name,
+            time.strftime('%Y%m%d-%H%M%S', time.localtime(run_started))))
+    with open(path, 'w') as f:
+        json.dump(
+            {
+                'script': script_name,
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                         time.localtime(run_started)),
+                'wall_seconds': round(time.time() - run_started, 3),
+                'peak_rss_mb': round(peak_rss_mb(), 1),
+                'peak_child_rss_mb': round(peak_child_rss_mb(), 1),
+                'calls': calls
+            },
+            f,
+            indent=2)
+    print('Wrote profiling report to {}'.format(path))
+    return path
+
+
+def summarise_calls(records):
+    # totals per call path, so a function called from different places gets
+    # a row under each caller. Rows are in order of first call with each
+    # under its caller
+    summary = {}
+    for record in records:
+        row = summary.setdefault(
+            tuple(record['path']), {
+                'name': record['name'],
+                'path': record['path'],
+                'depth': record['depth'],
+                'calls': 0,
+                'wall_seconds': 0,
+                'cpu_seconds': 0,
+                'peak_rss_delta_mb': 0,
+                'rows_in': 0,
+                'rows_out': 0,
+                's3_bytes_read': 0,
+                's3_bytes_written': 0
+            })
+        row['calls'] += 1
+        for key in [
+                'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out',
+                's3_bytes_read', 's3_bytes_written'
+        ]:
+            row[key] += record.get(key, 0)
+        row['peak_rss_delta_mb'] = max(row['peak_rss_delta_mb'],
+                                       record.get('peak_rss_delta_mb', 0))
+    first_calls = {path: i for i, path in enumerate(summary)}
+    return sorted(
+        summary.values(),
+        key=lambda row: [
+            first_calls.get(tuple(row['path'][:i + 1]), -1)
+            for i in range(len(row['path']))
+        ])
+
+
+def print_summary(records=None):
+    line = '{:<44} {:>5} {:>9} {:>9} {:>9} {:>11} {:>11} {:>9} {:>9}'
+    print(
+        line.format('function', 'calls', 'wall s', 'cpu s', 'peak +MB',
+                    'rows in', 'rows out', 'read MB', 'write MB'))
+    for row in summarise_calls(calls if records is None else records):
+        print(
+            line.format(('  ' * row['depth'] + row['name'])[:44],
+                        row['calls'],
+                        '{:.1f}'.format(row['wall_seconds']),
+                        '{:.1f}'.format(row['cpu_seconds']),
+                        '{:.0f}'.format(row['peak_rss_delta_mb']),
+                        row['rows_in'], row['rows_out'],
+                        '{:.1f}'.format(row['s3_bytes_read'] / 1e6),
+                        '{:.1f}'.format(row['s3_bytes_written'] / 1e6)))
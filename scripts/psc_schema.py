@@ -0,0 +1,170 @@
+#!/usr/bin/env
+
+from collections import Counter
+import numpy as np
+import pandas as pd
+
+EXEMPTION_TYPES = [
+    'disclosure_transparency_rules_chapter_five_applies',
+    'psc_exempt_as_shares_admitted_on_market',
+    'psc_exempt_as_trading_on_eu_regulated_market',
+    'psc_exempt_as_trading_on_regulated_market',
+    'psc_exempt_as_trading_on_uk_regulated_market'
+]
+
+# fields of the `data` payload of the PSC snapshot, sorted as json_normalize
+# sorted them. Only those found in at least one record become columns, as
+# with json_normalize. 'string', 'list' (of strings) and 'exemption_items'
+# (lists of objects holding dates) columns are kept as objects,
+# 'category' columns hold few distinct values and become pandas categoricals,
+# 'number' columns become float64 as most records don't have them. The
+# *_count fields only appear on the totals line at the end of the snapshot
+PSC_DATA_FIELDS = sorted([
+    ('address.address_line_1', 'string'),
+    ('address.address_line_2', 'string'),
+    ('address.care_of', 'string'),
+    ('address.country', 'category'),
+    ('address.locality', 'string'),
+    ('address.po_box', 'string'),
+    ('address.postal_code', 'string'),
+    ('address.premises', 'string'),
+    ('address.region', 'string'),
+    ('ceased_on', 'string'),
+    ('country_of_residence', 'category'),
+    ('date_of_birth.month', 'number'),
+    ('date_of_birth.year', 'number'),
+    ('description', 'string'),
+    ('etag', 'string'),
+    ('exemptions_count', 'number'),
+    ('identification.country_registered', 'category'),
+    ('identification.legal_authority', 'category'),
+    ('identification.legal_form', 'category'),
+    ('identification.place_registered', 'string'),
+    ('identification.registration_number', 'string'),
+    ('kind', 'category'),
+    ('linked_psc_name', 'string'),
+    ('links.person_with_significant_control', 'string'),
+    ('links.self', 'string'),
+    ('links.statement', 'string'),
+    ('name', 'string'),
+    ('name_elements.forename', 'string'),
+    ('name_elements.middle_name', 'string'),
+    ('name_elements.surname', 'string'),
+    ('name_elements.title', 'category'),
+    ('nationality', 'category'),
+    ('natures_of_control', 'list'),
+    ('notified_on', 'string'),
+    ('persons_of_significant_control_count', 'number'),
+    ('restrictions_notice_withdrawal_reason', 'category'),
+    ('statement', 'category'),
+    ('statements_count', 'number'),
+] + [('exemptions.{}.exemption_type'.format(x), 'category')
+     for x in EXEMPTION_TYPES] + [('exemptions.{}.items'.format(x),
+                                   'exemption_items')
+                                  for x in EXEMPTION_TYPES])
+
+
+def compile_flattener(fields):
+    # turns a list of (dotted path, kind) into a tree of nested keys whose
+    # leaves are column positions. The returned function walks each record
+    # against the tree once, writing values straight into per-column lists
+    # rather than building a flattened dict per record. Fields no record has
+    # are left out
+    columns = [path for path, kind in fields]
+    kinds = [kind for path, kind in fields]
+    tree = {}
+    for position, path in enumerate(columns):
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if not isinstance(node, dict):
+                raise ValueError('{} is both a field and an object'.format(
+                    path))
+        node[parts[-1]] = position
+
+    def flatten(records):
+        records = list(records)
+        values = [[np.nan] * len(records) for _ in columns]
+        unknown_keys = Counter()
+        found = set()
+        for row, record in enumerate(records):
+            if isinstance(record, dict):
+                fill_record(record, tree, (), row, values, found,
+                            unknown_keys)
+        found = sorted(found)
+        output = {}
+        for position in found:
+            path, kind, column_values = (columns[position], kinds[position],
+                                         values[position])
+            if kind == 'number':
+                output[path] = np.array(column_values, dtype='float64')
+            elif kind == 'category':
+                output[path] = pd.Categorical(
+                    pd.Series(column_values, dtype=object))
+            else:
+                output[path] = pd.Series(column_values, dtype=object).values
+        unknown_keys = {
+            '.'.join(path): count
+            for path, count in unknown_keys.items()
+        }
+        return pd.DataFrame(
+            output, columns=[columns[x] for x in found]), unknown_keys
+
+    flatten.columns = columns
+    return flatten
+
+
+def fill_record(record, tree, parents, row, values, found, unknown_keys):
+    for key, value in record.items():
+        node = tree.get(key)
+        if node.__class__ is int:
+            values[node][row] = value
+            found.add(node)
+        elif node is None:
+            unknown_keys[parents + (key, )] += 1
+        elif value.__class__ is dict:
+            fill_record(value, node, parents + (key, ), row, values, found,
+                        unknown_keys)
+        elif value is not None:
+            unknown_keys[parents + (key, )] += 1
+
+
+flatten_psc_data_payload = compile_flattener(PSC_DATA_FIELDS)
+
+
+def report_unknown_keys(unknown_keys):
+    if unknown_keys:
+        print('Warning: PSC fields not in schema were dropped: {}'.format(
+            ', '.join('{} ({})'.format(key, count)
+                      for key, count in sorted(unknown_keys.items()))))
+
+
+def create_natures_of_control():
+    # the natures of control Companies House describes for companies and,
+    # with the -limited-liability-partnership suffix, for LLPs
+    bands = ['25-to-50-percent', '50-to-75-percent', '75-to-100-percent']
+    holders = ['', '-as-trust', '-as-firm']
+    output = []
+    for base in ['ownership-of-shares', 'voting-rights']:
+        output.extend('{}-{}{}'.format(base, band, holder) for band in bands
+                      for holder in holders)
+    for base in [
+            'right-to-appoint-and-remove-directors',
+            'significant-influence-or-control'
+    ]:
+        output.extend(base + holder for holder in holders)
+    for base in ['right-to-share-surplus-assets', 'voting-rights']:
+        output.extend(
+            '{}-{}{}-limited-liability-partnership'.format(base, band, holder)
+            for band in bands for holder in holders)
+    for base in [
+            'right-to-appoint-and-remove-members',
+            'significant-influence-or-control'
+    ]:
+        output.extend('{}{}-limited-liability-partnership'.format(
+            base, holder) for holder in holders)
+    return output
+
+
+PSC_NATURES_OF_CONTROL = create_natures_of_control()
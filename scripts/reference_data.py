@@ -0,0 +1,59 @@
+#!/usr/bin/env
+
+import os
+import json
+import tempfile
+
+# local copies of the interim reference tables, reused across runs for as
+# long as the remote file's ETag (or modification time and size) is unchanged
+REFERENCE_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'psc_reference_data')
+
+
+def fetch_reference_file(fs, path, cache_dir=REFERENCE_CACHE_DIR):
+    local_path = os.path.join(cache_dir, path.replace('/', '__'))
+    version_path = local_path + '.version'
+    cached_version = None
+    if os.path.exists(local_path) and os.path.exists(version_path):
+        with open(version_path) as f:
+            cached_version = f.read()
+    try:
+        version = remote_file_version(fs.info(path))
+    except Exception:
+        if cached_version is None:
+            raise
+        print('Could not check {}, using cached copy...'.format(path))
+        return local_path
+    if version != cached_version:
+        os.makedirs(cache_dir, exist_ok=True)
+        # stages running at the same time may fetch the same file, each
+        # downloads to its own temporary file and moves it into place
+        download_path = create_temporary_path(cache_dir)
+        try:
+            fs.get(path, download_path)
+            os.replace(download_path, local_path)
+        finally:
+            if os.path.exists(download_path):
+                os.remove(download_path)
+        version_download_path = create_temporary_path(cache_dir)
+        with open(version_download_path, 'w') as f:
+            f.write(version)
+        os.replace(version_download_path, version_path)
+        print('Downloaded reference file {}...'.format(path))
+    return local_path
+
+
+def create_temporary_path(cache_dir):
+    handle, path = tempfile.mkstemp(dir=cache_dir, suffix='.download')
+    os.close(handle)
+    return path
+
+
+def remote_file_version(info):
+    if info.get('ETag'):
+        return str(info['ETag'])
+    return json.dumps(
+        [
+            str(info.get('LastModified', info.get('mtime'))),
+            info.get('Size', info.get('size'))
+        ])
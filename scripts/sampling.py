@@ -0,0 +1,73 @@
+#!/usr/bin/env
+
+import numpy as np
+from transforms import (encode_company_numbers, create_company_index,
+                        in_company_index)
+
+# test runs can be limited to a sample of the companies that keeps joins
+# between the inputs intact. A company is picked when the hash of its encoded
+# number (see transforms.encode_company_numbers) falls below the sample
+# fraction, so the same companies are picked from every input and by both
+# scripts, run after run. Companies one ownership hop from a picked company,
+# those owning it through a corporate PSC and those it owns, are added so
+# that corporate PSC chains stay joined
+
+CORPORATE_PSC_KIND = 'corporate-entity-person-with-significant-control'
+
+
+def company_hashes(codes):
+    # splitmix64 of each code as a float in [0, 1)
+    x = np.asarray(codes).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) / 2.0**53
+
+
+def in_hash_sample(codes, fraction):
+    codes = np.asarray(codes)
+    return (codes >= 0) & (company_hashes(codes) < fraction)
+
+
+def create_company_sample(fraction, company_numbers, owner_numbers):
+    # sample of fraction of the companies plus both ends of every ownership
+    # edge with a picked end. company_numbers are the companies with
+    # corporate PSCs and owner_numbers the registration numbers of those
+    # PSCs, any that aren't company numbers are ignored
+    owned = encode_company_numbers(company_numbers)
+    owners = encode_company_numbers(
+        owner_numbers.str.strip().str.zfill(8).str.upper())
+    hops = (owned >= 0) & (owners >= 0) & (
+        in_hash_sample(owned, fraction) | in_hash_sample(owners, fraction))
+    return {
+        'fraction': fraction,
+        'hops': create_company_index(
+            np.concatenate([owned[hops], owners[hops]]))
+    }
+
+
+def corporate_psc_owners(df):
+    # company numbers and registration numbers of the corporate PSCs of df
+    corporate = df[(df.kind == CORPORATE_PSC_KIND).values
+                   & df.identification_registration_number.notnull().values]
+    return (corporate.company_number,
+            corporate.identification_registration_number.astype(str))
+
+
+def in_company_sample(codes, company_sample):
+    return in_hash_sample(codes, company_sample['fraction']) | \
+        in_company_index(codes, company_sample['hops'])
+
+
+def sample_companies(df, company_sample):
+    # rows of df whose company_number is in the sample
+    if company_sample is None:
+        return df
+    return df[in_company_sample(
+        encode_company_numbers(df.company_number), company_sample)]
+
+
+def print_company_sample(company_sample):
+    print('Sampling {:.2%} of companies and the companies one ownership hop '
+          'from them, {} companies have an ownership link in the sample...'.
+          format(company_sample['fraction'], len(company_sample['hops'])))
@@ -0,0 +1,216 @@
+#!/usr/bin/env
+
+import io
+import os
+import atexit
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+# where the scripts read and write their files, 's3' for the bucket named at
+# the start of their paths with the credentials given on the command line or
+# 'local' for LOCAL_STORAGE_ROOT, a directory laid out like the bucket
+STORAGE_BACKEND = 's3'
+LOCAL_STORAGE_ROOT = None
+# S3 objects are read with up to this many concurrent ranged GETs of
+# S3_PART_SIZE bytes each and written with as many concurrent multipart
+# uploads
+S3_CONCURRENCY = 16
+S3_PART_SIZE = 64 * 1024 * 1024
+# files prefetch downloads at the same time
+PREFETCH_FILES = 4
+
+
+def create_filesystem(key=None, secret=None):
+    # the s3fs.S3FileSystem calls the scripts use (open, ls, info, get and
+    # exists) plus prefetch, which fetches a list of files or directories
+    # ending in / ahead of the reads, and reconnect, which forked processes
+    # call to stop sharing the parent's S3 connections
+    if STORAGE_BACKEND == 'local':
+        return create_local_filesystem(LOCAL_STORAGE_ROOT)
+    if STORAGE_BACKEND == 's3':
+        return create_s3_filesystem(key, secret)
+    raise ValueError('Unknown STORAGE_BACKEND {}'.format(STORAGE_BACKEND))
+
+
+def create_local_filesystem(root):
+    # the part of the s3fs.S3FileSystem interface the scripts use, over a
+    # local directory laid out like the bucket
+    def local_path(path):
+        return os.path.join(root, path)
+
+    def open_file(path, mode='rb', **kwargs):
+        directory = os.path.dirname(local_path(path))
+        if 'w' in mode and not os.path.exists(directory):
+            os.makedirs(directory)
+        return open(local_path(path), mode)
+
+    def ls(path):
+        return sorted(
+            os.path.join(path, x) for x in os.listdir(local_path(path)))
+
+    def info(path):
+        stat = os.stat(local_path(path))
+        return {
+            'Key': path,
+            'Size': stat.st_size,
+            'LastModified': stat.st_mtime
+        }
+
+    def get(path, destination):
+        shutil.copyfile(local_path(path), destination)
+
+    def exists(path):
+        return os.path.exists(local_path(path))
+
+    def prefetch(paths):
+        pass
+
+    def reconnect():
+        pass
+
+    return SimpleNamespace(
+        open=open_file,
+        ls=ls,
+        info=info,
+        get=get,
+        exists=exists,
+        prefetch=prefetch,
+        reconnect=reconnect)
+
+
+def create_s3_filesystem(key, secret):
+    # s3fs lists the bucket and reads metadata. Files are read from local
+    # copies and written to local files uploaded when closed, both moved by
+    # boto3's managed transfers, which split them into parts moved
+    # concurrently. The local copies are removed on exit
+    import s3fs
+    from boto3.s3.transfer import TransferConfig
+    s3 = s3fs.S3FileSystem(key=key, secret=secret, anon=False)
+    config = TransferConfig(
+        multipart_threshold=S3_PART_SIZE,
+        multipart_chunksize=S3_PART_SIZE,
+        max_concurrency=S3_CONCURRENCY)
+    local_dir = tempfile.mkdtemp(prefix='s3_files_')
+    atexit.register(shutil.rmtree, local_dir, True)
+    prefetched = {}
+
+    def local_file():
+        fd, path = tempfile.mkstemp(dir=local_dir)
+        os.close(fd)
+        return path
+
+    def download(path, destination):
+        bucket, key = split_s3_path(path)
+        s3.s3.download_file(bucket, key, destination, Config=config)
+
+    def upload(local_path, path):
+        bucket, key = split_s3_path(path)
+        s3.s3.upload_file(local_path, bucket, key, Config=config)
+        s3.invalidate_cache(path)
+
+    def open_file(path, mode='rb', **kwargs):
+        if 'w' in mode:
+            raw = UploadOnClose(local_file(), lambda x: upload(x, path))
+            f = UploadBufferedWriter(raw)
+            if 'b' in mode:
+                return f
+            return UploadTextWrapper(f, encoding=kwargs.get('encoding'))
+        if path in prefetched:
+            return open(prefetched[path], mode)
+        # the copy goes as soon as it's closed
+        local_path = local_file()
+        download(path, local_path)
+        f = open(local_path, mode)
+        os.remove(local_path)
+        return f
+
+    def get(path, destination):
+        if path in prefetched:
+            shutil.copyfile(prefetched[path], destination)
+        else:
+            download(path, destination)
+
+    def fetch(path):
+        local_path = local_file()
+        download(path, local_path)
+        prefetched[path] = local_path
+
+    def prefetch(paths):
+        files = []
+        for path in paths:
+            files.extend(s3.ls(path) if path.endswith('/') else [path])
+        files = [x for x in files if x not in prefetched]
+        with ThreadPoolExecutor(PREFETCH_FILES) as executor:
+            list(executor.map(fetch, files))
+        if files:
+            print('Prefetched {} files...'.format(len(files)))
+
+    def reconnect():
+        # boto3 clients and their connection pools can't be shared between
+        # processes, a forked process calls this before using S3. s3fs keys
+        # its connections on the process id so this makes a new client
+        s3.s3 = s3.connect()
+
+    return SimpleNamespace(
+        open=open_file,
+        ls=s3.ls,
+        info=s3.info,
+        get=get,
+        exists=s3.exists,
+        prefetch=prefetch,
+        reconnect=reconnect)
+
+
+def split_s3_path(path):
+    if path.startswith('s3://'):
+        path = path[len('s3://'):]
+    bucket, _, key = path.partition('/')
+    return bucket, key
+
+
+class UploadOnClose(io.FileIO):
+    # local file passed to upload once closed, then removed. A discarded
+    # file is removed without being uploaded, so a write that fails part way
+    # leaves the last complete copy in place
+    def __init__(self, path, upload):
+        super().__init__(path, 'w')
+        self.upload = upload
+        self.discarded = False
+
+    def discard(self):
+        self.discarded = True
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        try:
+            if not self.discarded:
+                self.upload(self.name)
+        finally:
+            os.remove(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.discard()
+        return super().__exit__(exc_type, exc_value, traceback)
+
+
+# the buffered and text layers over UploadOnClose, which discard it when the
+# with block writing them raises rather than uploading what was written
+
+
+class UploadBufferedWriter(io.BufferedWriter):
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.raw.discard()
+        return super().__exit__(exc_type, exc_value, traceback)
+
+
+class UploadTextWrapper(io.TextIOWrapper):
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.buffer.raw.discard()
+        return super().__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,1022 @@
+#!/usr/bin/env
+
+import os
+import sys
+import json
+import numpy as np
+import pandas as pd
+
+# usage: python synthetic_data.py <output directory> [scale] [seed]
+# writes synthetic inputs in the layout the scripts read from S3: raw/,
+# interim/ and processed/politicians.csv
+
+# live companies at scale 1, about a four hundredth of the March 2019
+# register. The other inputs are sized relative to it as in the 2019 dumps
+COMPANIES_PER_SCALE = 10000
+# companies in the PSC snapshot and officer files that have since dissolved
+DISSOLVED_COMPANIES_SHARE = 0.12
+OFFICERS_PER_COMPANY = 2.2
+OFFICERS_PER_FILE = 500000
+DISQUALIFIED_DIRECTORS_PER_COMPANY = 1 / 450
+POLITICIANS_PER_COMPANY = 1 / 60
+# share of individual PSC and officer roles held by someone who doesn't
+# already hold one, the rest go to existing people in proportion to the roles
+# they already hold so a few people hold very many
+NEW_PERSON_SHARE = 0.6
+# share of a person's roles registered at another address, or for officers
+# under another person number, the duplicates probable_id_edges joins up
+PERSON_VARIANT_SHARE = 0.15
+# chance the owner named by a UK corporate PSC itself has a corporate PSC,
+# giving ownership chains of geometrically distributed length
+CHAIN_CONTINUES_SHARE = 0.5
+SNAPSHOT_FILENAME = 'persons-with-significant-control-snapshot-2019-03-05.txt'
+LIVE_COMPANIES_FILENAME = 'BasicCompanyDataAsOneFile-2019-03-01.csv'
+MANIFEST_FILENAME = 'synthetic_data.json'
+
+# (prefix, share of the register, CompanyCategory)
+COMPANY_PREFIXES = [
+    ('', 0.9, 'Private Limited Company'),
+    ('SC', 0.055, 'Private Limited Company'),
+    ('NI', 0.014, 'Private Limited Company'),
+    ('OC', 0.014, 'Limited Liability Partnership'),
+    ('LP', 0.006, 'Limited Partnership'),
+    ('SL', 0.004, 'Limited Partnership'),
+    ('SO', 0.001, 'Limited Liability Partnership'),
+    ('FC', 0.002, 'Other company type'),
+    ('CE', 0.002, 'Charitable Incorporated Organisation'),
+    ('IP', 0.002, 'Registered Society'),
+]
+OTHER_CATEGORIES = [
+    ('PRI/LTD BY GUAR/NSC (Private, limited by guarantee, no share '
+     'capital)', 0.04),
+    ('Community Interest Company', 0.01),
+    ('Public Limited Company', 0.002),
+    ('Private Unlimited Company', 0.001),
+]
+COMPANY_STATUSES = [('Active', 0.93), ('Active - Proposal to Strike off',
+                                       0.05), ('Liquidation', 0.02)]
+PSC_KINDS = [
+    ('individual-person-with-significant-control', 0.86),
+    ('corporate-entity-person-with-significant-control', 0.085),
+    ('persons-with-significant-control-statement', 0.0523),
+    ('legal-person-person-with-significant-control', 0.002),
+    ('exemptions', 0.0005),
+    ('super-secure-person-with-significant-control', 0.0002),
+]
+COMPANY_NAME_SUFFIXES = {
+    'Limited Liability Partnership': 'LLP',
+    'Limited Partnership': 'LP',
+    'Public Limited Company': 'PLC',
+    'Community Interest Company': 'CIC',
+    'Charitable Incorporated Organisation': 'FOUNDATION',
+    'Registered Society': 'SOCIETY',
+    'Other company type': 'INC'
+}
+PSC_LINK_PATHS = {
+    'individual-person-with-significant-control':
+    'persons-with-significant-control/individual/',
+    'corporate-entity-person-with-significant-control':
+    'persons-with-significant-control/corporate-entity/',
+    'legal-person-person-with-significant-control':
+    'persons-with-significant-control/legal-person/',
+    'super-secure-person-with-significant-control':
+    'persons-with-significant-control/super-secure/',
+    'persons-with-significant-control-statement':
+    'persons-with-significant-control-statements/',
+    'exemptions': 'exemptions/'
+}
+PSC_STATEMENTS = [
+    ('no-individual-or-entity-with-signficant-control', 0.6),
+    ('steps-to-find-psc-not-yet-completed', 0.15),
+    ('psc-exists-but-not-identified', 0.1),
+    ('psc-details-not-confirmed', 0.08),
+    ('psc-contacted-but-no-response', 0.04),
+    ('psc-has-failed-to-confirm-changed-details', 0.03),
+]
+COMPANY_NATURES = [
+    (['ownership-of-shares-75-to-100-percent',
+      'voting-rights-75-to-100-percent',
+      'right-to-appoint-and-remove-directors'], 0.4),
+    (['ownership-of-shares-25-to-50-percent',
+      'voting-rights-25-to-50-percent'], 0.3),
+    (['ownership-of-shares-50-to-75-percent',
+      'voting-rights-50-to-75-percent'], 0.1),
+    (['significant-influence-or-control'], 0.1),
+    (['ownership-of-shares-25-to-50-percent'], 0.1),
+]
+LLP_NATURES = [
+    (['right-to-share-surplus-assets-75-to-100-percent-limited-liability-'
+      'partnership', 'voting-rights-75-to-100-percent-limited-liability-'
+      'partnership'], 0.4),
+    (['right-to-share-surplus-assets-25-to-50-percent-limited-liability-'
+      'partnership'], 0.4),
+    (['significant-influence-or-control-limited-liability-partnership'],
+     0.2),
+]
+EXEMPTION_TYPES = [
+    'psc_exempt_as_trading_on_regulated_market',
+    'psc_exempt_as_shares_admitted_on_market',
+    'disclosure_transparency_rules_chapter_five_applies'
+]
+# country spellings as they appear in the free text fields, with their share
+COUNTRIES = [
+    ('England', 0.45), ('United Kingdom', 0.25), ('ENGLAND', 0.05),
+    ('Scotland', 0.04), ('Wales', 0.02), ('UK', 0.02),
+    ('Northern Ireland', 0.01), ('England And Wales', 0.01),
+    ('Great Britain', 0.01), ('Jersey', 0.006), ('Guernsey', 0.005),
+    ('Isle Of Man', 0.004), ('British Virgin Islands', 0.006),
+    ('Virgin Islands, British', 0.002), ('Cayman Islands', 0.003),
+    ('Gibraltar', 0.002), ('Seychelles', 0.002), ('Belize', 0.001),
+    ('Panama', 0.001), ('Cyprus', 0.002), ('Luxembourg', 0.003),
+    ('Netherlands', 0.004), ('Ireland', 0.008), ('France', 0.005),
+    ('Germany', 0.005), ('Switzerland', 0.003), ('United States', 0.008),
+    ('USA', 0.003), ('Hong Kong', 0.003), ('China', 0.004),
+    ('India', 0.004), ('Delaware', 0.001), ('U.K.', 0.001)
+]
+# the cleaner maps deliberately miss a couple of the spellings above, as the
+# real maps do
+COUNTRY_CLEAN_MAP = {
+    'ENGLAND': 'UNITED KINGDOM', 'UNITED KINGDOM': 'UNITED KINGDOM',
+    'SCOTLAND': 'UNITED KINGDOM', 'WALES': 'UNITED KINGDOM',
+    'UK': 'UNITED KINGDOM', 'NORTHERN IRELAND': 'UNITED KINGDOM',
+    'ENGLAND AND WALES': 'UNITED KINGDOM', 'GREAT BRITAIN': 'UNITED KINGDOM',
+    'JERSEY': 'JERSEY', 'GUERNSEY': 'GUERNSEY', 'ISLE OF MAN': 'ISLE OF MAN',
+    'BRITISH VIRGIN ISLANDS': 'BRITISH VIRGIN ISLANDS',
+    'VIRGIN ISLANDS, BRITISH': 'BRITISH VIRGIN ISLANDS',
+    'CAYMAN ISLANDS': 'CAYMAN ISLANDS', 'GIBRALTAR': 'GIBRALTAR',
+    'SEYCHELLES': 'SEYCHELLES', 'BELIZE': 'BELIZE', 'PANAMA': 'PANAMA',
+    'CYPRUS': 'CYPRUS', 'LUXEMBOURG': 'LUXEMBOURG',
+    'NETHERLANDS': 'NETHERLANDS', 'IRELAND': 'IRELAND', 'FRANCE': 'FRANCE',
+    'GERMANY': 'GERMANY', 'SWITZERLAND': 'SWITZERLAND',
+    'UNITED STATES': 'UNITED STATES', 'USA': 'UNITED STATES',
+    'HONG KONG': 'HONG KONG', 'CHINA': 'CHINA', 'INDIA': 'INDIA'
+}
+SECRET_JURISDICTIONS = [
+    'JERSEY', 'GUERNSEY', 'ISLE OF MAN', 'BRITISH VIRGIN ISLANDS',
+    'CAYMAN ISLANDS', 'GIBRALTAR', 'SEYCHELLES', 'BELIZE', 'PANAMA',
+    'CYPRUS', 'LUXEMBOURG', 'SWITZERLAND', 'HONG KONG', 'DELAWARE'
+]
+RECOGNISED_STOCK_EXCHANGE_COUNTRIES = [
+    'France', 'Germany', 'Netherlands', 'Luxembourg', 'Ireland',
+    'Switzerland', 'Hong Kong', 'China', 'India', 'United States'
+]
+URL_COMPANY_CODES = [
+    ('EAW', 'England and Wales Company', ''), ('SC', 'Scottish Company', ''),
+    ('NI', 'Northern Ireland Company', ''),
+    ('OC', 'England and Wales LLP', ''), ('SO', 'Scottish LLP', ''),
+    ('NC', 'Northern Ireland LLP', ''),
+    ('LP', 'England and Wales Limited Partnership', 'X'),
+    ('SL', 'Scottish Limited Partnership', ''),
+    ('NL', 'Northern Ireland Limited Partnership', 'X'),
+    ('FC', 'Overseas Company', 'X'), ('SF', 'Overseas Company', 'X'),
+    ('NF', 'Overseas Company', 'X'),
+    ('IP', 'Industrial and Provident Society', 'X'),
+    ('SP', 'Scottish Industrial and Provident Society', 'X'),
+    ('RC', 'Royal Charter Company', 'X'), ('CE', 'Charitable CIO', ''),
+    ('CS', 'Scottish Charitable CIO', '')
+]
+FORENAMES = [
+    'John', 'David', 'Michael', 'Paul', 'Andrew', 'Mark', 'James', 'Peter',
+    'Richard', 'Robert', 'Stephen', 'Christopher', 'Ian', 'Simon', 'Thomas',
+    'Daniel', 'Matthew', 'Mohammed', 'Ali', 'Wei', 'Raj', 'Piotr', 'Sarah',
+    'Susan', 'Elizabeth', 'Helen', 'Claire', 'Emma', 'Karen', 'Julie',
+    'Nicola', 'Rachel', 'Laura', 'Jane', 'Catherine', 'Louise', 'Fatima',
+    'Priya', 'Anna', 'Olga', 'Mary Ann', 'Jean-Luc', 'Li Wei', 'Amir'
+]
+MIDDLE_NAMES = [
+    'James', 'John', 'Edward', 'William', 'Anne', 'Marie', 'Louise', 'Ahmed',
+    'Kumar', 'Alexander'
+]
+SURNAMES = [
+    'Smith', 'Jones', 'Williams', 'Taylor', 'Brown', 'Davies', 'Evans',
+    'Wilson', 'Thomas', 'Johnson', 'Roberts', 'Robinson', 'Thompson',
+    'Wright', 'Walker', 'White', 'Edwards', 'Hughes', 'Green', 'Hall',
+    'Lewis', 'Harris', 'Clarke', 'Patel', 'Jackson', 'Wood', 'Turner',
+    'Martin', 'Cooper', 'Hill', 'Ward', 'Morris', 'Moore', 'Clark', 'Lee',
+    'King', 'Baker', 'Harrison', 'Morgan', 'Allen', 'James', 'Scott',
+    'Phillips', 'Watson', 'Davis', 'Parker', 'Price', 'Bennett', 'Young',
+    'Griffiths', 'Mitchell', 'Kelly', 'Cook', 'Carter', 'Richardson',
+    'Bailey', 'Collins', 'Bell', 'Shaw', 'Murphy', 'Miller', 'Cox', 'Khan',
+    'Singh', 'Ahmed', 'Chen', 'Wang', 'Nowak', 'Van Dyke', "O'Neil",
+    'Mac Donald', 'Ng'
+]
+TITLES = [('Mr', 0.62), ('Mrs', 0.16), ('Ms', 0.08), ('Miss', 0.06),
+          ('Dr', 0.05), ('Sir', 0.002), (None, 0.028)]
+NATIONALITIES = [('British', 0.8), ('English', 0.05), ('Irish', 0.02),
+                 ('Indian', 0.02), ('Polish', 0.02), ('Chinese', 0.02),
+                 ('American', 0.02), ('German', 0.015), ('French', 0.015),
+                 ('Scottish', 0.02)]
+OCCUPATIONS = [('Director', 0.55), ('Company Director', 0.25),
+               ('Accountant', 0.04), ('Consultant', 0.04),
+               ('Solicitor', 0.02), ('Engineer', 0.03), ('None', 0.02),
+               ('Retired', 0.05)]
+COMPANY_WORDS = [
+    'ACORN', 'ALPHA', 'APEX', 'ATLAS', 'BEACON', 'BLUE', 'BRIDGE', 'CASTLE',
+    'CEDAR', 'CENTRAL', 'CITY', 'CROWN', 'DELTA', 'EAGLE', 'EAST', 'FALCON',
+    'GOLDEN', 'GREEN', 'HARBOUR', 'HIGHLAND', 'IMPERIAL', 'KINGS', 'LION',
+    'MAPLE', 'MERIDIAN', 'NORTH', 'OAK', 'OMEGA', 'PHOENIX', 'PRIME',
+    'QUEENS', 'RED', 'RIVER', 'ROYAL', 'SILVER', 'SOUTH', 'SUMMIT', 'UNION',
+    'VICTORIA', 'WEST'
+]
+COMPANY_SECTORS = [
+    'PROPERTIES', 'HOLDINGS', 'CONSULTING', 'SERVICES', 'INVESTMENTS',
+    'TRADING', 'DEVELOPMENTS', 'CAPITAL', 'SOLUTIONS', 'MEDIA', 'ESTATES',
+    'TECHNOLOGIES', 'CONSTRUCTION', 'LOGISTICS', 'VENTURES', 'GROUP',
+    'PARTNERS', 'MANAGEMENT', 'FOODS', 'DESIGN'
+]
+STREETS = [
+    'HIGH STREET', 'STATION ROAD', 'CHURCH LANE', 'MAIN STREET', 'PARK ROAD',
+    'VICTORIA ROAD', 'GREEN LANE', 'MANOR ROAD', 'CHURCH STREET',
+    'LONDON ROAD', 'KINGS ROAD', 'MILL LANE', 'CITY ROAD', 'OLD STREET'
+]
+TOWNS = [('LONDON', 0.35), ('MANCHESTER', 0.06), ('BIRMINGHAM', 0.06),
+         ('LEEDS', 0.04), ('GLASGOW', 0.04), ('EDINBURGH', 0.03),
+         ('BRISTOL', 0.03), ('LIVERPOOL', 0.03), ('BELFAST', 0.02),
+         ('CARDIFF', 0.02), ('NOTTINGHAM', 0.02), ('SHEFFIELD', 0.02),
+         ('READING', 0.02), ('CAMBRIDGE', 0.02), ('OXFORD', 0.02),
+         ('BRIGHTON', 0.02), ('LEICESTER', 0.02), ('NEWCASTLE', 0.02),
+         ('SOUTHAMPTON', 0.02), ('CROYDON', 0.02), ('WATFORD', 0.02),
+         ('LUTON', 0.02), ('COVENTRY', 0.02), ('ILFORD', 0.02),
+         ('HARROW', 0.01)]
+SIC_CODES = [
+    '68209 - Other letting and operating of own or leased real estate',
+    '70229 - Management consultancy activities other than financial '
+    'management', '82990 - Other business support service activities n.e.c.',
+    '62020 - Information technology consultancy activities',
+    '64209 - Activities of other holding companies n.e.c.',
+    '96090 - Other service activities n.e.c.', '99999 - Dormant Company',
+    '41100 - Development of building projects',
+    '56101 - Licensed restaurants', '47910 - Retail sale via mail order '
+    'houses or via Internet', '43390 - Other building completion and '
+    'finishing', '74909 - Other professional, scientific and technical '
+    'activities n.e.c.'
+]
+ACCOUNT_CATEGORIES = [('TOTAL EXEMPTION FULL', 0.3), ('MICRO ENTITY', 0.3),
+                      ('NO ACCOUNTS FILED', 0.15), ('DORMANT', 0.1),
+                      ('TOTAL EXEMPTION SMALL', 0.05), ('SMALL', 0.04),
+                      ('FULL', 0.03), ('UNAUDITED ABRIDGED', 0.03)]
+LEGISLATURES = [
+    ('United Kingdom', 'House of Commons'), ('United Kingdom', 'House of '
+                                             'Lords'),
+    ('United Kingdom', 'Scottish Parliament'), ('Ireland', 'Dáil Éireann'),
+    ('France', 'Assemblée nationale'), ('Nigeria', 'Senate'),
+    ('Russia', 'State Duma'), ('Ukraine', 'Verkhovna Rada'),
+    ('Kazakhstan', 'Mazhilis'), ('Azerbaijan', 'National Assembly'),
+    ('Malta', 'Parliament'), ('Cyprus', 'House of Representatives')
+]
+
+
+def main():
+    directory = sys.argv[1]
+    scale = float(sys.argv[2]) if len(sys.argv) > 2 else 1
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    generate_inputs(directory, scale, seed)
+
+
+def generate_inputs(directory, scale=1, seed=0):
+    rng = np.random.RandomState(seed)
+    n = int(COMPANIES_PER_SCALE * scale)
+    print('Generating synthetic inputs for {} live companies in {}...'.format(
+        n, directory))
+    # numbers of live and dissolved companies are drawn together so they
+    # never collide
+    all_companies = create_companies(
+        rng, n + int(n * DISSOLVED_COMPANIES_SHARE))
+    companies = all_companies[:n]
+    dissolved = all_companies[n:].reset_index(drop=True)
+    people = create_people(rng, n * 3)
+    counts = {}
+    live_companies = create_live_companies_file(rng, companies)
+    write_csv(live_companies, directory, 'raw', LIVE_COMPANIES_FILENAME)
+    counts['live_companies'] = len(live_companies)
+    lines, used_people = create_psc_snapshot(rng, companies, dissolved,
+                                             people)
+    write_lines(lines, directory, 'raw', SNAPSHOT_FILENAME)
+    counts['psc_snapshot_lines'] = len(lines)
+    officers = create_officers(rng, companies, dissolved, people,
+                               used_people)
+    number_of_files = max(2, -(-len(officers) // OFFICERS_PER_FILE))
+    for i, officers_file in enumerate(
+            np.array_split(officers, number_of_files)):
+        write_csv(officers_file, directory, 'raw', 'officers',
+                  'persons_data_{}.csv'.format(i + 1))
+    write_csv(
+        pd.DataFrame({
+            'Company Number': companies.company_number,
+            'Company Status': 'C',
+            'Number of Officers': 0
+        }), directory, 'raw', 'officers', 'companies_data_1.csv')
+    counts['officers'] = len(officers)
+    persons, disqualifications = create_disqualified_directors(
+        rng, int(n * DISQUALIFIED_DIRECTORS_PER_COMPANY), people, used_people)
+    write_csv(persons, directory, 'raw', 'disqualified_directors',
+              'persons.csv')
+    write_csv(disqualifications, directory, 'raw', 'disqualified_directors',
+              'disqualifications.csv')
+    counts['disqualified_directors'] = len(disqualifications)
+    politicians = create_politicians(
+        rng, max(100, int(n * POLITICIANS_PER_COMPANY)), people, used_people)
+    politicians.to_csv(output_file(directory, 'processed', 'politicians.csv'))
+    counts['politicians'] = len(politicians)
+    write_reference_tables(directory)
+    with open(output_file(directory, MANIFEST_FILENAME), 'w') as f:
+        json.dump({'scale': scale, 'seed': seed, 'rows': counts}, f, indent=2)
+    print('Generated {}'.format(', '.join(
+        '{} {}'.format(count, name) for name, count in counts.items())))
+    return counts
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def output_file(directory, *parts):
+    path = os.path.join(directory, *parts)
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    return path
+
+
+def write_csv(df, directory, *parts):
+    df.to_csv(output_file(directory, *parts), index=False)
+    print('Wrote {}...'.format('/'.join(parts)))
+
+
+def write_lines(lines, directory, *parts):
+    with open(output_file(directory, *parts), 'w') as f:
+        for line in lines:
+            f.write(line)
+            f.write('\n')
+    print('Wrote {}...'.format('/'.join(parts)))
+
+
+def choose_index(rng, options, size):
+    # positions of size draws from a list of (value, weight) pairs
+    weights = np.array([x[1] for x in options], dtype=float)
+    return rng.choice(len(options), size, p=weights / weights.sum())
+
+
+def choose(rng, options, size):
+    values = np.empty(len(options), dtype=object)
+    values[:] = [x[0] for x in options]
+    return values[choose_index(rng, options, size)]
+
+
+def pick(rng, values, size):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array[rng.randint(0, len(values), size)]
+
+
+def create_company_numbers(rng, prefixes):
+    # numbers are issued in sequence within each prefix, with gaps where
+    # companies were struck off long ago
+    output = np.empty(len(prefixes), dtype=object)
+    for prefix in np.unique(prefixes):
+        positions = np.flatnonzero(prefixes == prefix)
+        width = 8 - len(prefix)
+        numbers = rng.randint(1, 10**width // 2) + np.cumsum(
+            rng.randint(1, 6, len(positions)))
+        output[positions] = [
+            '{}{}'.format(prefix,
+                          str(x).zfill(width)) for x in numbers
+        ]
+    return output
+
+
+def create_postcodes(rng, n):
+    areas = np.array([
+        'N', 'E', 'EC', 'W', 'WC', 'SE', 'SW', 'NW', 'M', 'B', 'LS', 'G',
+        'EH', 'BS', 'L', 'BT', 'CF', 'NG', 'S', 'RG', 'CB', 'OX', 'BN', 'LE'
+    ])
+    letters = np.array(list('ABDEFGHJLNPQRSTUWXYZ'))
+    return (pd.Series(areas[rng.randint(0, len(areas), n)]) +
+            pd.Series(rng.randint(1, 20, n)).astype(str) + ' ' +
+            pd.Series(rng.randint(1, 10, n)).astype(str) +
+            pd.Series(letters[rng.randint(0, len(letters), n)]) +
+            pd.Series(letters[rng.randint(0, len(letters), n)])).values
+
+
+def zipf_choice(rng, n, size, a=1.6, share=0.3):
+    # indices into n values, share of them concentrated on a handful drawn
+    # very often as with formation agents' addresses, the rest uniform
+    return np.where(
+        rng.rand(size) < share, (rng.zipf(a, size) - 1) % n,
+        rng.randint(0, n, size))
+
+
+def create_companies(rng, n):
+    prefixes = choose(rng, [(x[0], x[1]) for x in COMPANY_PREFIXES], n)
+    categories = pd.Series(prefixes).map(
+        {x[0]: x[2]
+         for x in COMPANY_PREFIXES}).values
+    other = (categories == 'Private Limited Company') & (
+        rng.rand(n) < sum(x[1] for x in OTHER_CATEGORIES))
+    categories[other] = choose(rng, OTHER_CATEGORIES, other.sum())
+    suffixes = pd.Series(categories).map(COMPANY_NAME_SUFFIXES).fillna(
+        'LIMITED')
+    suffixes[(suffixes == 'LIMITED') & (rng.rand(n) < 0.15)] = 'LTD'
+    names = pd.Series(pick(rng, COMPANY_WORDS, n)) + ' ' + pd.Series(
+        pick(rng, COMPANY_SECTORS, n))
+    repeat = names.groupby(names).cumcount()
+    names = names.where(repeat == 0, names + ' ' + (repeat + 1).astype(str))
+    postcodes = create_postcodes(rng, max(1, n // 3))
+    return pd.DataFrame({
+        'company_number': create_company_numbers(rng, prefixes),
+        'company_name': (names + ' ' + suffixes).values,
+        'category': categories,
+        'prefix': prefixes,
+        'postcode': postcodes[zipf_choice(rng, len(postcodes), n)],
+        'address_line_1': (pd.Series(rng.randint(1, 300, n)).astype(str) +
+                           ' ' + pd.Series(pick(rng, STREETS, n))).values,
+        'town': choose(rng, TOWNS, n)
+    })
+
+
+def create_live_companies_file(rng, companies):
+    # every column of the BasicCompanyData file, with its odd spacing
+    n = len(companies)
+    incorporated = pd.to_datetime('2019-02-28') - pd.to_timedelta(
+        np.minimum(rng.exponential(2500, n), 36000).astype(int), unit='D')
+    output = pd.DataFrame()
+    output['CompanyName'] = companies.company_name.values
+    output[' CompanyNumber'] = companies.company_number.values
+    output['RegAddress.CareOf'] = np.where(
+        rng.rand(n) < 0.02,
+        'C/O ' + pd.Series(pick(rng, SURNAMES, n)).str.upper(), None)
+    output['RegAddress.POBox'] = None
+    output['RegAddress.AddressLine1'] = companies.address_line_1.values
+    output[' RegAddress.AddressLine2'] = np.where(
+        rng.rand(n) < 0.4, pick(rng, ['FLOOR 2', 'SUITE 4', 'UNIT 1'], n),
+        None)
+    output['RegAddress.PostTown'] = companies.town.values
+    output['RegAddress.County'] = np.where(
+        rng.rand(n) < 0.3, pick(rng, ['GREATER LONDON', 'KENT', 'ESSEX'], n),
+        None)
+    output['RegAddress.Country'] = choose(
+        rng, [('UNITED KINGDOM', 0.5), ('ENGLAND', 0.35),
+              ('SCOTLAND', 0.05), (None, 0.1)], n)
+    output['RegAddress.PostCode'] = np.where(
+        rng.rand(n) < 0.005, None, companies.postcode.values)
+    output['CompanyCategory'] = companies.category.values
+    output['CompanyStatus'] = choose(rng, COMPANY_STATUSES, n)
+    output['CountryOfOrigin'] = 'United Kingdom'
+    output['DissolutionDate'] = None
+    output['IncorporationDate'] = incorporated.strftime('%d/%m/%Y')
+    output['Accounts.AccountRefDay'] = incorporated.day
+    output['Accounts.AccountRefMonth'] = incorporated.month
+    output['Accounts.NextDueDate'] = (incorporated + pd.to_timedelta(
+        640, unit='D')).strftime('%d/%m/%Y')
+    output['Accounts.LastMadeUpDate'] = np.where(
+        incorporated < pd.to_datetime('2018-01-01'),
+        (incorporated + pd.to_timedelta(365, unit='D')).strftime('%d/%m/%Y'),
+        None)
+    output['Accounts.AccountCategory'] = choose(rng, ACCOUNT_CATEGORIES, n)
+    output['Returns.NextDueDate'] = None
+    output['Returns.LastMadeUpDate'] = None
+    for col in [
+            'Mortgages.NumMortCharges', 'Mortgages.NumMortOutstanding',
+            'Mortgages.NumMortPartSatisfied', 'Mortgages.NumMortSatisfied'
+    ]:
+        output[col] = np.where(rng.rand(n) < 0.1, rng.randint(1, 5, n), 0)
+    output['SICCode.SicText_1'] = pick(rng, SIC_CODES, n)
+    for i in range(2, 5):
+        output['SICCode.SicText_{}'.format(i)] = np.where(
+            rng.rand(n) < 0.3 / i, pick(rng, SIC_CODES, n), None)
+    output['LimitedPartnerships.NumGenPartners'] = 0
+    output['LimitedPartnerships.NumLimPartners'] = 0
+    output['URI'] = ('http://business.data.gov.uk/id/company/' +
+                     companies.company_number).values
+    for i in range(1, 11):
+        renamed = rng.rand(n) < 0.2 / i
+        output['PreviousName_{}.CONDATE'.format(i)] = np.where(
+            renamed, incorporated.strftime('%d/%m/%Y'), None)
+        output[' PreviousName_{}.CompanyName'.format(i)] = np.where(
+            renamed, pick(rng, COMPANY_WORDS, n) + ' LIMITED', None)
+    output['ConfStmtNextDueDate'] = (incorporated + pd.to_timedelta(
+        380, unit='D')).strftime('%d/%m/%Y')
+    output[' ConfStmtLastMadeUpDate'] = None
+    return output
+
+
+def create_people(rng, n):
+    forenames = pd.Series(pick(rng, FORENAMES, n))
+    middle = rng.rand(n) < 0.35
+    forenames[middle] = forenames[middle] + ' ' + pick(
+        rng, MIDDLE_NAMES, middle.sum())
+    return pd.DataFrame({
+        'forenames': forenames.values,
+        'surname': pick(rng, SURNAMES, n),
+        'title': choose(rng, TITLES, n),
+        'birth_year': rng.randint(1935, 2000, n),
+        'birth_month': rng.randint(1, 13, n),
+        'nationality': choose(rng, NATIONALITIES, n),
+        'country_of_residence': choose(rng, COUNTRIES, n),
+        'occupation': choose(rng, OCCUPATIONS, n),
+        'postcode': create_postcodes(rng, n),
+        'address_line_1': (pd.Series(rng.randint(1, 300, n)).astype(str) +
+                           ' ' + pd.Series(pick(rng, STREETS, n))).values,
+        'town': choose(rng, TOWNS, n),
+        'person_number': np.arange(100000000, 100000000 + n * 7, 7)
+    })
+
+
+def assign_people(rng, n, used_people, pool_size):
+    # the person holding each of n roles, a new person with probability
+    # NEW_PERSON_SHARE and otherwise the holder of an earlier role, so people
+    # who already hold many roles are the most likely to get another.
+    # used_people holds the roles assigned by earlier calls and is extended
+    new_person = rng.rand(n) < NEW_PERSON_SHARE
+    earlier_role = rng.rand(n)
+    next_person = max(used_people) + 1 if used_people else 0
+    output = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        if new_person[i] or not used_people:
+            output[i] = next_person % pool_size
+            next_person += 1
+        else:
+            output[i] = used_people[int(earlier_role[i] * len(used_people))]
+        used_people.append(output[i])
+    return output
+
+
+def random_hex(rng, n, digits=40):
+    return [
+        ''.join('{:08x}'.format(x) for x in row)[:digits]
+        for row in rng.randint(0, 2**32, (n, -(-digits // 8)),
+                               dtype=np.int64)
+    ]
+
+
+def create_psc_snapshot(rng, companies, dissolved, people):
+    # one JSON line per PSC, statement or exemption. Most companies have a
+    # single PSC and a few have very many
+    used_people = []
+    all_companies = pd.concat([companies, dissolved], ignore_index=True)
+    counts = np.minimum(rng.zipf(2.6, len(all_companies)), 400)
+    excluded = all_companies.prefix.isin(['FC', 'IP', 'LP']).values
+    counts[excluded & (rng.rand(len(all_companies)) < 0.97)] = 0
+    rows = np.repeat(np.arange(len(all_companies)), counts)
+    n = len(rows)
+    kinds = choose(rng, PSC_KINDS, n)
+    individual = np.flatnonzero(
+        kinds == 'individual-person-with-significant-control')
+    holders = np.zeros(n, dtype=np.int64)
+    holders[individual] = assign_people(rng, len(individual), used_people,
+                                        len(people))
+    notified = pd.to_datetime('2016-04-06') + pd.to_timedelta(
+        np.where(rng.rand(n) < 0.45, 0, rng.randint(0, 1050, n)), unit='D')
+    ceased_on = notified + pd.to_timedelta(rng.randint(1, 900, n), unit='D')
+    llp = all_companies.prefix.isin(['OC', 'SO']).values[rows]
+    values = {
+        'etag': random_hex(rng, n),
+        'link_id': random_hex(rng, n, 27),
+        'notified_on': notified.strftime('%Y-%m-%d'),
+        'ceased_on': np.where(rng.rand(n) < 0.2,
+                              ceased_on.strftime('%Y-%m-%d'), None),
+        'natures': np.where(llp, choose_index(rng, LLP_NATURES, n),
+                            choose_index(rng, COMPANY_NATURES, n)),
+        'statement': choose(rng, PSC_STATEMENTS, n),
+        'exemption_type': pick(rng, EXEMPTION_TYPES, n),
+        # a quarter of people give the company's registered office as their
+        # address, and some move between filings
+        'at_office': rng.rand(n) < 0.25 + PERSON_VARIANT_SHARE,
+        'owner': create_corporate_owners(rng, len(companies), rows, kinds)
+    }
+    company_columns = {
+        col: all_companies[col].values
+        for col in all_companies.columns
+    }
+    person_columns = {col: people[col].values for col in people.columns}
+    lines = []
+    for i in range(n):
+        row = rows[i]
+        company_number = company_columns['company_number'][row]
+        kind = kinds[i]
+        data = {
+            'etag': values['etag'][i],
+            'kind': kind,
+            'links': {
+                'self':
+                '/company/{}/{}{}'.format(company_number,
+                                          PSC_LINK_PATHS[kind],
+                                          values['link_id'][i])
+            }
+        }
+        if kind == 'persons-with-significant-control-statement':
+            data['statement'] = values['statement'][i]
+            data['notified_on'] = values['notified_on'][i]
+            if data['statement'] == (
+                    'psc-has-failed-to-confirm-changed-details'):
+                data['linked_psc_name'] = 'Mr John Smith'
+        elif kind == 'exemptions':
+            exemption_type = values['exemption_type'][i]
+            data['exemptions'] = {
+                exemption_type: {
+                    'exemption_type': exemption_type.replace('_', '-'),
+                    'items': [{
+                        'exempt_from': values['notified_on'][i]
+                    }]
+                }
+            }
+        elif kind == 'super-secure-person-with-significant-control':
+            data['description'] = (
+                'super-secure-persons-with-significant-control')
+        else:
+            natures = LLP_NATURES if llp[i] else COMPANY_NATURES
+            data['natures_of_control'] = list(
+                natures[values['natures'][i]][0])
+            data['notified_on'] = values['notified_on'][i]
+            if values['ceased_on'][i] is not None:
+                data['ceased_on'] = values['ceased_on'][i]
+            if kind == 'individual-person-with-significant-control':
+                fill_individual_psc(data, person_columns, holders[i],
+                                    company_columns, row,
+                                    values['at_office'][i])
+            elif kind == 'corporate-entity-person-with-significant-control':
+                fill_corporate_psc(data, rng, company_columns,
+                                   values['owner'][i])
+            else:
+                fill_legal_person_psc(data, rng)
+        lines.append(
+            json.dumps({
+                'company_number': company_number,
+                'data': data
+            },
+                       sort_keys=True))
+    lines.append(
+        json.dumps({
+            'data': {
+                'exemptions_count':
+                int((kinds == 'exemptions').sum()),
+                'kind':
+                'totals#persons-of-significant-control-snapshot',
+                'persons_of_significant_control_count':
+                n,
+                'statements_count':
+                int((kinds == 'persons-with-significant-control-statement'
+                     ).sum())
+            }
+        },
+                   sort_keys=True))
+    return lines, used_people
+
+
+def address(premises_and_street, town, postcode, country):
+    premises, street = premises_and_street.split(' ', 1)
+    return {
+        'premises': premises,
+        'address_line_1': street.title(),
+        'locality': town.title(),
+        'postal_code': postcode,
+        'country': country
+    }
+
+
+def fill_individual_psc(data, people, person, companies, company,
+                        at_office):
+    title = people['title'][person]
+    forenames = people['forenames'][person].split(' ', 1)
+    surname = people['surname'][person]
+    data['name'] = ' '.join(
+        x for x in [title, people['forenames'][person], surname] if x)
+    data['name_elements'] = {'forename': forenames[0], 'surname': surname}
+    if len(forenames) > 1:
+        data['name_elements']['middle_name'] = forenames[1]
+    if title:
+        data['name_elements']['title'] = title
+    data['date_of_birth'] = {
+        'year': int(people['birth_year'][person]),
+        'month': int(people['birth_month'][person])
+    }
+    data['nationality'] = people['nationality'][person]
+    data['country_of_residence'] = people['country_of_residence'][person]
+    if at_office:
+        data['address'] = address(companies['address_line_1'][company],
+                                  companies['town'][company],
+                                  companies['postcode'][company], 'England')
+    else:
+        data['address'] = address(people['address_line_1'][person],
+                                  people['town'][person],
+                                  people['postcode'][person],
+                                  people['country_of_residence'][person])
+
+
+def create_corporate_owners(rng, live_companies, rows, kinds):
+    # the live company owning each UK corporate PSC, or -1 for foreign
+    # owners. With probability CHAIN_CONTINUES_SHARE the owner is one of the
+    # companies with corporate PSCs themselves, building chains of ownership
+    corporate = np.flatnonzero(
+        kinds == 'corporate-entity-person-with-significant-control')
+    owners = np.full(len(rows), -1, dtype=np.int64)
+    uk = corporate[rng.rand(len(corporate)) < 0.7]
+    owned = np.unique(rows[corporate])
+    owned = owned[owned < live_companies]
+    if not len(uk) or not len(owned):
+        return owners
+    owners[uk] = np.where(
+        rng.rand(len(uk)) < CHAIN_CONTINUES_SHARE,
+        owned[rng.randint(0, len(owned), len(uk))],
+        rng.randint(0, live_companies, len(uk)))
+    # a company can't own itself
+    owners[uk] = np.where(owners[uk] == rows[uk],
+                          (owners[uk] + 1) % live_companies, owners[uk])
+    return owners
+
+
+def pick_one(rng, values):
+    return values[rng.randint(0, len(values))]
+
+
+def fill_corporate_psc(data, rng, companies, owner):
+    if owner >= 0:
+        number = companies['company_number'][owner]
+        data['name'] = companies['company_name'][owner].title()
+        data['identification'] = {
+            'legal_authority': pick_one(rng, [
+                'Companies Act 2006', 'Companies Act 1985',
+                'United Kingdom (England And Wales)'
+            ]),
+            'legal_form': pick_one(rng, [
+                'Private Limited Company', 'Limited Company',
+                'Limited By Shares'
+            ]),
+            'country_registered': pick_one(rng, [
+                'England', 'England', 'United Kingdom', 'England And Wales',
+                'Scotland'
+            ]),
+            'place_registered': pick_one(rng, [
+                'Companies House', 'Registrar Of Companies For England And '
+                'Wales', 'Companies House, Cardiff'
+            ]),
+            # written without its leading zeros as often as not
+            'registration_number':
+            number.lstrip('0') if rng.rand() < 0.4 else number
+        }
+        data['address'] = address(companies['address_line_1'][owner],
+                                  companies['town'][owner],
+                                  companies['postcode'][owner], 'England')
+    else:
+        country = COUNTRIES[9 + choose_index(rng, COUNTRIES[9:], 1)[0]][0]
+        data['name'] = '{} {} {}'.format(
+            pick_one(rng, COMPANY_WORDS), pick_one(rng, COMPANY_SECTORS),
+            pick_one(rng, ['S.A.', 'B.V.', 'LTD', 'INC.', 'LLC',
+                           'GMBH'])).title()
+        data['identification'] = {
+            'legal_authority': '{} Law'.format(country),
+            'legal_form': 'Limited Company',
+            'country_registered': country,
+            'place_registered': '{} Registry'.format(country),
+            'registration_number': '{}{}'.format(
+                pick_one(rng, ['', 'HE', 'B', 'C']), rng.randint(1, 999999))
+        }
+        data['address'] = {
+            'premises': str(rng.randint(1, 99)),
+            'address_line_1': 'Main Street',
+            'locality': 'Capital City',
+            'country': country
+        }
+
+
+def fill_legal_person_psc(data, rng):
+    data['name'] = 'The Secretary Of State For {}'.format(
+        pick_one(rng, ['Transport', 'Health', 'Defence']))
+    data['identification'] = {
+        'legal_authority': 'United Kingdom',
+        'legal_form': 'Government Department'
+    }
+    data['address'] = {
+        'premises': '1',
+        'address_line_1': 'Victoria Street',
+        'locality': 'London',
+        'postal_code': 'SW1H 0ET',
+        'country': 'United Kingdom'
+    }
+
+
+def create_officers(rng, companies, dissolved, people, used_people):
+    # current appointments, as the persons_data files, with some officers
+    # of dissolved companies that are filtered out
+    all_companies = pd.concat([companies, dissolved], ignore_index=True)
+    n = int(len(companies) * OFFICERS_PER_COMPANY)
+    rows = rng.randint(0, len(all_companies), n)
+    corporate = rng.rand(n) < 0.04
+    holders = assign_people(rng, n, used_people, len(people))
+    officers = people.iloc[holders].reset_index(drop=True)
+    # the same person appointed under another person number
+    renumbered = rng.rand(n) < PERSON_VARIANT_SHARE
+    person_numbers = officers.person_number.values.copy()
+    person_numbers[renumbered] = rng.randint(200000000, 900000000,
+                                             renumbered.sum())
+    llp = all_companies.prefix.isin(['OC', 'SO']).values[rows]
+    appointment_types = np.where(
+        llp, choose(rng, [(4, 0.7), (5, 0.3)], n),
+        choose(rng, [(1, 0.75), (0, 0.24), (11, 0.01)], n))
+    appointed = pd.to_datetime('2019-02-28') - pd.to_timedelta(
+        np.minimum(rng.exponential(2000, n), 20000).astype(int), unit='D')
+    # corporate officers are usually other live companies, at their
+    # registered office
+    corporate_officer = rng.randint(0, len(companies), n)
+    output = pd.DataFrame({
+        'Company Number':
+        all_companies.company_number.values[rows],
+        'Record Type':
+        2,
+        'App Date Origin':
+        choose(rng, [(' ', 0.6), ('1', 0.3), ('2', 0.1)], n),
+        'Appointment Type':
+        appointment_types,
+        'Person number':
+        pd.Series(person_numbers).astype(str).str.zfill(12).values,
+        'Corporate Indicator':
+        np.where(corporate, 'Y', ' '),
+        'Appointment Date':
+        appointed.strftime('%Y%m%d'),
+        'Resignation Date':
+        None,
+        'Person Postcode':
+        np.where(corporate, companies.postcode.values[corporate_officer],
+                 officers.postcode.values),
+        'Partial Date of Birth':
+        np.where(
+            corporate | (rng.rand(n) < 0.03), None,
+            pd.Series(officers.birth_year).astype(str) + pd.Series(
+                officers.birth_month).astype(str).str.zfill(2)),
+        'Full Date of Birth':
+        None,
+        'Title':
+        np.where(corporate, None, officers.title.values),
+        'Forenames':
+        np.where(corporate, None, officers.forenames.values),
+        'Surname':
+        np.where(corporate, companies.company_name.values[corporate_officer],
+                 pd.Series(officers.surname).str.upper().values),
+        'Honours':
+        np.where(rng.rand(n) < 0.003, pick(rng, ['OBE', 'MBE', 'CBE'], n),
+                 None),
+        'Care Of':
+        None,
+        'PO Box':
+        None,
+        'Address Line 1':
+        np.where(corporate,
+                 companies.address_line_1.values[corporate_officer],
+                 officers.address_line_1.values),
+        'Address Line 2':
+        None,
+        'Post Town':
+        np.where(corporate, companies.town.values[corporate_officer],
+                 officers.town.values),
+        'County':
+        None,
+        'Country':
+        np.where(corporate, 'United Kingdom',
+                 officers.country_of_residence.values),
+        'Occupation':
+        np.where(corporate, None, officers.occupation.values),
+        'Nationality':
+        np.where(corporate, None, officers.nationality.values),
+        'Resident Country':
+        np.where(corporate, None, officers.country_of_residence.values)
+    })
+    return output
+
+
+def create_disqualified_directors(rng, n, people, used_people):
+    # a third are people holding roles in the other files
+    from_roles = rng.rand(n) < 0.35
+    holders = np.where(from_roles, np.array(used_people or [0])[rng.randint(
+        0, max(1, len(used_people)), n)], rng.randint(0, len(people), n))
+    disqualified = people.iloc[holders].reset_index(drop=True)
+    person_numbers = pd.Series(np.arange(n) + 1).astype(str).str.zfill(12)
+    persons = pd.DataFrame({
+        'person_number':
+        person_numbers.values,
+        'title':
+        disqualified.title.values,
+        'forenames':
+        pd.Series(disqualified.forenames).str.upper().values,
+        'surname':
+        pd.Series(disqualified.surname).str.upper().values,
+        'honours':
+        None,
+        'person_dob':
+        (pd.Series(disqualified.birth_year).astype(str) +
+         pd.Series(disqualified.birth_month).astype(str).str.zfill(2) +
+         pd.Series(rng.randint(1, 29, n)).astype(str).str.zfill(2)).values,
+        'nationality':
+        disqualified.nationality.values,
+        'address_line_1':
+        disqualified.address_line_1.values,
+        'post_town':
+        disqualified.town.values,
+        'postcode':
+        disqualified.postcode.values
+    })
+    # a few people have been disqualified more than once
+    disqualifications = pd.concat(
+        [
+            persons[['person_number']],
+            persons[['person_number']].sample(frac=0.1, random_state=rng)
+        ],
+        ignore_index=True)
+    start = pd.to_datetime('2019-02-28') - pd.to_timedelta(
+        rng.randint(0, 4000, len(disqualifications)), unit='D')
+    disqualifications['disqual_type'] = choose(
+        rng, [('ORDER', 0.2), ('UNDERTAKING', 0.8)], len(disqualifications))
+    disqualifications['disqual_start_date'] = start.strftime('%Y%m%d')
+    disqualifications['disqual_end_date'] = (start + pd.to_timedelta(
+        rng.randint(730, 5475, len(disqualifications)),
+        unit='D')).strftime('%Y%m%d')
+    disqualifications['section_of_the_act'] = choose(
+        rng, [('CDDA 1986 Section 6', 0.7), ('CDDA 1986 Section 7', 0.3)],
+        len(disqualifications))
+    return persons, disqualifications
+
+
+def create_politicians(rng, n, people, used_people):
+    # in the shape everypolitician_retrieve.py writes, a few are people
+    # holding roles and some sit in more than one legislature
+    from_roles = rng.rand(n) < 0.05
+    holders = np.where(from_roles, np.array(used_people or [0])[rng.randint(
+        0, max(1, len(used_people)), n)], rng.randint(0, len(people), n))
+    politicians = people.iloc[holders].reset_index(drop=True)
+    first_names = pd.Series(politicians.forenames).str.split(' ').str[0]
+    last_names = pd.Series(politicians.surname).str.split(' ').str[-1]
+    month_year = pd.Series(politicians.birth_year).astype(str) + '-' + \
+        pd.Series(politicians.birth_month).astype(str).str.zfill(2)
+    full_date = rng.rand(n) < 0.7
+    legislatures = np.array(LEGISLATURES, dtype=object)[rng.randint(
+        0, len(LEGISLATURES), n)]
+    start_year = rng.randint(1990, 2016, n)
+    output = pd.DataFrame({
+        'birth_date':
+        np.where(full_date, month_year + '-15', month_year),
+        'id': ['{}-{}'.format(x, y) for x, y in zip(
+            random_hex(rng, n, 8), random_hex(rng, n, 8))],
+        'leg_country':
+        legislatures[:, 0],
+        'leg_name':
+        legislatures[:, 1],
+        'name': (first_names + ' ' + last_names).values,
+        'org_affiliation':
+        pick(rng, ['Labour', 'Conservative', 'Independent', 'Liberal'], n),
+        'active_periods': [
+            '{}-05-01 -> {}-05-01'.format(x, x + 4) for x in start_year
+        ],
+        'birth_date_type':
+        np.where(full_date, 'full date', 'year and month'),
+        'first_name':
+        first_names.values,
+        'last_name':
+        last_names.values,
+        'datetime_extracted':
+        '2019-03-01 09:00:00',
+        'month_year':
+        month_year.values,
+    })
+    output['join_id'] = (output.first_name.str.upper() + '-' +
+                         output.last_name.str.upper() + '_' +
+                         output.month_year)
+    again = output[rng.rand(n) < 0.1].copy()
+    again_legislatures = np.array(
+        LEGISLATURES, dtype=object)[rng.randint(0, len(LEGISLATURES),
+                                                 len(again))]
+    again['leg_country'] = again_legislatures[:, 0]
+    again['leg_name'] = again_legislatures[:, 1]
+    output = pd.concat([output, again], ignore_index=True)
+    output.index = output.id.values
+    output.index.name = 'id'
+    return output
+
+
+def write_reference_tables(directory):
+    write_csv(
+        pd.DataFrame(
+            URL_COMPANY_CODES,
+            columns=['Prefix', 'Company Type', 'Excluded from PSC']),
+        directory, 'interim', 'companies_house_url_type_codes.csv')
+    pd.Series(SECRET_JURISDICTIONS).to_csv(
+        output_file(directory, 'interim', 'secret_jurisdictions.csv'),
+        index=False,
+        header=False)
+    write_csv(
+        pd.DataFrame({
+            'country_name': RECOGNISED_STOCK_EXCHANGE_COUNTRIES
+        }), directory, 'interim', 'recognised_stock_exchange_countries.csv')
+    clean_map = pd.DataFrame(
+        sorted(COUNTRY_CLEAN_MAP.items()), columns=['original', 'clean'])
+    registered = clean_map.original.isin(
+        [x.upper() for x, share in COUNTRIES[9:]])
+    write_csv(clean_map[registered], directory, 'interim',
+              'registered_country_cleaner_map.csv')
+    write_csv(clean_map, directory, 'interim',
+              'address_country_cleaner_map.csv')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env
+
+import io
+from contextlib import ExitStack
+import numpy as np
+import pandas as pd
+import pytest
+from columnar import (write_parquet, read_parquet, to_arrow_table,
+                      arrow_types, merge_arrow_types, create_arrow_schema,
+                      create_parquet_writer)
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+COLUMN_KINDS = {
+    'company_number': 'string',
+    'kind': 'category',
+    'ceased_on': 'string',
+    'date_of_birth_year': 'number',
+    'natures_of_control': 'list',
+    'secret_base': 'bool'
+}
+
+
+def create_records():
+    # the first half has no ceased_on and no natures_of_control values, as
+    # a chunk of active records might
+    return pd.DataFrame({
+        'company_number': ['00000001', '00000002', '00000003', '00000004'],
+        'kind':
+        pd.Categorical(
+            ['individual', 'corporate', 'individual', 'exemptions']),
+        'ceased_on': [np.nan, np.nan, '2018-01-01', np.nan],
+        'date_of_birth_year': [1970.0, np.nan, 1980.0, 1990.0],
+        'natures_of_control': [np.nan, np.nan, ['voting'], ['shares']],
+        'secret_base': [False, True, False, False]
+    })
+
+
+class UnclosedBytesIO(io.BytesIO):
+    # keeps the written bytes readable after the parquet writer closes it
+    def close(self):
+        pass
+
+
+def write_whole(df):
+    f = UnclosedBytesIO()
+    write_parquet(df, f, COLUMN_KINDS)
+    f.seek(0)
+    return f
+
+
+def write_in_parts(df, size):
+    # as process_company_data writes spilled partials: the types of every
+    # part are merged before the writer is made, each part gets its own
+    # categories
+    parts = [df.iloc[i:i + size].copy() for i in range(0, len(df), size)]
+    for part in parts:
+        part['kind'] = part.kind.astype(object).astype('category')
+    types = {}
+    for part in parts:
+        merge_arrow_types(types, arrow_types(part))
+    f = UnclosedBytesIO()
+    with ExitStack() as stack:
+        writer = create_parquet_writer(
+            stack, f, create_arrow_schema(df.columns, types, COLUMN_KINDS))
+        for part in parts:
+            writer.write_table(to_arrow_table(part, writer.schema))
+    f.seek(0)
+    return f
+
+
+def field_type(schema, name):
+    return str(schema.types[schema.names.index(name)])
+
+
+def test_categories_are_declared_as_dictionaries():
+    schema = create_arrow_schema(['kind'], {}, COLUMN_KINDS)
+    assert field_type(schema, 'kind').startswith('dictionary')
+
+
+def test_parts_have_the_schema_of_the_whole_table():
+    # only the whole table's schema carries the pandas metadata
+    df = create_records()
+    whole = pq.read_schema(write_whole(df))
+    parts = pq.read_schema(write_in_parts(df, 2))
+    assert whole.remove_metadata().equals(parts.remove_metadata())
+    assert field_type(whole, 'ceased_on') == 'string'
+
+
+def test_all_null_columns_keep_their_declared_type():
+    df = create_records().iloc[:2]
+    schema = pq.read_schema(write_whole(df))
+    assert field_type(schema, 'ceased_on') == 'string'
+    assert field_type(schema, 'natures_of_control').startswith('list')
+
+
+def test_parts_read_back_as_the_whole_table():
+    df = create_records()
+    whole = read_parquet(write_whole(df))
+    parts = read_parquet(write_in_parts(df, 2))
+    # categories are in the order they were first seen
+    pd.testing.assert_frame_equal(whole, parts, check_categorical=False)
@@ -0,0 +1,68 @@
+#!/usr/bin/env
+
+import sys
+import json
+import pandas as pd
+import storage
+
+# process_company_data creates its filesystem from the S3 keys in argv on
+# import, the local backend needs neither
+storage.STORAGE_BACKEND = 'local'
+argv = sys.argv
+sys.argv = [argv[0], '', '']
+try:
+    from process_company_data import (read_psc_json_delta,
+                                      reuse_previous_records)
+finally:
+    sys.argv = argv
+
+
+def create_line(company_number, etag, name):
+    return json.dumps({
+        'company_number': company_number,
+        'data': {
+            'etag': etag,
+            'kind': 'individual-person-with-significant-control',
+            'name': name
+        }
+    })
+
+
+# the second record is repeated further down the snapshot
+SNAPSHOT = [
+    create_line('00000001', 'a', 'Jane Smith'),
+    create_line('00000002', 'b', 'John Smith'),
+    create_line('00000003', 'c', 'Jo Bloggs'),
+    create_line('00000002', 'b', 'John Smith'),
+    json.dumps({'data': {'persons_of_significant_control_count': 4}})
+]
+
+
+def create_previous_records(rows):
+    return pd.DataFrame(
+        rows, columns=['company_number', 'etag', 'name'], dtype=object)
+
+
+def test_repeated_lines_are_all_unchanged():
+    previous_keys = {('00000001', 'a'), ('00000002', 'b')}
+    delta, unchanged = read_psc_json_delta(SNAPSHOT, previous_keys)
+    assert unchanged == {('00000001', 'a'): [0], ('00000002', 'b'): [1, 3]}
+    assert list(delta.index) == [2, 4]
+
+
+def test_repeated_lines_reuse_a_row_each():
+    # whether or not the previous run had the repeated line
+    _, unchanged = read_psc_json_delta(
+        SNAPSHOT, {('00000001', 'a'), ('00000002', 'b')})
+    for previous_rows in [[('00000001', 'a', 'Jane Smith'),
+                           ('00000002', 'b', 'John Smith')],
+                          [('00000001', 'a', 'Jane Smith'),
+                           ('00000002', 'b', 'John Smith'),
+                           ('00000002', 'b', 'John Smith')]]:
+        reused = reuse_previous_records(
+            create_previous_records(previous_rows), unchanged)
+        reused = reused.sort_values('snapshot_line')
+        assert list(reused.snapshot_line) == [0, 1, 3]
+        assert list(reused.company_number) == [
+            '00000001', '00000002', '00000002'
+        ]
@@ -0,0 +1,331 @@
+#!/usr/bin/env
+
+from itertools import chain
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_categorical_dtype
+
+
+def create_join_ids(first_names, surnames, month_year_births):
+    # column-wise equivalent of applying the old per-row create_join_id,
+    # rows missing any of the three values get NaN
+    output = pd.Series(np.nan, index=first_names.index, dtype=object)
+    valid = (first_names.notnull() & surnames.notnull()
+             & month_year_births.notnull())
+    if not valid.any():
+        return output
+    first_name = first_names[valid].str.split(' ', n=1).str[0]
+    month_year = format_month_year(month_year_births[valid])
+    join_id = first_name + '-' + surnames[valid] + '_' + month_year
+    join_id = join_id.str.strip('-_ ')
+    join_id = join_id.str.upper()
+    join_id = join_id.str.replace(' ', '')
+    output[valid] = join_id
+    return output
+
+
+def format_month_year(dates):
+    # strftime each distinct date once, there are only a few thousand
+    unique_dates = pd.Series(dates.unique())
+    month_year_map = pd.Series(
+        unique_dates.dt.strftime('%Y-%m').values, index=unique_dates)
+    return dates.map(month_year_map)
+
+
+def parse_dates(s, format=None, function=None):
+    # pd.to_datetime of each distinct value of s once, with the results
+    # broadcast back through the factorized codes. function (taking and
+    # returning a Series) prepares the distinct values for parsing. Missing
+    # values and those that don't parse become NaT
+    if is_categorical_dtype(s):
+        codes, uniques = s.cat.codes.values, s.cat.categories
+    else:
+        codes, uniques = pd.factorize(s)
+    uniques = pd.Series(uniques)
+    if function is not None:
+        uniques = function(uniques)
+    dates = pd.to_datetime(uniques, format=format, errors='coerce')
+    return pd.Series(
+        np.append(dates.values, np.datetime64('NaT'))[codes],
+        index=s.index,
+        name=s.name)
+
+
+def create_month_year_births(years, months):
+    # first day of the month of birth from the year and month columns of
+    # the PSC snapshot, NaT where either is missing, isn't a whole number or
+    # is out of range
+    index = years.index
+    years = pd.to_numeric(years, errors='coerce').values.astype(float)
+    months = pd.to_numeric(months, errors='coerce').values.astype(float)
+    # months since 0000-01, for those in the range of datetime64[ns]
+    months_since = years * 12 + months - 1
+    valid = ((years == np.floor(years)) & (months == np.floor(months))
+             & (months >= 1) & (months <= 12)
+             & (months_since >= 1677 * 12 + 9)
+             & (months_since <= 2262 * 12 + 3))
+    output = np.full(len(years), np.datetime64('NaT'), dtype='M8[ns]')
+    output[valid] = (months_since[valid].astype(np.int64) -
+                     1970 * 12).astype('M8[M]')
+    return pd.Series(output, index=index)
+
+
+# intervals are placed on one line of days, each key's in its own span of
+# this many days (about 2,900 years), so the intervals of different keys
+# never overlap. See create_interval_index
+INTERVAL_KEY_SPAN = 2**20
+
+
+def create_interval_index(keys, starts, ends):
+    # date intervals of each key, searched by count_overlapping_intervals. A
+    # missing start or end leaves the interval open on that side. Intervals
+    # with no key or ending before they start are dropped
+    keys = pd.Series(np.asarray(keys, dtype=object))
+    valid = (keys.notnull().values
+             & ~(pd.Series(ends).values < pd.Series(starts).values))
+    key_values = pd.Index(keys[valid].unique())
+    codes = key_values.get_indexer(keys[valid])
+    return {
+        'keys': key_values,
+        'starts': np.sort(
+            interval_positions(codes, pd.Series(starts)[valid], 0)),
+        'ends': np.sort(
+            interval_positions(codes, pd.Series(ends)[valid],
+                               INTERVAL_KEY_SPAN - 1))
+    }
+
+
+def interval_positions(codes, dates, fill):
+    # position of dates in the span of their key codes, fill for missing
+    # dates
+    days = np.asarray(dates, dtype='M8[ns]').astype('M8[D]').astype(np.int64)
+    days = np.clip(days + INTERVAL_KEY_SPAN // 2, 0, INTERVAL_KEY_SPAN - 1)
+    days[pd.isnull(np.asarray(dates, dtype='M8[ns]'))] = fill
+    return np.asarray(codes, dtype=np.int64) * INTERVAL_KEY_SPAN + days
+
+
+def count_overlapping_intervals(index, keys, starts, ends):
+    # for each row, the number of intervals of its key overlapping the
+    # period from its start to its end, without pairing rows and intervals:
+    # those starting by the period's end less those ending before its start.
+    # A missing end leaves the period open, rows with a missing key or start
+    # match nothing
+    codes = index['keys'].get_indexer(pd.Series(np.asarray(keys,
+                                                           dtype=object)))
+    found = np.flatnonzero((codes >= 0) & pd.notnull(np.asarray(starts)))
+    output = np.zeros(len(codes), dtype=np.int64)
+    period_starts = interval_positions(
+        codes[found], np.asarray(starts, dtype='M8[ns]')[found], 0)
+    period_ends = interval_positions(
+        codes[found], np.asarray(ends, dtype='M8[ns]')[found],
+        INTERVAL_KEY_SPAN - 1)
+    output[found] = np.maximum(
+        np.searchsorted(index['starts'], period_ends, side='right') -
+        np.searchsorted(index['ends'], period_starts, side='left'), 0)
+    return output
+
+
+def flag_any_country_in(df, columns, countries):
+    # True where any of columns holds one of countries. Each distinct value
+    # of a column is looked up in the set once and the result is broadcast
+    # back through the factorized codes, missing values never match
+    countries = frozenset(countries)
+    output = np.zeros(len(df), dtype=bool)
+    for col in columns:
+        codes, uniques = pd.factorize(df[col])
+        matches = np.array([x in countries for x in uniques] + [False],
+                           dtype=bool)
+        output |= matches[codes]
+    return pd.Series(output, index=df.index)
+
+
+def explode_list_column(df, list_col, output_col, keep_cols):
+    # one output row per item of the lists in list_col, with keep_cols
+    # repeated alongside, rows where list_col is missing are dropped
+    temp_df = df[keep_cols + [list_col]].dropna(subset=[list_col])
+    lists = temp_df[list_col].values
+    lengths = np.array([len(x) for x in lists], dtype=np.int64)
+    output = {
+        col: np.repeat(temp_df[col].values, lengths)
+        for col in keep_cols
+    }
+    output[output_col] = np.array(
+        list(chain.from_iterable(lists)), dtype=object)
+    return pd.DataFrame(output, columns=keep_cols + [output_col])
+
+
+def join_distinct_values(df, key, separator=' | '):
+    # one row per distinct value of column key, sorted like a groupby, with
+    # the distinct values of each other column for that key joined by
+    # separator in the order they first appear. Missing and empty values are
+    # left out, keys with none get ''. Rows with a missing key are dropped
+    key_codes, keys = pd.factorize(df[key], sort=True)
+    output = {key: keys}
+    for col in df.columns.drop(key):
+        output[col] = join_distinct_column(key_codes, len(keys), df[col],
+                                           separator)
+    return pd.DataFrame(output, columns=df.columns)
+
+
+def join_distinct_column(key_codes, nkeys, s, separator):
+    codes, uniques = pd.factorize(s)
+    uniques = np.asarray(uniques, dtype=object)
+    codes[np.append(uniques == '', False)[codes]] = -1
+    rows = np.flatnonzero((key_codes >= 0) & (codes >= 0))
+    # first row of each distinct key and value pair, grouped by key with a
+    # stable sort so each key's values keep the order they appear in
+    pairs = key_codes[rows].astype(np.int64) * len(uniques) + codes[rows]
+    rows = rows[~pd.Series(pairs).duplicated().values]
+    rows = rows[np.argsort(key_codes[rows], kind='mergesort')]
+    row_keys = key_codes[rows]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = row_keys[1:] != row_keys[:-1]
+    starts = np.flatnonzero(first)
+    pieces = uniques[codes[rows]]
+    pieces[~first] = np.add(separator, pieces[~first])
+    output = np.full(nkeys, '', dtype=object)
+    if len(rows):
+        output[row_keys[starts]] = np.add.reduceat(pieces, starts)
+    return output
+
+
+def encode_values(s, codes):
+    # integer code for every value of s from the codes dict, values not yet
+    # in codes are added to it with the next free code
+    local_codes, uniques = pd.factorize(s)
+    for value in uniques:
+        if value not in codes:
+            codes[value] = len(codes)
+    mapping = np.array([codes[x] for x in uniques] + [-1], dtype=np.int32)
+    return pd.Series(mapping[local_codes], index=s.index)
+
+
+def create_type_codes(company_numbers):
+    # the two letter prefix of each company number as a categorical, 'EAW'
+    # for English and Welsh companies whose numbers are all digits. The
+    # digit check runs once per distinct prefix
+    return map_categories(company_numbers.str[:2],
+                          lambda x: x.where(~x.str.isdigit(), 'EAW'))
+
+
+# base 37 digit of each ASCII character of a company number, -1 for those
+# that can't appear in one
+COMPANY_NUMBER_DIGITS = np.full(128, -1, dtype=np.int8)
+COMPANY_NUMBER_DIGITS[0] = 0
+COMPANY_NUMBER_DIGITS[ord('0'):ord('9') + 1] = np.arange(1, 11)
+COMPANY_NUMBER_DIGITS[ord('A'):ord('Z') + 1] = np.arange(11, 37)
+
+
+def encode_company_numbers(company_numbers):
+    # packs company numbers, e.g. 01234567, SC123456 or OC301234, into int64
+    # codes as eight base 37 digits over 0-9 and A-Z with blank padding, so
+    # equal numbers get equal codes and joins and membership tests compare
+    # integers. Missing numbers and those longer than eight characters or
+    # with other characters get -1, which matches nothing
+    if is_categorical_dtype(company_numbers):
+        codes = encode_company_numbers(
+            pd.Series(company_numbers.cat.categories))
+        return np.append(codes, -1)[company_numbers.cat.codes.values]
+    # fixed width unicode, one code point per uint32 with the ninth only set
+    # for longer numbers
+    points = np.asarray(
+        company_numbers.values,
+        dtype='U9').view(np.uint32).reshape(len(company_numbers), 9)
+    digits = COMPANY_NUMBER_DIGITS[np.minimum(points[:, :8], 127)]
+    invalid = (company_numbers.isnull().values | (points[:, 0] == 0)
+               | (points[:, 8] != 0) | (digits.min(axis=1) < 0))
+    codes = np.zeros(len(company_numbers), dtype=np.int64)
+    for i in range(8):
+        codes *= 37
+        codes += digits[:, i]
+    codes[invalid] = -1
+    return codes
+
+
+def create_company_index(codes):
+    # sorted distinct codes from encode_company_numbers, built once and
+    # searched by in_company_index
+    codes = np.asarray(codes)
+    return np.unique(codes[codes >= 0])
+
+
+def in_company_index(codes, index):
+    return company_index_positions(codes, index) >= 0
+
+
+def company_index_positions(codes, index):
+    # position in the sorted index of each code, -1 where it isn't there. The
+    # codes are binary searched in sorted order, which keeps each search
+    # close to the last in memory
+    codes = np.asarray(codes)
+    output = np.full(len(codes), -1, dtype=np.int64)
+    if len(index) == 0:
+        return output
+    order = np.argsort(codes)
+    sorted_codes = codes[order]
+    positions = np.minimum(
+        np.searchsorted(index, sorted_codes), len(index) - 1)
+    found = index[positions] == sorted_codes
+    output[order[found]] = positions[found]
+    return output
+
+
+def read_csv_columns(f, keep_column, categorical_column, **kwargs):
+    # reads the columns of a CSV for whose header keep_column is true,
+    # parsing those for which categorical_column is also true straight into
+    # categoricals and the rest as strings. The header is read first so f
+    # must be seekable
+    header = pd.read_csv(f, nrows=0).columns
+    f.seek(0)
+    columns = [x for x in header if keep_column(x)]
+    return pd.read_csv(
+        f,
+        usecols=columns,
+        dtype={
+            x: 'category' if categorical_column(x) else str
+            for x in columns
+        },
+        **kwargs)
+
+
+def to_categoricals(df, columns):
+    # converts those of columns present in df to categoricals in place
+    for col in columns:
+        if col in df.columns and not is_categorical_dtype(df[col]):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def map_categories(s, function, fill_value=None):
+    # applies function (taking and returning a Series) to each distinct value
+    # of s once and broadcasts the results back through the category codes,
+    # the output is categorical too. Missing values become fill_value
+    if not is_categorical_dtype(s):
+        s = s.astype('category')
+    categories = pd.Series(s.cat.categories, dtype=object)
+    mapped = pd.Series(
+        list(function(categories)) + [fill_value], dtype=object)
+    mapped_codes, mapped_categories = pd.factorize(mapped)
+    return pd.Series(
+        pd.Categorical.from_codes(mapped_codes[s.cat.codes.values],
+                                  mapped_categories),
+        index=s.index,
+        name=s.name)
+
+
+def concat_categoricals(frames, **kwargs):
+    # pd.concat turns categoricals whose categories differ between frames
+    # into objects, so every frame is first given the union of the
+    # categories of each categorical column
+    columns = [
+        col for col in frames[0].columns
+        if is_categorical_dtype(frames[0][col])
+    ] if frames else []
+    for col in columns:
+        categories = pd.Index(
+            list(
+                chain.from_iterable(
+                    frame[col].cat.categories for frame in frames))).unique()
+        for frame in frames:
+            frame[col] = frame[col].cat.set_categories(categories)
+    return pd.concat(frames, **kwargs)